@@ -0,0 +1,74 @@
+"""
+Per-message cost of
+:meth:`pseud.auth.CurveWithUntrustedKeyForServer.is_authenticated` for a
+growing number of authenticated peers, compared to the former scan of
+trusted keys.
+
+Run from the repository root::
+
+    python -m benchmarks.auth
+"""
+from __future__ import print_function
+import functools
+import timeit
+
+import zmq
+from zmq.utils import z85
+
+from pseud.auth import CurveWithUntrustedKeyForServer
+from pseud.cache import PeerStateStore
+
+NUMBER = 1000
+
+
+def scan_is_authenticated(backend, user_id):
+    result = False
+    if user_id in backend.trusted_keys:
+        result = True
+    try:
+        if z85.decode(user_id) in backend.trusted_keys:
+            result = True
+    except ValueError:
+        pass
+    if user_id in backend.trusted_keys.values():
+        result = True
+    return result
+
+
+class FakeRPC(object):
+    """
+    Tables of peers are all the backend needs to trust keys.
+    """
+    def __init__(self):
+        self.peers = PeerStateStore()
+
+
+def measure(func):
+    return min(timeit.repeat(func, number=NUMBER, repeat=3)) / NUMBER
+
+
+def main():
+    backend = CurveWithUntrustedKeyForServer(FakeRPC())
+    print('{:>8}{:>14}{:>14}{:>14}{:>14}'.format(
+        'peers', 'scan key', 'index key', 'scan login', 'index login'))
+    for peers in (10, 1000, 10000, 100000):
+        while len(backend.trusted_keys) < peers:
+            key = z85.decode(zmq.curve_keypair()[0])
+            backend.trust_key(key, 'user-{}'.format(len(backend.trusted_keys))
+                              .encode())
+        # worst case for the scan: the most recently authenticated peer
+        key = z85.encode(key)
+        login = backend.trusted_keys[z85.decode(key)]
+        timings = [
+            measure(functools.partial(scan_is_authenticated, backend, key)),
+            measure(functools.partial(backend.is_authenticated, key)),
+            measure(functools.partial(scan_is_authenticated, backend,
+                                      login)),
+            measure(functools.partial(backend.is_authenticated, login)),
+        ]
+        print('{:>8}'.format(peers) + ''.join(
+            '{:>12.3f}us'.format(timing * 1e6) for timing in timings))
+
+
+if __name__ == '__main__':
+    main()
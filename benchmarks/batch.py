@@ -0,0 +1,82 @@
+"""
+Calls per second through a gevent client and server, each call sent in
+its own WORK message compared to batches of calls sent with
+:meth:`pseud.common.BaseRPC.batch`, run one after the other or
+concurrently by the server. At most ``IN_FLIGHT`` calls are pending.
+
+Run from the repository root::
+
+    python -m benchmarks.batch
+
+gevent is required.
+"""
+from __future__ import division, print_function
+import time
+
+import gevent
+
+from pseud._gevent import Client, Server
+
+CALLS = 20000
+# calls waited for together, below the high water mark of sockets
+IN_FLIGHT = 1000
+BATCH_SIZES = (10, 100, 1000)
+
+
+def echo(value):
+    return value
+
+
+def unbatched(client, count):
+    for _ in range(count // IN_FLIGHT):
+        futures = [client.echo(i) for i in range(IN_FLIGHT)]
+        gevent.joinall(futures, raise_error=True)
+
+
+def batched(size):
+    def run(client, count):
+        for _ in range(count // IN_FLIGHT):
+            futures = []
+            for start in range(0, IN_FLIGHT, size):
+                with client.batch() as batch:
+                    futures.extend(batch.echo(i)
+                                   for i in range(start, start + size))
+            gevent.joinall(futures, raise_error=True)
+    return run
+
+
+def measure(endpoint, func, concurrent_batches=False):
+    server = Server(b'server', concurrent_batches=concurrent_batches)
+    server.register_rpc(echo)
+    server.bind(endpoint)
+    server.start()
+    client = Client(b'server', timeout=60)
+    client.connect(endpoint)
+    client.start()
+    try:
+        # warm up connection and handshake
+        client.echo(None).get()
+        started = time.time()
+        func(client, CALLS)
+        return CALLS / (time.time() - started)
+    finally:
+        client.stop()
+        server.stop()
+
+
+def main():
+    candidates = [('unbatched', unbatched, False)]
+    for size in BATCH_SIZES:
+        candidates.append(('batch {}'.format(size), batched(size), False))
+        candidates.append(('batch {} conc.'.format(size), batched(size),
+                           True))
+    print('{:<18}{:>14}'.format('calls', 'calls/s'))
+    for index, (name, func, concurrent_batches) in enumerate(candidates):
+        # servers of a process can not share an inproc endpoint
+        endpoint = 'ipc:///tmp/pseud-batch-{}'.format(index)
+        print('{:<18}{:>14.0f}'.format(
+            name, measure(endpoint, func, concurrent_batches)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+ZAP requests answered per second by
+:class:`pseud.auth.CurveWithCertificatesForServer` with a large
+certificates directory, compared to decoding every known key for each
+request as :class:`pseud.auth.CurveWithTrustedKeyForServer` does.
+Also reports the time to load the directory.
+
+Run from the repository root::
+
+    python -m benchmarks.certificates [number of certificates]
+"""
+from __future__ import division, print_function
+import os
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+
+import zmq
+from zmq.utils import z85
+
+from pseud.auth import CurveWithCertificatesForServer, load_certificates
+
+
+class FakeZapSocket(object):
+    def send_multipart(self, message):
+        self.reply = message
+
+
+class FakeRPC(object):
+    def __init__(self, certificates_directory):
+        self.certificates_directory = certificates_directory
+
+    def forget_identity(self, routing_id=None):
+        pass
+
+
+def write_certificates(directory, count):
+    for index in range(count):
+        public_key, _ = zmq.curve_keypair()
+        with open(os.path.join(directory,
+                               'peer-{}.key'.format(index)), 'wb') as f:
+            f.write(b'metadata\ncurve\n    public-key = "' + public_key +
+                    b'"\n')
+    return public_key
+
+
+def scan(known_identities, key):
+    for identity, public_key in known_identities.items():
+        if key == z85.decode(public_key):
+            return identity
+
+
+def zap_request(key):
+    return [b'zid', b'', b'1.0', b'1', b'', b'127.0.0.1', b'', b'CURVE',
+            key]
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    count = int(argv[0]) if argv else 100000
+    directory = tempfile.mkdtemp()
+    try:
+        last_key = z85.decode(write_certificates(directory, count))
+
+        start = time.time()
+        backend = CurveWithCertificatesForServer(FakeRPC(directory))
+        backend.reload()
+        print('loaded {} certificates in {:.3f}s'.format(
+            len(backend.certificates), time.time() - start))
+
+        backend.zap_socket = FakeZapSocket()
+        number = 100000
+        elapsed = min(timeit.repeat(
+            lambda: backend._zap_handler(zap_request(last_key)),
+            number=number, repeat=3))
+        assert backend.zap_socket.reply[4] == b'200'
+        print('indexed: {:>12.0f} requests/s'.format(number / elapsed))
+
+        known_identities = {identity: z85.encode(key) for key, identity in
+                            load_certificates(directory).items()}
+        number = 3
+        elapsed = min(timeit.repeat(
+            lambda: scan(known_identities, last_key),
+            number=number, repeat=3))
+        print('scan:    {:>12.0f} requests/s'.format(number / elapsed))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+Latency of sending a msgpack body, with and without zlib compression,
+for growing payloads. Latency is the time to pack, and compress, plus the
+time to transfer the body at given bandwidth plus the time to unpack it.
+The crossover is the smallest body size for which compression pays off,
+a good value for ``compression_threshold``.
+
+Run from the repository root::
+
+    python -m benchmarks.compression
+"""
+from __future__ import print_function
+import functools
+import timeit
+
+from pseud.packer import Packer
+
+# bytes per second
+BANDWIDTHS = (
+    ('100Mbit', 100e6 / 8),
+    ('1Gbit', 1e9 / 8),
+    ('10Gbit', 10e9 / 8),
+)
+
+
+def make_payload(records):
+    return [{'id': i, 'name': 'user-{}'.format(i), 'active': bool(i % 2),
+             'score': i * .5, 'tags': ['a', 'b', 'c']}
+            for i in range(records)]
+
+
+def measure(func):
+    number = 10
+    return min(timeit.repeat(func, number=number, repeat=3)) / number
+
+
+def main():
+    plain = Packer()
+    zlib = Packer(compression='zlib', compression_threshold=0)
+    crossovers = {}
+    print('{:>10}{:>12}{:>12}{:>12}{:>12}'.format(
+        'body', 'zlib body', 'pack', 'zlib pack', 'zlib unpack'))
+    for records in (10, 100, 1000, 10000, 100000):
+        payload = make_payload(records)
+        packed = plain.packb(payload)
+        compressed = zlib.packb(payload)
+        pack = measure(functools.partial(plain.packb, payload))
+        unpack = measure(functools.partial(plain.unpackb, packed))
+        zlib_pack = measure(functools.partial(zlib.packb, payload))
+        zlib_unpack = measure(functools.partial(zlib.unpackb, compressed))
+        print('{:>10}{:>12}{:>10.3f}ms{:>10.3f}ms{:>10.3f}ms'.format(
+            len(packed), len(compressed), pack * 1e3, zlib_pack * 1e3,
+            zlib_unpack * 1e3))
+        for name, bandwidth in BANDWIDTHS:
+            latency = pack + len(packed) / bandwidth + unpack
+            zlib_latency = (zlib_pack + len(compressed) / bandwidth +
+                            zlib_unpack)
+            if zlib_latency < latency and name not in crossovers:
+                crossovers[name] = len(packed)
+    print()
+    for name, bandwidth in BANDWIDTHS:
+        print('{:>8}: compression pays off from {} bytes'.format(
+            name, crossovers.get(name, 'never')))
+
+
+if __name__ == '__main__':
+    main()
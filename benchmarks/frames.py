@@ -0,0 +1,89 @@
+"""
+Cost of parsing the header frames of an incoming message and dispatching
+it, fed with synthetic :class:`zmq.Frame` instead of a socket.
+``map(bytes)`` and the if/elif chain are the former implementation of
+:meth:`pseud.common.BaseRPC.on_socket_ready`.
+
+Run from the repository root::
+
+    python -m benchmarks.frames
+"""
+from __future__ import print_function
+import timeit
+
+import zmq
+
+from pseud.common import _frame_bytes
+from pseud.interfaces import (AUTHENTICATED, EMPTY_DELIMITER, ERROR,
+                              HEARTBEAT, HELLO, OK, UNAUTHORIZED, VERSION,
+                              WORK)
+
+NUMBER = 50000
+
+
+def noop(*args):
+    pass
+
+
+HANDLERS = {message_type: noop
+            for message_type in (WORK, OK, ERROR, AUTHENTICATED,
+                                 UNAUTHORIZED, HELLO, HEARTBEAT)}
+
+
+def make_frames(message_type):
+    return [zmq.Frame(frame) for frame in (
+        b'client-routing-id', EMPTY_DELIMITER, VERSION,
+        b'0123456789abcdef', message_type, b'\x93\xa4ping\x90\x80')]
+
+
+def chain_parse(response):
+    routing_id, delimiter, version, message_uuid, message_type = map(
+        bytes, response[:5])
+    frames = response[5:]
+    message, buffers = frames[0], frames[1:]
+    if message_type == WORK:
+        noop(message, routing_id, message_uuid, buffers, version)
+    elif message_type == OK:
+        noop(message, message_uuid, buffers, version)
+    elif message_type == ERROR:
+        noop(message, message_uuid, version)
+    elif message_type == AUTHENTICATED:
+        noop(message)
+    elif message_type == UNAUTHORIZED:
+        noop(routing_id, message_uuid)
+    elif message_type == HELLO:
+        noop(routing_id, message_uuid, message)
+    elif message_type == HEARTBEAT:
+        pass
+
+
+def table_parse(response):
+    routing_id = _frame_bytes(response[0])
+    version = _frame_bytes(response[2])
+    message_uuid = _frame_bytes(response[3])
+    message_type = _frame_bytes(response[4])
+    message, buffers = response[5], response[6:]
+    HANDLERS[message_type](None, message, routing_id, b'', message_uuid,
+                           buffers, version)
+
+
+def measure(func, message_type, number=NUMBER, repeat=3):
+    # Frame.bytes is cached, fresh frames are needed for every call
+    frames = iter([make_frames(message_type)
+                   for _ in range(number * repeat)])
+    return min(timeit.repeat(lambda: func(next(frames)), number=number,
+                             repeat=repeat)) / number
+
+
+def main():
+    print('{:<16}{:>14}{:>14}'.format('message type', 'map + chain',
+                                      'table'))
+    for name, message_type in (('WORK', WORK), ('OK', OK),
+                               ('HEARTBEAT', HEARTBEAT)):
+        print('{:<16}{:>12.3f}us{:>12.3f}us'.format(
+            name, measure(chain_parse, message_type) * 1e6,
+            measure(table_parse, message_type) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Memory used by many in-flight calls, each one a
+:class:`pseud.common.PendingCall` record linked to its future, compared
+to the former pair of ``future_pool`` and ``future_routes`` entries with
+a ``functools.partial`` cleanup callback.
+:meth:`pseud.common.BaseRPC.in_flight_memory` is printed as well.
+
+Run from the repository root::
+
+    python -m benchmarks.in_flight
+
+Allocations are measured with :mod:`tracemalloc`, python 3 and gevent
+are required.
+"""
+from __future__ import division, print_function
+import functools
+import gc
+import tracemalloc
+
+import gevent.event
+
+from pseud._gevent import Client
+from pseud.common import message_ids
+
+IN_FLIGHT = (10000, 100000)
+
+
+def former_calls(client, count):
+    ids = message_ids()
+    future_routes = {}
+    for _ in range(count):
+        uid = next(ids)
+        client.future_pool[uid] = future = gevent.event.AsyncResult()
+        future_routes[uid] = b'server'
+        client.timers.add(uid, client.timeout)
+        future.rawlink(functools.partial(client.cleanup_future, uid))
+    return future_routes
+
+
+def record_calls(client, count):
+    ids = message_ids()
+    for _ in range(count):
+        future = gevent.event.AsyncResult()
+        call = client.add_pending_call(next(ids), future, None, b'server')
+        future.rawlink(call)
+
+
+def measure(func, count):
+    """
+    Returns bytes still allocated by func, and the estimate of the client
+    when calls are records.
+    """
+    client = Client(b'server')
+    # no tick is needed, timers are only stored
+    client._timer_scheduled = True
+    gc.collect()
+    tracemalloc.start()
+    try:
+        kept = func(client, count)
+        current, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    if kept is not None:
+        return current, None
+    return current, client.in_flight_memory()['bytes']
+
+
+def main():
+    print('{:<10}{:>10}{:>16}{:>20}'.format(
+        'calls', 'in-flight', 'traced bytes', 'in_flight_memory'))
+    for count in IN_FLIGHT:
+        for name, func in (('former', former_calls),
+                           ('records', record_calls)):
+            traced, reported = measure(func, count)
+            print('{:<10}{:>10}{:>14.0f}/c{:>20}'.format(
+                name, count, traced / count,
+                '-' if reported is None
+                else '{:.0f}/c'.format(reported / count)))
+
+
+if __name__ == '__main__':
+    main()
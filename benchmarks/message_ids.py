@@ -0,0 +1,44 @@
+"""
+Cost of generating the id of a request, and of preparing a request
+with :meth:`pseud.common.BaseRPC._prepare_work`, with the counter based
+ids of :func:`pseud.common.message_ids` and the former ``uuid4``.
+
+Run from the repository root::
+
+    python -m benchmarks.message_ids
+"""
+from __future__ import print_function
+import timeit
+import uuid
+
+from pseud import Client
+from pseud.common import message_ids
+
+NUMBER = 100000
+
+
+def uuid4_ids():
+    while True:
+        yield uuid.uuid4().bytes
+
+
+def measure(func, number=NUMBER):
+    return min(timeit.repeat(func, number=number, repeat=3)) / number
+
+
+def main():
+    client = Client(b'server')
+    print('{:<10}{:>8}{:>14}{:>18}'.format('ids', 'size', 'id',
+                                           'prepared calls/s'))
+    for name, factory in (('uuid4', uuid4_ids), ('counter', message_ids)):
+        ids = factory()
+        client.message_ids = factory()
+        prepare = measure(lambda: client._prepare_work(None, 'service.ping',
+                                                       1, 2))
+        print('{:<10}{:>8}{:>12.3f}us{:>18.0f}'.format(
+            name, len(next(ids)), measure(lambda: next(ids)) * 1e6,
+            1 / prepare))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Per-message cost of :class:`pseud.packer.Packer` on small rpc payloads,
+compared to calling module level msgpack functions for every message.
+
+Run from the repository root::
+
+    python -m benchmarks.packer
+"""
+from __future__ import print_function
+import datetime
+import functools
+import timeit
+
+import msgpack
+
+from pseud.packer import Packer
+
+NUMBER = 100000
+
+PAYLOADS = {
+    'scalar call': ('service.ping', (1,), {}),
+    'small call': ('service.update', (42, 'name', 3.14),
+                   {'flag': True, 'tags': ['a', 'b']}),
+    'datetime call': ('service.at', (datetime.datetime(2014, 9, 1, 12),),
+                      {}),
+}
+
+
+def module_level_packb(packer, data):
+    return msgpack.packb(data, encoding='utf-8', use_bin_type=True,
+                         default=packer.ext_type_pack_hook)
+
+
+def module_level_unpackb(packer, packed):
+    return msgpack.unpackb(packed, use_list=False, encoding='utf-8',
+                           ext_hook=packer.ext_type_unpack_hook)
+
+
+def measure(func, number=NUMBER):
+    return min(timeit.repeat(func, number=number, repeat=3)) / number
+
+
+def main():
+    packer = Packer()
+    print('{:<16}{:>14}{:>14}{:>14}{:>14}'.format(
+        'payload', 'packb module', 'packb reuse', 'unpackb mod.',
+        'unpackb'))
+    for name, payload in sorted(PAYLOADS.items()):
+        packed = packer.packb(payload)
+        timings = (
+            measure(functools.partial(module_level_packb, packer, payload)),
+            measure(functools.partial(packer.packb, payload)),
+            measure(functools.partial(module_level_unpackb, packer,
+                                      packed)),
+            measure(functools.partial(packer.unpackb, packed)),
+        )
+        print('{:<16}'.format(name) + ''.join(
+            '{:>12.3f}us'.format(timing * 1e6) for timing in timings))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""
+Throughput and allocations of :class:`pseud.packer.Packer` for typical
+payload shapes. Results are written as JSON, to compare releases::
+
+    python -m benchmarks.serialization > before.json
+    python -m benchmarks.serialization --table
+
+Allocations are measured with :mod:`tracemalloc`, on python 3 only.
+"""
+from __future__ import division, print_function
+import argparse
+import datetime
+import functools
+import gc
+import json
+import platform
+import sys
+import timeit
+
+import msgpack
+
+from pseud.packer import Packer
+
+try:
+    import tracemalloc
+except ImportError:  # pragma: no cover
+    tracemalloc = None
+
+
+def make_payloads():
+    now = datetime.datetime(2014, 9, 1, 12, 30)
+    return {
+        'scalar': ('service.ping', (1,), {}),
+        'nested dict': ('service.update', (), {
+            'user': {'id': 42, 'name': 'Marie', 'roles': ['admin', 'dev'],
+                     'profile': {'lang': 'fr', 'tz': 'Europe/Paris',
+                                 'scores': {'a': 1.5, 'b': 2.5}}}}),
+        'large list': ('service.store', (list(range(100000)),), {}),
+        'bytes blob': ('service.upload', (b'x' * (1 << 20),), {}),
+        'datetime records': ('service.log', ([
+            {'at': now + datetime.timedelta(seconds=i),
+             'day': now.date(),
+             'took': datetime.timedelta(milliseconds=i)}
+            for i in range(1000)],), {}),
+    }
+
+
+def measure(func, number):
+    return min(timeit.repeat(func, number=number, repeat=3)) / number
+
+
+def allocations(func):
+    """
+    Returns count and size of the blocks still allocated
+    after one call, and peak size allocated during the call.
+    """
+    if tracemalloc is None:
+        return None
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        result = func()
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    del result
+    stats = after.compare_to(before, 'filename')
+    return {
+        'blocks': sum(stat.count_diff for stat in stats),
+        'bytes': sum(stat.size_diff for stat in stats),
+        'peak_bytes': peak,
+    }
+
+
+def run(number):
+    packer = Packer()
+    results = {}
+    for name, payload in sorted(make_payloads().items()):
+        packed = packer.packb(payload)
+        pack = functools.partial(packer.packb, payload)
+        unpack = functools.partial(packer.unpackb, packed)
+        # scale down iterations for large payloads
+        iterations = max(1, number * 64 // max(len(packed), 64))
+        pack_time = measure(pack, iterations)
+        unpack_time = measure(unpack, iterations)
+        results[name] = {
+            'size': len(packed),
+            'packb': {'seconds': pack_time,
+                      'ops_per_second': 1 / pack_time,
+                      'mb_per_second': len(packed) / pack_time / 1e6,
+                      'allocations': allocations(pack)},
+            'unpackb': {'seconds': unpack_time,
+                        'ops_per_second': 1 / unpack_time,
+                        'mb_per_second': len(packed) / unpack_time / 1e6,
+                        'allocations': allocations(unpack)},
+        }
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'msgpack': '.'.join(map(str, msgpack.version)),
+        'results': results,
+    }
+
+
+def print_table(report):
+    print('{:<18}{:>10}{:>12}{:>12}{:>12}{:>12}'.format(
+        'payload', 'size', 'packb', 'unpackb', 'packb MB/s',
+        'unpack MB/s'))
+    for name, result in sorted(report['results'].items()):
+        print('{:<18}{:>10}{:>10.1f}us{:>10.1f}us{:>12.1f}{:>12.1f}'.format(
+            name, result['size'],
+            result['packb']['seconds'] * 1e6,
+            result['unpackb']['seconds'] * 1e6,
+            result['packb']['mb_per_second'],
+            result['unpackb']['mb_per_second']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--number', type=int, default=10000,
+                        help='iterations for the smallest payload')
+    parser.add_argument('--table', action='store_true',
+                        help='human readable output instead of JSON')
+    args = parser.parse_args(argv)
+    report = run(args.number)
+    if args.table:
+        print_table(report)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Cost of arming and cancelling the timeouts of many in-flight calls,
+one timer per call with the event loops as done before, compared to
+the :class:`pseud.timer.TimerWheel` of an RPC instance.
+
+Run from the repository root::
+
+    python -m benchmarks.timers
+
+Allocations are measured with :mod:`tracemalloc`, on python 3 only.
+"""
+from __future__ import division, print_function
+import gc
+import timeit
+
+from pseud.timer import TimerWheel
+
+try:
+    import tracemalloc
+except ImportError:  # pragma: no cover
+    tracemalloc = None
+
+TIMEOUT = 5
+IN_FLIGHT = (1000, 10000, 50000)
+
+
+def noop():
+    pass
+
+
+def tornado_timers(count):
+    from tornado.ioloop import IOLoop
+    io_loop = IOLoop()
+    deadline = io_loop.time() + TIMEOUT
+    timeouts = [io_loop.add_timeout(deadline, noop)
+                for _ in range(count)]
+    for timeout in timeouts:
+        io_loop.remove_timeout(timeout)
+    io_loop.close()
+
+
+def gevent_timers(count):
+    import gevent
+    greenlets = [gevent.spawn_later(TIMEOUT, noop) for _ in range(count)]
+    for greenlet in greenlets:
+        greenlet.kill(block=False)
+
+
+def wheel_timers(count):
+    wheel = TimerWheel()
+    keys = range(count)
+    for key in keys:
+        wheel.add(key, TIMEOUT)
+    for key in keys:
+        wheel.discard(key)
+
+
+def wheel_expire(count):
+    now = [0]
+    wheel = TimerWheel(clock=lambda: now[0])
+    for key in range(count):
+        wheel.add(key, TIMEOUT)
+    now[0] = TIMEOUT
+    assert len(wheel.advance()) == count
+
+
+def peak_allocated(func):
+    if tracemalloc is None:
+        return float('nan')
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def main():
+    candidates = [('timer wheel', wheel_timers),
+                  ('wheel expiry', wheel_expire)]
+    for name, func in (('tornado', tornado_timers),
+                       ('gevent', gevent_timers)):
+        try:
+            func(1)
+        except ImportError:
+            continue
+        candidates.append((name, func))
+    print('{:<14}{:>10}{:>14}{:>14}'.format('timers', 'in-flight',
+                                            'per call', 'peak memory'))
+    for count in IN_FLIGHT:
+        for name, func in candidates:
+            seconds = min(timeit.repeat(lambda: func(count), number=1,
+                                        repeat=3))
+            print('{:<14}{:>10}{:>12.3f}us{:>12.1f}MB'.format(
+                name, count, seconds / count * 1e6,
+                peak_allocated(lambda: func(count)) / 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,7 @@
 import logging
 import os
 import pprint
-import uuid
+import time
 
 from future import standard_library
 import zmq
@@ -10,14 +10,13 @@ import zope.interface
 with standard_library.hooks():
     import builtins
 
-from . import auth, interfaces, heartbeat, predicate  # NOQA
+from . import auth, interfaces, heartbeat, predicate, serializers  # NOQA
 from .common import (BaseRPC,
                      format_remote_traceback,
                      internal_exceptions,
                      )  # NOQA
 from .interfaces import (IClient,
                          TimeoutError,
-                         VERSION,
                          WORK,
                          )  # NOQA
 try:
@@ -50,25 +49,31 @@ class SyncBaseRPC(BaseRPC):
         message, uid = self._prepare_work(name, *args, **kw)
         if logger.isEnabledFor(logging.DEBUG):
             logger.debug('Sending work: {!r} {}'.format(
-                message[:-1],
-                pprint.pformat(self.packer.unpackb(message[-1]))))
-        response = self.send_message(message)
+                message[:3],
+                pprint.pformat(self.packer.unpackb(message[3],
+                                                   message[4:]))))
+        response = self.send_message(message, copy=len(message) == 4)
         return response
 
     def _prepare_work(self, name, *args, **kw):
-        work = self.packer.packb((name, args, kw))
-        uid = uuid.uuid4().bytes
-        message = [VERSION, uid, WORK, work]
+        buffers = []
+        work = self._pack_work(name, args, kw, buffers,
+                               time.time() + self.timeout)
+        uid = next(self.message_ids)
+        message = [self.version, uid, WORK, work]
+        message.extend(buffers)
         return message, uid
 
-    def _handle_ok(self, message, message_uuid):
-        value = self.packer.unpackb(message)
+    def _handle_ok(self, message, message_uuid, buffers=(), version=None):
+        packer = self._serializers[version or self.version]
+        value = packer.unpackb(message, buffers)
         logger.debug('SyncClient result {!r} from {!r}'.format(value,
                                                                message_uuid))
         return value
 
-    def _handle_error(self, message, message_uuid):
-        value = self.packer.unpackb(message)
+    def _handle_error(self, message, message_uuid, version=None):
+        value = self._get_error_serializer(version or self.version).unpackb(
+            message)
         klass, message, traceback = value
         full_message = '\n'.join((format_remote_traceback(traceback),
                                   message))
@@ -85,14 +90,19 @@ class SyncBaseRPC(BaseRPC):
         else:
             raise exception
 
-    def send_message(self, message):
-        self.socket.send_multipart(message)
+    def send_message(self, message, copy=True):
+        self.socket.send_multipart(message, copy=copy)
         try:
             response = self.socket.recv_multipart(copy=False)
         except zmq.Again:
             raise TimeoutError()
         return self.on_socket_ready(response)
 
+    def _reject_serializer(self, message_type, routing_id, message_uuid,
+                           version):
+        raise interfaces.UnsupportedSerializerError(
+            'Serializer {!r} of the reply is not accepted'.format(version))
+
     def _store_result_in_future(self, future, result):
         raise NotImplementedError('SyncClient can not do that')
 
@@ -102,6 +112,13 @@ class SyncBaseRPC(BaseRPC):
     def read_forever(self, socket, callback):
         raise NotImplementedError('SyncClient can not do that')
 
+    def _start_monitor(self):
+        # REQ socket waits for replies synchronously, until timeout
+        pass
+
+    def batch(self, user_id=None):
+        raise NotImplementedError('REQ socket sends one request at a time')
+
     def create_periodic_callback(self, callback, timer):
         raise NotImplementedError('SyncClient can not do that')
 
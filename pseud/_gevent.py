@@ -1,4 +1,3 @@
-import functools
 import logging
 import pprint
 
@@ -34,22 +33,58 @@ class GeventBaseRPC(BaseRPC):
     def _backend_init(self, io_loop=None):
         self.io_loop = None
 
+    def _new_call(self, uid, user_id, routing_id, name=None, deadline=None):
+        future = gevent.event.AsyncResult()
+        future.rawlink(self.add_pending_call(uid, future, user_id,
+                                             routing_id, name, deadline))
+        return future
+
     def send_work(self, user_id, name, *args, **kw):
-        message, uid = self._prepare_work(user_id, name, *args, **kw)
-        self.create_timeout_detector(uid)
+        message, uid, deadline = self._prepare_work(user_id, name, *args,
+                                                    **kw)
+        future = self._new_call(uid, user_id, message[0], name, deadline)
         if logger.isEnabledFor(logging.DEBUG):
             logger.debug('Sending work: {!r} {}'.format(
-                message[:-1],
-                pprint.pformat(self.packer.unpackb(message[-1]))))
+                message[:5],
+                pprint.pformat(self.packer.unpackb(message[5],
+                                                   message[6:]))))
         self.auth_backend.save_last_work(message)
         self.start()
-        self.send_message(message)
-        self.future_pool[uid] = future = gevent.event.AsyncResult()
-        future.rawlink(functools.partial(self.cleanup_future, uid))
+        # out-of-band frames follow the body, they are sent without copy
+        self.send_message(message, copy=len(message) == 6)
         return future
 
-    def send_message(self, message):
-        gevent.spawn(self.socket.send_multipart, message)
+    def _current_job(self):
+        # every message is handled in its own greenlet
+        return gevent.getcurrent()
+
+    def _stop_job(self, job):
+        # jobs of a sequential batch share the greenlet of the batch,
+        # they are only marked
+        if isinstance(job, gevent.Greenlet):
+            job.kill(block=False)
+
+    def _map_jobs(self, func, calls):
+        if not self.concurrent_batches:
+            return [func(call) for call in calls]
+        greenlets = [gevent.spawn(func, call) for call in calls]
+        gevent.joinall(greenlets)
+        return [greenlet.value for greenlet in greenlets]
+
+    def send_message(self, message, copy=True):
+        gevent.spawn(self._send_message, message, copy)
+
+    def _send_message(self, message, copy):
+        try:
+            self.socket.send_multipart(message, copy=copy)
+        except zmq.ZMQError as error:
+            if error.errno != zmq.EHOSTUNREACH:
+                raise
+            # ROUTER does not know yet the recipient
+            self.hold_message(message)
+        else:
+            if message[0] in self.outbox:
+                self.outbox.discard(message[0], message)
 
     def _store_result_in_future(self, future, result):
         future.set(result)
@@ -61,6 +96,7 @@ class GeventBaseRPC(BaseRPC):
             gevent.sleep(.2)
 
     def stop(self):
+        self._stop_monitor()
         if self.reader is not None:
             self.reader.kill()
         if not self.socket.closed:
@@ -80,7 +116,7 @@ class GeventBaseRPC(BaseRPC):
 
     def timeout_task(self, uuid):
         try:
-            self.future_pool[uuid].set_exception(Timeout)
+            self.future_pool[uuid].future.set_exception(Timeout)
         except KeyError:
             pass
 
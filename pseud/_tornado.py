@@ -1,8 +1,7 @@
-from collections import Counter
-import functools
 import logging
 import pprint
 import sys
+import time
 import traceback
 
 from concurrent.futures import TimeoutError
@@ -19,7 +18,7 @@ import zmq
 from zmq.eventloop import ioloop, zmqstream
 import zope.interface
 
-from .common import BaseRPC
+from .common import BaseRPC, CallContext
 from .interfaces import (
     IClient,
     IServer,
@@ -27,18 +26,12 @@ from .interfaces import (
     ERROR,
     OK,
     ServiceNotFoundError,
-    VERSION,
 )
-from .utils import get_rpc_callable
-
 ioloop.install()
 
 logger = logging.getLogger(__name__)
 
 
-MAX_EHOSTUNREACH_RETRY = 3
-
-
 def async_sleep(io_loop, duration):
     return tornado.gen.Task(
         io_loop.add_timeout,
@@ -59,12 +52,13 @@ class TornadoBaseRPC(BaseRPC):
             self.io_loop = io_loop
 
     @tornado.gen.coroutine
-    def _handle_work_proxy(self, locator, args, kw, user_id, message_uuid):
-        worker_callable = get_rpc_callable(
-            locator,
-            registry=self.registry,
-            **self.auth_backend.get_predicate_arguments(user_id))
-        if worker_callable.with_identity:
+    def _handle_work_proxy(self, locator, args, kw, user_id, message_uuid,
+                           deadline=None):
+        worker_callable = self._get_rpc_callable(locator, user_id)
+        if worker_callable.with_context:
+            result = worker_callable(CallContext(user_id, deadline),
+                                     *args, **kw)
+        elif worker_callable.with_identity:
             result = worker_callable(user_id, *args, **kw)
         else:
             result = worker_callable(*args, **kw)
@@ -75,18 +69,17 @@ class TornadoBaseRPC(BaseRPC):
             raise tornado.gen.Return(result)
 
     @tornado.gen.coroutine
-    def _handle_work(self, message, routing_id, user_id, message_uuid):
-        locator, args, kw = self.packer.unpackb(message)
+    def _run_job(self, locator, args, kw, user_id, message_uuid, deadline):
         try:
             try:
                 result = yield self._handle_work_proxy(
-                    locator, args, kw, user_id, message_uuid)
+                    locator, args, kw, user_id, message_uuid, deadline)
             except ServiceNotFoundError:
                 if self.proxy_to is None:
                     raise
                 else:
                     result = yield self.proxy_to._handle_work_proxy(
-                        locator, args, kw, user_id, message_uuid)
+                        locator, args, kw, user_id, message_uuid, deadline)
 
         except Exception:
             logger.exception('Pseud job failed')
@@ -94,50 +87,113 @@ class TornadoBaseRPC(BaseRPC):
             traceback_ = traceback.format_exc()
             name = exc_type.__name__
             message = str(exc_value)
-            result = (name, message, traceback_)
-            status = ERROR
-        else:
-            status = OK
-        response = self.packer.packb(result)
-        message = [routing_id, EMPTY_DELIMITER, VERSION, message_uuid, status,
+            raise tornado.gen.Return((ERROR, (name, message, traceback_)))
+        raise tornado.gen.Return((OK, result))
+
+    @tornado.gen.coroutine
+    def _handle_work(self, message, routing_id, user_id, message_uuid,
+                     buffers=(), version=None):
+        version = version or self.version
+        packer = self._serializers[version]
+        work = self._unpack_work(packer, message, buffers)
+        if work is None:
+            return
+        locator, args, kw, deadline = work
+        job_key = (routing_id, message_uuid)
+        # coroutines can not be interrupted, a cancelled job runs
+        # until it returns but its reply is dropped
+        self.running_jobs[job_key] = True
+        try:
+            status, result = yield self._run_job(locator, args, kw, user_id,
+                                                 message_uuid, deadline)
+        finally:
+            cancelled = self.running_jobs.pop(job_key, None) is None
+        if cancelled:
+            return
+        buffers = []
+        response = packer.packb(packer.mark_out_of_band(result), buffers)
+        message = [routing_id, EMPTY_DELIMITER, version, message_uuid, status,
                    response]
+        message.extend(buffers)
         if logger.isEnabledFor(logging.DEBUG):
             logger.debug('Worker send reply {!r} {}'.format(
-                message[:-1],
+                message[:5],
                 pprint.pformat(result))
             )
-        self.send_message(message)
+        self.send_message(message, copy=not buffers)
+
+    @tornado.gen.coroutine
+    def _run_batched_job(self, routing_id, user_id, deadline, job, call):
+        message_uuid, locator, args, kw = call
+        job_key = (routing_id, message_uuid)
+        if job_key not in self.running_jobs:
+            return
+        if deadline is not None and deadline <= time.time():
+            logger.warning('Batched job {!r} expired, dropped'.format(
+                locator))
+            del self.running_jobs[job_key]
+            return
+        try:
+            status, result = yield self._run_job(locator, args, kw, user_id,
+                                                 message_uuid, deadline)
+        finally:
+            cancelled = self.running_jobs.pop(job_key, None) is None
+        if not cancelled:
+            raise tornado.gen.Return((message_uuid, status, result))
+
+    @tornado.gen.coroutine
+    def _handle_batch(self, message, routing_id, user_id, message_uuid,
+                      buffers=(), version=None):
+        version = version or self.version
+        packer = self._serializers[version]
+        batch = self._unpack_batch(packer, message, buffers)
+        if batch is None:
+            return
+        calls, deadline = batch
+        job = self._start_batch(routing_id, calls)
+        if self.concurrent_batches:
+            results = yield [self._run_batched_job(routing_id, user_id,
+                                                   deadline, job, call)
+                             for call in calls]
+        else:
+            results = []
+            for call in calls:
+                result = yield self._run_batched_job(routing_id, user_id,
+                                                     deadline, job, call)
+                results.append(result)
+        self._send_batch_reply(routing_id, version, message_uuid, results)
 
     def send_work(self, user_id, name, *args, **kw):
         self.start()
-        message, uid = self._prepare_work(user_id, name, *args, **kw)
-        self.future_pool[uid] = future = future_class()
-        self.create_timeout_detector(uid)
+        message, uid, deadline = self._prepare_work(user_id, name, *args,
+                                                    **kw)
+        future = self._new_call(uid, user_id, message[0], name, deadline)
         if logger.isEnabledFor(logging.DEBUG):
             logger.debug('Sending work: {!r} {}'.format(
-                message[:-1],
-                pprint.pformat(self.packer.unpackb(message[-1]))))
+                message[:5],
+                pprint.pformat(self.packer.unpackb(message[5],
+                                                   message[6:]))))
         self.auth_backend.save_last_work(message)
-        self.send_message(message)
-        self.io_loop.add_future(future,
-                                functools.partial(self.cleanup_future, uid))
+        # out-of-band frames follow the body, they are sent without copy
+        self.send_message(message, copy=len(message) == 6)
         return future
 
-    def _retry(self, msg):
-        self.send_message(msg)
+    def _new_call(self, uid, user_id, routing_id, name=None, deadline=None):
+        future = future_class()
+        self.io_loop.add_future(future, self.add_pending_call(
+            uid, future, user_id, routing_id, name, deadline))
+        return future
 
-    def send_callback(self, counter, msg, status):
-        if (isinstance(status, zmq.ZMQError) and
-                status.errno == zmq.EHOSTUNREACH):
-            # ROUTER does not know yet the recipient
-            if counter[msg[0]] > MAX_EHOSTUNREACH_RETRY:
-                return
-            counter[msg[0]] += 1
-            # retry in 100 ms
-            self.create_later_callback(functools.partial(self._retry, msg), .1)
+    def send_callback(self, msg, status):
+        if isinstance(status, zmq.ZMQError):
+            if status.errno == zmq.EHOSTUNREACH:
+                # ROUTER does not know yet the recipient
+                self.hold_message(msg)
+        elif msg[0] in self.outbox:
+            self.outbox.discard(msg[0], msg)
 
-    def send_message(self, message):
-        self.reader.send_multipart(message)
+    def send_message(self, message, copy=True):
+        self.reader.send_multipart(message, copy=copy)
 
     def _store_result_in_future(self, future, result):
         future.set_result(result)
@@ -155,7 +211,7 @@ class TornadoBaseRPC(BaseRPC):
         stream = zmqstream.ZMQStream(socket,
                                      io_loop=self.io_loop)
         stream.on_recv(callback, copy=copy)
-        stream.on_send(functools.partial(self.send_callback, Counter()))
+        stream.on_send(self.send_callback)
         return stream
 
     def create_periodic_callback(self, callback, timer):
@@ -173,11 +229,12 @@ class TornadoBaseRPC(BaseRPC):
 
     def timeout_task(self, uuid):
         try:
-            self.future_pool[uuid].set_exception(TimeoutError())
+            self.future_pool[uuid].future.set_exception(TimeoutError())
         except KeyError:
             pass
 
     def stop(self):
+        self._stop_monitor()
         if self.reader is not None:
             self.reader.on_recv(None)
             self.reader.flush()
@@ -1,9 +1,13 @@
+import collections
 import itertools
 import logging
+import os
+import threading
 
 import zope.component
 import zope.interface
 import zmq
+import zmq.auth
 from zmq.utils import z85
 
 from .interfaces import (AUTHENTICATED,
@@ -16,6 +20,7 @@ from .interfaces import (AUTHENTICATED,
                          UnauthorizedError,
                          VERSION,
                          )
+from .credentials import SQLiteCredentialStore
 from .packer import Packer
 from .utils import register_auth_backend
 
@@ -23,10 +28,83 @@ logger = logging.getLogger(__name__)
 
 
 class _BaseAuthBackend(object):
+    # backends with slow ZAP handlers answer from a thread regardless
+    # of ``rpc.zap_thread``
+    zap_thread = False
 
     def __init__(self, rpc):
         self.rpc = rpc
 
+    def _routing_id_evicted(self, user_id, routing_id):
+        # the connection is identified again on its next message,
+        # registering its routing_id again
+        self.rpc.forget_identity(routing_id)
+
+    def _is_connected(self, user_id, routing_id):
+        # the routing_id of a connected peer is kept, it may be sent
+        # calls before it sends anything again
+        return routing_id in self.rpc.connection_fds
+
+    def start_zap_handler(self):
+        """
+        Binds the ZAP socket and answers requests with ``_zap_handler``,
+        from the loop of the RPC, or from a dedicated thread
+        if ``rpc.zap_thread`` is set.
+        """
+        if self.zap_thread or self.rpc.zap_thread:
+            # plain sockets of the same libzmq context, inproc://
+            # endpoints are not shared across contexts
+            context = zmq.Context.shadow(self.rpc.context.underlying)
+        else:
+            context = self.rpc.context
+        self.zap_socket = zap_socket = context.socket(zmq.ROUTER)
+        zap_socket.linger = 1
+        zap_socket.bind(b'inproc://zeromq.zap.01')
+        if self.zap_thread or self.rpc.zap_thread:
+            self.zap_stopped = threading.Event()
+            self.reader = threading.Thread(target=self._zap_loop,
+                                           name='pseud-zap')
+            self.reader.daemon = True
+            self.reader.start()
+        else:
+            self.reader = self.rpc.read_forever(zap_socket,
+                                                self._handle_zap_request,
+                                                copy=True)
+
+    def _handle_zap_request(self, message):
+        # the identity frame is the routing_id of our own socket, the
+        # connection being authenticated is unknown and may take over
+        # the routing_id of a cached one: every identity is read again,
+        # before the connection can send anything
+        self.rpc.forget_identity()
+        self._zap_handler(message)
+
+    def _zap_loop(self):
+        zap_socket = self.zap_socket
+        while not self.zap_stopped.is_set():
+            if not zap_socket.poll(100):
+                continue
+            message = zap_socket.recv_multipart()
+            try:
+                self._handle_zap_request(message)
+            except Exception:
+                logger.exception('Invalid ZAP request')
+        zap_socket.close()
+
+    def stop_zap_handler(self):
+        if self.zap_thread or self.rpc.zap_thread:
+            self.zap_stopped.set()
+            self.reader.join()
+        else:
+            try:
+                self.reader.kill()
+            except AttributeError:
+                self.reader.on_recv(None)
+                self.reader.flush()
+                self.reader.close()
+            self.zap_socket.close()
+        self.zap_socket = None
+
 
 @register_auth_backend
 @zope.interface.implementer(IAuthenticationBackend)
@@ -130,19 +208,22 @@ class CurveWithTrustedKeyForServer(_BaseAuthBackend):
         self.rpc = rpc
 
     def configure(self):
+        # keypairs of the tests
+        self.known_identities = {b'bob': zmq.curve_keypair(),
+                                 b'alice': zmq.curve_keypair()}
+        self.configure_curve_server()
+
+    def configure_curve_server(self):
+        """
+        Makes the socket a CURVE server and starts the zap handler,
+        subclasses configure their own peers then call it.
+        """
         self.rpc.socket.curve_publickey = self.rpc.public_key
         self.rpc.socket.curve_secretkey = self.rpc.secret_key
         self.rpc.socket.curve_server = True
         assert self.rpc.socket.mechanism == zmq.CURVE
         assert self.rpc.socket.get(zmq.CURVE_SERVER)
-        self.zap_socket = zap_socket = self.rpc.context.socket(zmq.ROUTER)
-        zap_socket.linger = 1
-        zap_socket.bind(b'inproc://zeromq.zap.01')
-        self.reader = self.rpc.read_forever(zap_socket,
-                                            self._zap_handler,
-                                            copy=True)
-        self.known_identities = {b'bob': zmq.curve_keypair(),
-                                 b'alice': zmq.curve_keypair()}
+        self.start_zap_handler()
 
     def _zap_handler(self, message):
         """
@@ -188,14 +269,163 @@ class CurveWithTrustedKeyForServer(_BaseAuthBackend):
         pass
 
     def stop(self):
+        self.stop_zap_handler()
+
+
+def load_certificates(directory):
+    """
+    Returns the identities of public certificates (``*.key`` files, as
+    written by :func:`zmq.auth.create_certificates`) found in directory,
+    by binary public key. The identity is the file name without
+    extension.
+    """
+    certificates = {}
+    for filename in os.listdir(directory):
+        identity, extension = os.path.splitext(filename)
+        if extension != '.key':
+            continue
+        try:
+            public_key, _ = zmq.auth.load_certificate(
+                os.path.join(directory, filename))
+            certificates[z85.decode(public_key)] = identity.encode('utf-8')
+        except (IOError, OSError, ValueError):
+            logger.warning('Invalid certificate {!r}'.format(filename))
+    return certificates
+
+
+@register_auth_backend
+@zope.interface.implementer(IAuthenticationBackend)
+@zope.component.adapter(IClient)
+class CurveWithCertificatesForClient(CurveWithTrustedKeyForClient):
+    """
+    Client of a server authenticating peers with
+    their certificate, see :class:`CurveWithCertificatesForServer`.
+    """
+    name = 'curve_certificates'
+
+    def handle_authentication(self, user_id, routing_id, message_uuid):
+        # the certificate has been revoked since the connection was made
+        call = self.rpc.future_pool.pop(message_uuid, None)
+        if call is not None:
+            call.future.set_exception(UnauthorizedError(
+                'Certificate revoked by {!r}'.format(user_id)))
+
+
+@register_auth_backend
+@zope.interface.implementer(IAuthenticationBackend)
+@zope.component.adapter(IServer)
+class CurveWithCertificatesForServer(CurveWithTrustedKeyForServer):
+    """
+    Allows peers whose public certificate is in
+    ``certificates_directory``, the user_id of a peer is the name of its
+    certificate file.
+
+    Certificates are reloaded in a thread when the directory is modified.
+    Add or replace them by renaming files into the directory, changes of
+    existing files in place are not detected.
+    Revoking a certificate does not close established connections, their
+    messages are refused.
+    """
+    name = 'curve_certificates'
+    reload_interval = 1
+
+    def __init__(self, rpc):
+        self.rpc = rpc
+        self.certificates = {}
+        self.user_ids = frozenset()
+        self.routing_mapping = rpc.peers.table(
+            'routing_mapping', on_evict=self._routing_id_evicted,
+            keep=self._is_connected)
+        self.mtime = None
+        self.loading = False
+
+    def configure(self):
+        self.reload()
+        self.configure_curve_server()
+        self.periodic_callback = self.rpc.create_periodic_callback(
+            self.check_directory, self.reload_interval)
+
+    def reload(self):
+        directory = self.rpc.certificates_directory
+        self.mtime = os.stat(directory).st_mtime
+        # replace the whole mapping, lookups never see a partial one
+        certificates = load_certificates(directory)
+        self.certificates = certificates
+        self.user_ids = frozenset(certificates.values())
+        # connections of revoked certificates are identified again,
+        # and refused
+        self.rpc.forget_identity()
+        logger.debug('{} certificates loaded from {!r}'.format(
+            len(self.certificates), directory))
+
+    def _reload_in_thread(self):
         try:
-            self.reader.kill()
+            self.reload()
+        except Exception:
+            logger.exception('Failed to reload certificates')
+        finally:
+            self.loading = False
+
+    def check_directory(self):
+        if self.loading:
+            return
+        try:
+            mtime = os.stat(self.rpc.certificates_directory).st_mtime
+        except OSError:
+            logger.exception('Certificates directory is gone')
+            return
+        if mtime != self.mtime:
+            self.loading = True
+            thread = threading.Thread(target=self._reload_in_thread)
+            thread.daemon = True
+            thread.start()
+
+    def _zap_handler(self, message):
+        """
+        `ZAP <http://rfc.zeromq.org/spec:27>`_
+        """
+        (zid, delimiter, version, sequence, domain, address, identity,
+         mechanism, key) = message
+        assert version == b'1.0'
+        assert mechanism == b'CURVE'
+        try:
+            known_identity = self.certificates[key]
+        except KeyError:
+            known_identity = b''
+            response_code = b'400'
+            response_msg = b'Unauthorized'
+        else:
+            response_code = b'200'
+            response_msg = b'OK'
+
+        reply = [zid, delimiter, version, sequence, response_code,
+                 response_msg, known_identity, b'']
+        self.zap_socket.send_multipart(reply)
+
+    def is_authenticated(self, peer_id):
+        return peer_id in self.user_ids
+
+    def handle_authentication(self, user_id, routing_id, message_uuid):
+        # its certificate has been revoked
+        self.routing_mapping.forget(user_id)
+        self.rpc.send_message([routing_id, EMPTY_DELIMITER, VERSION,
+                               message_uuid, UNAUTHORIZED,
+                               b'Certificate revoked'])
+
+    def get_routing_id(self, user_id):
+        if user_id not in self.user_ids:
+            raise KeyError(user_id)
+        return self.routing_mapping[user_id]
+
+    def register_routing_id(self, user_id, routing_id):
+        self.routing_mapping[user_id] = routing_id
+
+    def stop(self):
+        try:
+            self.periodic_callback.stop()
         except AttributeError:
-            self.reader.on_recv(None)
-            self.reader.flush()
-            self.reader.close()
-        self.zap_socket.close()
-        self.zap_socket = None
+            self.periodic_callback.kill()
+        super(CurveWithCertificatesForServer, self).stop()
 
 
 @register_auth_backend
@@ -255,18 +485,15 @@ class PlainForServer(_BaseAuthBackend):
 
     def __init__(self, rpc):
         self.rpc = rpc
-        self.routing_mapping = {}
+        self.routing_mapping = rpc.peers.table(
+            'routing_mapping', on_evict=self._routing_id_evicted,
+            keep=self._is_connected)
 
     def configure(self):
         self.rpc.socket.plain_server = True
         assert self.rpc.socket.mechanism == zmq.PLAIN
         assert self.rpc.socket.get(zmq.PLAIN_SERVER)
-        self.zap_socket = zap_socket = self.rpc.context.socket(zmq.ROUTER)
-        zap_socket.linger = 1
-        zap_socket.bind('inproc://zeromq.zap.01')
-        self.reader = self.rpc.read_forever(zap_socket,
-                                            self._zap_handler,
-                                            copy=True)
+        self.start_zap_handler()
 
     def _zap_handler(self, message):
         """
@@ -311,14 +538,7 @@ class PlainForServer(_BaseAuthBackend):
         self.routing_mapping[user_id] = routing_id
 
     def stop(self):
-        try:
-            self.reader.kill()
-        except AttributeError:
-            self.reader.on_recv(None)
-            self.reader.flush()
-            self.reader.close()
-        self.zap_socket.close()
-        self.zap_socket = None
+        self.stop_zap_handler()
 
 
 @register_auth_backend
@@ -348,6 +568,123 @@ class TrustedPeerForServer(PlainForServer):
         self.zap_socket.send_multipart(reply)
 
 
+@register_auth_backend
+@zope.interface.implementer(IAuthenticationBackend)
+@zope.component.adapter(IClient)
+class SQLitePlainForClient(PlainForClient):
+    """
+    Client of :class:`SQLitePlainForServer`.
+    """
+    name = 'sqlite_plain'
+
+
+@register_auth_backend
+@zope.interface.implementer(IAuthenticationBackend)
+@zope.component.adapter(IServer)
+class SQLitePlainForServer(PlainForServer):
+    """
+    Checks logins and passwords of peers, using PLAIN mechanism,
+    against a :class:`pseud.credentials.SQLiteCredentialStore`
+    at ``credentials_database``.
+    Passwords are hashed from the ZAP thread, even without ``zap_thread``.
+    """
+    name = 'sqlite_plain'
+    zap_thread = True
+
+    def configure(self):
+        self.store = SQLiteCredentialStore(self.rpc.credentials_database)
+        super(SQLitePlainForServer, self).configure()
+
+    def _zap_handler(self, message):
+        """
+        `ZAP <http://rfc.zeromq.org/spec:27>`_
+        """
+        (zid, delimiter, version, sequence, domain, address, identity,
+         mechanism, login, password) = message
+        assert version == b'1.0'
+        assert mechanism == b'PLAIN'
+        if self.store.check_password(login, password):
+            response_code = b'200'
+            response_msg = b'OK'
+            known_identity = login
+        else:
+            known_identity = b''
+            response_code = b'400'
+            response_msg = b'Unauthorized'
+
+        reply = [zid, delimiter, version, sequence, response_code,
+                 response_msg, known_identity, b'']
+        self.zap_socket.send_multipart(reply)
+
+    def stop(self):
+        super(SQLitePlainForServer, self).stop()
+        self.store.close()
+
+
+@register_auth_backend
+@zope.interface.implementer(IAuthenticationBackend)
+@zope.component.adapter(IClient)
+class SQLiteCurveForClient(CurveWithTrustedKeyForClient):
+    """
+    Client of :class:`SQLiteCurveForServer`.
+    """
+    name = 'sqlite_curve'
+
+
+@register_auth_backend
+@zope.interface.implementer(IAuthenticationBackend)
+@zope.component.adapter(IServer)
+class SQLiteCurveForServer(CurveWithTrustedKeyForServer):
+    """
+    Allows peers whose CURVE public key is trusted in
+    a :class:`pseud.credentials.SQLiteCredentialStore` at
+    ``credentials_database``, as the login owning it.
+    """
+    name = 'sqlite_curve'
+
+    def __init__(self, rpc):
+        self.rpc = rpc
+        self.routing_mapping = rpc.peers.table(
+            'routing_mapping', on_evict=self._routing_id_evicted,
+            keep=self._is_connected)
+
+    def configure(self):
+        self.store = SQLiteCredentialStore(self.rpc.credentials_database)
+        self.configure_curve_server()
+
+    def _zap_handler(self, message):
+        """
+        `ZAP <http://rfc.zeromq.org/spec:27>`_
+        """
+        (zid, delimiter, version, sequence, domain, address, identity,
+         mechanism, key) = message
+        assert version == b'1.0'
+        assert mechanism == b'CURVE'
+        login = self.store.get_login(key)
+        if login is not None:
+            response_code = b'200'
+            response_msg = b'OK'
+            known_identity = login.encode('utf-8')
+        else:
+            known_identity = b''
+            response_code = b'400'
+            response_msg = b'Unauthorized'
+
+        reply = [zid, delimiter, version, sequence, response_code,
+                 response_msg, known_identity, b'']
+        self.zap_socket.send_multipart(reply)
+
+    def get_routing_id(self, user_id):
+        return self.routing_mapping[user_id]
+
+    def register_routing_id(self, user_id, routing_id):
+        self.routing_mapping[user_id] = routing_id
+
+    def stop(self):
+        super(SQLiteCurveForServer, self).stop()
+        self.store.close()
+
+
 @register_auth_backend
 @zope.interface.implementer(IAuthenticationBackend)
 @zope.component.adapter(IClient)
@@ -365,7 +702,9 @@ class CurveWithUntrustedKeyForClient(_BaseAuthBackend):
     def __init__(self, *args, **kw):
         super(CurveWithUntrustedKeyForClient, self).__init__(*args, **kw)
         self.counter = itertools.count()
-        self.last_messages = []
+        # message ids of the calls of each message kept to be sent again,
+        # oldest first
+        self.resend_queue = collections.deque()
         self.packer = Packer()
 
     def configure(self):
@@ -377,12 +716,12 @@ class CurveWithUntrustedKeyForClient(_BaseAuthBackend):
     def handle_authentication(self, user_id, routing_id, message_uuid):
         if next(self.counter) >= self.max_retries:
             try:
-                future = self.rpc.future_pool.pop(message_uuid)
+                call = self.rpc.future_pool.pop(message_uuid)
             except KeyError:
                 pass
             else:
-                future.set_exception(UnauthorizedError('Max authentication'
-                                                       ' retries reached'))
+                call.future.set_exception(UnauthorizedError(
+                    'Max authentication retries reached'))
         else:
             self.rpc.send_message([routing_id, EMPTY_DELIMITER, VERSION,
                                    message_uuid, HELLO,
@@ -392,15 +731,32 @@ class CurveWithUntrustedKeyForClient(_BaseAuthBackend):
     def handle_hello(self, *args):
         pass
 
-    def handle_authenticated(self, message_uuid):
-        try:
-            self.rpc.send_message(self.last_messages.pop(0))
-        except IndexError:
-            pass
-        self.last_message = None
+    def handle_authenticated(self, message):
+        # the oldest request sent before authentication is sent again
+        while self.resend_queue:
+            calls = [self.rpc.future_pool.get(uid)
+                     for uid in self.resend_queue.popleft()]
+            calls = [call for call in calls
+                     if call is not None and call.message is not None]
+            if calls:
+                self.rpc.refresh_budget(calls[0].message)
+                self.rpc.send_message(calls[0].message)
+                for call in calls:
+                    call.message = None
+                break
 
     def save_last_work(self, message):
-        self.last_messages.append(message)
+        uids = self.rpc.call_ids(message)
+        # kept with its pending calls, forgotten with them
+        for uid in uids:
+            self.rpc.future_pool[uid].message = message
+        # messages whose calls are all done at the head of the queue are
+        # dropped
+        future_pool = self.rpc.future_pool
+        while self.resend_queue and not any(
+                uid in future_pool for uid in self.resend_queue[0]):
+            self.resend_queue.popleft()
+        self.resend_queue.append(uids)
 
     def is_authenticated(self, peer_id):
         return True
@@ -438,10 +794,19 @@ class CurveWithUntrustedKeyForServer(_BaseAuthBackend):
 
     def __init__(self, rpc):
         self.rpc = rpc
+        # read by the zap thread
         self.trusted_keys = {}
-        self.pending_keys = {}
+        # index of trusted keys, raw and z85 encoded, for is_authenticated()
+        self.authenticated_keys = set()
+        # keys trusted for each login, untrusted once the login is evicted
+        self.trusted_logins = rpc.peers.table('trusted_logins',
+                                              on_evict=self._untrust_keys)
+        self.pending_keys = rpc.peers.table('pending_keys',
+                                            on_evict=self._key_evicted)
         self.user_map = {}
-        self.login2peer_id_mapping = {}
+        self.login2peer_id_mapping = rpc.peers.table(
+            'login2peer_id_mapping', on_evict=self._routing_id_evicted,
+            keep=self._is_connected)
         self.packer = Packer()
 
     def _zap_handler(self, message):
@@ -466,12 +831,7 @@ class CurveWithUntrustedKeyForServer(_BaseAuthBackend):
         self.rpc.socket.curve_server = True
         assert self.rpc.socket.mechanism == zmq.CURVE
         assert self.rpc.socket.get(zmq.CURVE_SERVER)
-        self.zap_socket = zap_socket = self.rpc.context.socket(zmq.ROUTER)
-        zap_socket.linger = 1
-        zap_socket.bind(b'inproc://zeromq.zap.01')
-        self.reader = self.rpc.read_forever(zap_socket,
-                                            self._zap_handler,
-                                            copy=True)
+        self.start_zap_handler()
 
     def get_routing_id(self, user_id):
         return self.login2peer_id_mapping[user_id]
@@ -481,14 +841,28 @@ class CurveWithUntrustedKeyForServer(_BaseAuthBackend):
 
     def handle_hello(self, user_id, routing_id, message_uuid, message):
         login, password = self.packer.unpackb(message)
-        if login in self.user_map and self.user_map[login] == password:
-            key = z85.decode(self.pending_keys[routing_id])
-            self.trusted_keys[key] = login
+        if login not in self.user_map or self.user_map[login] != password:
+            authenticated = False
+        elif user_id == login:
+            # its key was trusted when it connected, the login has been
+            # evicted since, along with its keys
+            if self.trusted_logins.get(login) is None:
+                self.trusted_logins[login] = set()
+            self.rpc.invalidate_predicates(login)
             self.login2peer_id_mapping[login] = routing_id
-            try:
-                del self.login2peer_id_mapping[self.pending_keys[routing_id]]
-            except KeyError:
-                pass
+            authenticated = True
+        elif routing_id in self.pending_keys:
+            # kept until the peer is forgotten, every call sent before
+            # login made the client send its own HELLO
+            pending_key = self.pending_keys[routing_id]
+            self.trust_key(z85.decode(pending_key), login)
+            self.rpc.invalidate_predicates(login)
+            self.login2peer_id_mapping[login] = routing_id
+            self.login2peer_id_mapping.pop(pending_key, None)
+            authenticated = True
+        else:
+            authenticated = False
+        if authenticated:
             reply = 'Welcome {!r}'.format(login).encode()
             status = AUTHENTICATED
         else:
@@ -498,37 +872,55 @@ class CurveWithUntrustedKeyForServer(_BaseAuthBackend):
         self.rpc.send_message([routing_id, EMPTY_DELIMITER, VERSION,
                                message_uuid, status, reply])
 
+    def trust_key(self, key, login):
+        """
+        Trust given binary public key as login.
+        """
+        previous = self.trusted_keys.get(key)
+        if previous is not None:
+            # None when evicted meanwhile, along with its keys
+            keys = self.trusted_logins.get(previous)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    self.trusted_logins.pop(previous)
+        keys = self.trusted_logins.get(login)
+        if keys is None:
+            keys = self.trusted_logins[login] = set()
+        keys.add(key)
+        self.trusted_keys[key] = login
+        self.authenticated_keys.update((key, z85.encode(key)))
+
+    def _untrust_keys(self, login, keys):
+        for key in keys:
+            del self.trusted_keys[key]
+            self.authenticated_keys.difference_update((key, z85.encode(key)))
+        routing_id = self.login2peer_id_mapping.get(login)
+        if routing_id is not None:
+            self.rpc.forget_identity(routing_id)
+
+    def _key_evicted(self, routing_id, key):
+        self.rpc.forget_identity(routing_id)
+
     def handle_authenticated(self, message):
         pass
 
     def handle_authentication(self, user_id, routing_id, message_uuid):
-        self.pending_keys[routing_id] = user_id  # this is the client pub key
+        # user_id is the client public key, or the login of a peer
+        # whose key was trusted when it connected and is known already
+        if user_id not in self.user_map:
+            self.pending_keys[routing_id] = user_id
         reply = b'Authentication Required'
         status = UNAUTHORIZED
         self.rpc.send_message([routing_id, EMPTY_DELIMITER, VERSION,
                                message_uuid, status, reply])
 
     def is_authenticated(self, user_id):
-        result = False
-        if user_id in self.trusted_keys:
-            result = True
-        try:
-            if z85.decode(user_id) in self.trusted_keys:
-                result = True
-        except ValueError:
-            pass
-        if user_id in self.trusted_keys.values():
-            result = True
-        return result
+        return (user_id in self.authenticated_keys or
+                user_id in self.trusted_logins)
 
     def stop(self):
-        try:
-            self.reader.kill()
-        except AttributeError:
-            self.reader.on_recv(None)
-            self.reader.flush()
-            self.reader.close()
-        self.zap_socket.close()
+        self.stop_zap_handler()
 
     def save_last_work(self, message):
         pass
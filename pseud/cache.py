@@ -0,0 +1,359 @@
+import collections
+import time
+
+_marker = object()
+
+_clock = getattr(time, 'monotonic', time.time)
+
+
+class LRUCache(object):
+    """
+    Mapping that keeps at most ``maxsize`` items, evicting the least
+    recently used first.
+    When ``ttl`` is given, items are forgotten ``ttl`` seconds after
+    they have been stored.
+    """
+    def __init__(self, maxsize=1024, ttl=None, clock=_clock):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._data = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, _marker) is not _marker
+
+    def __getitem__(self, key):
+        value = self.get(key, _marker)
+        if value is _marker:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self._data.pop(key, None)
+        expires = None if self.ttl is None else self.clock() + self.ttl
+        self._data[key] = (expires, value)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def __delitem__(self, key):
+        del self._data[key]
+
+    def get(self, key, default=None):
+        try:
+            expires, value = self._data.pop(key)
+        except KeyError:
+            return default
+        if expires is not None and expires <= self.clock():
+            return default
+        # move to the most recently used end
+        self._data[key] = (expires, value)
+        return value
+
+    def pop(self, key, default=_marker):
+        try:
+            expires, value = self._data.pop(key)
+        except KeyError:
+            if default is _marker:
+                raise
+            return default
+        return value
+
+    def clear(self):
+        self._data.clear()
+
+
+class PredicateCache(LRUCache):
+    """
+    Remembers predicate decisions, keyed by
+    ``(rpc-callable name, domain, user_id)``.
+    """
+    def invalidate(self, user_id=None):
+        """
+        Forget decisions taken for given user_id, or all of them.
+        """
+        if user_id is None:
+            self.clear()
+            return
+        for key in [key for key in self._data if key[2] == user_id]:
+            del self._data[key]
+
+
+class PeerTable(LRUCache):
+    """
+    LRUCache whose items are forgotten ``ttl`` seconds after they have
+    been used for the last time.
+    ``on_evict(key, value)`` is called for every item dropped by the
+    table itself or forgotten, not for popped ones.
+    Items for which ``keep(key, value)`` is true are used again instead
+    of being dropped by the table, it may then hold more than
+    ``maxsize`` items.
+    """
+    # kept items looked at before giving up on evicting an item
+    max_kept = 16
+
+    def __init__(self, maxsize=1024, ttl=None, clock=_clock,
+                 on_evict=None, keep=None):
+        super(PeerTable, self).__init__(maxsize=maxsize, ttl=ttl,
+                                        clock=clock)
+        self.on_evict = on_evict
+        self.keep = keep
+
+    def __setitem__(self, key, value):
+        self.expire()
+        data = self._data
+        data.pop(key, None)
+        expires = None if self.ttl is None else self.clock() + self.ttl
+        data[key] = (expires, value)
+        kept = 0
+        while len(data) > self.maxsize and kept < self.max_kept:
+            if not self._evict(*data.popitem(last=False)):
+                kept += 1
+
+    def _evict(self, key, item):
+        """
+        Drops given item, popped from the table, unless it is kept.
+        Returns False if it is kept.
+        """
+        if self.keep is not None and self.keep(key, item[1]):
+            expires = None if self.ttl is None else self.clock() + self.ttl
+            self._data[key] = (expires, item[1])
+            return False
+        self._evicted(key, item)
+        return True
+
+    def _evicted(self, key, item):
+        if self.on_evict is not None:
+            self.on_evict(key, item[1])
+
+    def get(self, key, default=None):
+        try:
+            item = expires, value = self._data.pop(key)
+        except KeyError:
+            return default
+        if expires is not None:
+            now = self.clock()
+            if expires <= now:
+                if self._evict(key, item):
+                    return default
+                return value
+            expires = now + self.ttl
+        self._data[key] = (expires, value)
+        return value
+
+    def forget(self, key):
+        """
+        Drops given key as if it was evicted.
+        """
+        try:
+            item = self._data.pop(key)
+        except KeyError:
+            return
+        self._evicted(key, item)
+
+    def expire(self):
+        """
+        Drops idle items, the least recently used, thus first to expire,
+        come first.
+        """
+        if self.ttl is None:
+            return
+        now = self.clock()
+        data = self._data
+        while data:
+            key = next(iter(data))
+            if data[key][0] > now:
+                break
+            # kept items come back with a later expiry
+            self._evict(key, data.pop(key))
+
+    def values(self):
+        return [value for _, value in self._data.values()]
+
+
+class PeerStateStore(object):
+    """
+    Named :class:`PeerTable` of state kept by backends about peers, each
+    bounded to ``maxsize`` peers, evicting those idle for more than
+    ``idle_timeout`` seconds.
+    """
+    def __init__(self, maxsize=100000, idle_timeout=None, clock=_clock):
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.clock = clock
+        self.tables = {}
+
+    def table(self, name, on_evict=None, keep=None):
+        """
+        Returns the table of given name, ``on_evict`` and ``keep`` are
+        given to the table when it is created.
+        """
+        try:
+            return self.tables[name]
+        except KeyError:
+            table = self.tables[name] = PeerTable(maxsize=self.maxsize,
+                                                  ttl=self.idle_timeout,
+                                                  clock=self.clock,
+                                                  on_evict=on_evict,
+                                                  keep=keep)
+            return table
+
+    def touch(self, *keys):
+        """
+        Marks given user_ids or routing_ids as used in every table,
+        peers are idle when they send nothing.
+        """
+        if self.idle_timeout is None:
+            return
+        for table in self.tables.values():
+            for key in keys:
+                table.get(key)
+
+    def forget(self, *keys):
+        """
+        Drops given user_ids or routing_ids from every table.
+        """
+        for table in self.tables.values():
+            for key in keys:
+                table.forget(key)
+
+    def sizes(self):
+        return {name: len(table) for name, table in self.tables.items()}
+
+
+class _HeldMessages(object):
+    __slots__ = ('messages', 'delay', 'scheduled', 'retried')
+
+    def __init__(self, delay):
+        self.messages = collections.deque()
+        self.delay = delay
+        self.scheduled = False
+        # (expires, message) of the messages taken for a retry, by id
+        self.retried = {}
+
+
+class Outbox(object):
+    """
+    Messages held for routing_ids the ROUTER socket does not know yet,
+    at most ``maxsize_per_peer`` by peer and ``maxsize`` overall.
+    Messages are dropped ``ttl`` seconds after they have been held for
+    the first time, retries keep their expiry.
+    ``delay`` is the first retry delay of a peer, it doubles at every
+    retry up to ``max_delay``.
+    """
+    def __init__(self, maxsize_per_peer=1000, maxsize=100000, ttl=5,
+                 delay=.001, max_delay=.5, clock=_clock):
+        self.maxsize_per_peer = maxsize_per_peer
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.initial_delay = delay
+        self.max_delay = max_delay
+        self.clock = clock
+        self.size = 0
+        self._peers = {}
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, routing_id):
+        return routing_id in self._peers
+
+    def routing_ids(self):
+        return list(self._peers)
+
+    def put(self, routing_id, message):
+        """
+        Holds message, returns the held messages of its peer,
+        or None if the outbox is full.
+        """
+        held = self._peers.get(routing_id)
+        if held is not None and (
+                len(held.messages) >= self.maxsize_per_peer):
+            self.expire()
+            held = self._peers.get(routing_id)
+            if held is not None and (
+                    len(held.messages) >= self.maxsize_per_peer):
+                return None
+        if self.size >= self.maxsize:
+            self.expire()
+            if self.size >= self.maxsize:
+                return None
+        if held is None:
+            held = self._peers[routing_id] = _HeldMessages(
+                self.initial_delay)
+        retried = held.retried.pop(id(message), None)
+        if retried is not None and retried[1] is message:
+            expires = retried[0]
+        else:
+            expires = self.clock() + self.ttl
+        held.messages.append((expires, message))
+        self.size += 1
+        return held
+
+    def next_delay(self, held):
+        """
+        Returns the delay before the next retry of given peer.
+        """
+        delay = held.delay
+        held.delay = min(delay * 2, self.max_delay)
+        return delay
+
+    def take(self, routing_id):
+        """
+        Returns the messages held for given peer that did not expire,
+        its retry delay is kept until :meth:`discard` is called.
+        Messages held again by :meth:`put` keep their expiry, the peer is
+        forgotten if none is left.
+        """
+        held = self._peers.get(routing_id)
+        if held is None:
+            return []
+        now = self.clock()
+        self.size -= len(held.messages)
+        retried = self._expire_retried(held, now)
+        messages = []
+        for expires, message in held.messages:
+            if expires > now:
+                retried[id(message)] = (expires, message)
+                messages.append(message)
+        held.messages.clear()
+        held.scheduled = False
+        if not retried:
+            del self._peers[routing_id]
+        return messages
+
+    def _expire_retried(self, held, now):
+        retried = held.retried
+        for key in [key for key, (expires, _) in retried.items()
+                    if expires <= now]:
+            del retried[key]
+        return retried
+
+    def discard(self, routing_id, message=None):
+        """
+        Forgets given message taken for a retry, it has been sent or
+        dropped, or every one of them, and given peer if nothing is held
+        for it anymore.
+        """
+        held = self._peers.get(routing_id)
+        if held is None:
+            return
+        if message is None:
+            held.retried.clear()
+        else:
+            held.retried.pop(id(message), None)
+        if not held.messages and not held.retried:
+            del self._peers[routing_id]
+
+    def expire(self):
+        now = self.clock()
+        for routing_id, held in list(self._peers.items()):
+            # retried messages keep their expiry, they are not in order
+            messages = [item for item in held.messages if item[0] > now]
+            self.size -= len(held.messages) - len(messages)
+            held.messages = collections.deque(messages)
+            retried = self._expire_retried(held, now)
+            if not messages and not retried and not held.scheduled:
+                del self._peers[routing_id]
@@ -1,16 +1,23 @@
+import binascii
+import collections
 import functools
 import inspect
+import itertools
 import logging
+import os
 import pprint
+import struct
+import sys
 import textwrap
+import time
 import traceback
-import uuid
 
 import dateutil.parser
 import dateutil.tz
 from future import standard_library
 from future.builtins import str
 import zmq
+from zmq.utils.monitor import parse_monitor_message
 import zope.component
 import zope.interface
 
@@ -19,23 +26,34 @@ with standard_library.hooks():
 
 from . import interfaces  # NOQA
 from .interfaces import (AUTHENTICATED,
+                         BATCH,
+                         BATCH_REPLY,
+                         BatchDiscardedError,
+                         CallCancelledError,
+                         CANCEL,
                          EMPTY_DELIMITER,
                          ERROR,
                          HEARTBEAT,
                          HELLO,
                          IAuthenticationBackend,
                          IHeartbeatBackend,
+                         ISerializer,
                          OK,
+                         PeerDisconnectedError,
                          ServiceNotFoundError,
                          UNAUTHORIZED,
+                         UnreachablePeerError,
+                         UnsupportedSerializerError,
                          VERSION,
                          WORK,
                          )  # NOQA
-from .utils import (get_rpc_callable,
+from .cache import LRUCache, Outbox, PeerStateStore, PredicateCache  # NOQA
+from .timer import TimerWheel  # NOQA
+from .utils import (compile_routes,
+                    get_route_index,
                     register_rpc,
                     create_local_registry,
                     )  # NOQA
-from .packer import Packer  # NOQA
 
 
 logger = logging.getLogger(__name__)
@@ -62,6 +80,86 @@ class DummyFuture(object):
             raise
 
 
+class PendingCall(object):
+    """
+    A request waiting for its reply, kept in
+    :attr:`BaseRPC.future_pool` under its message id.
+    It is linked to its future, and drops itself once the future is done.
+    ``deadline`` is the wall clock time it expires at, ``name`` the called
+    rpc-callable.
+    ``message`` is only kept by authentication backends that may have
+    to send it again, ``batch`` is the id of the BATCH message it was
+    sent in.
+    """
+    __slots__ = ('rpc', 'uid', 'future', 'deadline', 'user_id',
+                 'routing_id', 'name', 'message', 'batch')
+
+    def __init__(self, rpc, uid, future, deadline, user_id, routing_id,
+                 name=None):
+        self.rpc = rpc
+        self.uid = uid
+        self.future = future
+        self.deadline = deadline
+        self.user_id = user_id
+        self.routing_id = routing_id
+        self.name = name
+        self.message = None
+        self.batch = None
+
+    def __call__(self, future):
+        self.rpc.cleanup_future(self.uid, future, self.routing_id)
+
+
+class CallContext(object):
+    """
+    Given as first argument to rpc-callables registered with
+    ``with_context=True``.
+    """
+    __slots__ = ('user_id', 'deadline')
+
+    def __init__(self, user_id, deadline=None):
+        self.user_id = user_id
+        # local wall clock time the caller gives up at, if known
+        self.deadline = deadline
+
+    def remaining(self):
+        """
+        Returns seconds left before the caller gives up, or None.
+        """
+        if self.deadline is None:
+            return None
+        return self.deadline - time.time()
+
+
+def serializer_version(name):
+    """
+    :term:`VERSION` frame announcing given serializer.
+    msgpack, the default, is announced by the bare version.
+    """
+    if name == 'msgpack':
+        return VERSION
+    return VERSION + b'/' + name.encode('utf-8')
+
+
+def message_ids():
+    """
+    Yields the ids of the messages sent by an RPC instance, a random
+    prefix of 4 bytes followed by a 64 bits counter.
+    """
+    prefix = os.urandom(4)
+    pack = struct.Struct('!Q').pack
+    for counter in itertools.count(1):
+        yield prefix + pack(counter)
+
+
+def batch_id(message_uuid):
+    """
+    Message id as written in BATCH and BATCH_REPLY bodies, hexadecimal
+    text that every serializer can carry, unlike bytes.
+    """
+    return binascii.hexlify(message_uuid).decode('ascii')
+
+
 def format_remote_traceback(traceback):
     pivot = '\n{}'.format(3 * 4 * ' ')  # like three tabs
     return textwrap.dedent("""
@@ -73,6 +171,9 @@ def format_remote_traceback(traceback):
 
 UTC = dateutil.tz.tzutc()
 
+# message types whose body is packed by the serializer named in VERSION
+SERIALIZED_TYPES = (WORK, OK, ERROR, BATCH, BATCH_REPLY)
+
 
 class AttributeWrapper(object):
     def __init__(self, rpc, name=None, user_id=None):
@@ -103,21 +204,189 @@ class AttributeWrapper(object):
         return self.rpc.send_work(user_id, self.name, *args, **kw)
 
 
+class Batch(object):
+    """
+    Collects calls made through it, and sends them to the peer in a single
+    BATCH message when the ``with`` block exits or :meth:`send` is called.
+    Each call returns its own future.
+    """
+    def __init__(self, rpc, user_id=None):
+        self.rpc = rpc
+        self.peer_routing_id = user_id or rpc.peer_routing_id
+        self.calls = []
+        self.routing_id = None
+        # the one of the first call, the earliest
+        self.deadline = None
+
+    def __getattr__(self, name):
+        return AttributeWrapper(self, name=name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.send()
+        else:
+            self.discard()
+
+    def send_work(self, user_id, name, *args, **kw):
+        if self.routing_id is None:
+            self.routing_id = self.rpc.auth_backend.get_routing_id(user_id)
+        uid = next(self.rpc.message_ids)
+        self.calls.append((uid, name, args, kw))
+        future = self.rpc._new_call(uid, user_id, self.routing_id, name)
+        if self.deadline is None:
+            self.deadline = self.rpc.future_pool[uid].deadline
+        return future
+
+    def send(self):
+        """
+        Sends collected calls.
+        """
+        if not self.calls:
+            return
+        message = self.rpc._prepare_batch(self.routing_id, self.calls,
+                                          self.deadline)
+        for uid, _, _, _ in self.calls:
+            call = self.rpc.future_pool.get(uid)
+            if call is not None:
+                call.batch = message[3]
+        self.calls = []
+        self.deadline = None
+        self.rpc.auth_backend.save_last_work(message)
+        self.rpc.start()
+        # out-of-band frames follow the body, they are sent without copy
+        self.rpc.send_message(message, copy=len(message) == 6)
+
+    def discard(self):
+        """
+        Forgets collected calls, their futures fail with
+        :class:`pseud.interfaces.BatchDiscardedError`.
+        """
+        for uid, _, _, _ in self.calls:
+            call = self.rpc.future_pool.pop(uid, None)
+            self.rpc.timers.discard(uid)
+            if call is not None:
+                call.future.set_exception(BatchDiscardedError(
+                    'Batch discarded before it was sent'))
+        self.calls = []
+        self.deadline = None
+
+
+def _frame_bytes(frame):
+    return getattr(frame, 'bytes', frame)
+
+
+def _on_work(rpc, message, routing_id, user_id, message_uuid, buffers,
+             version):
+    rpc._handle_work(message, routing_id, user_id, message_uuid, buffers,
+                     version)
+
+
+def _on_ok(rpc, message, routing_id, user_id, message_uuid, buffers,
+           version):
+    return rpc._handle_ok(message, message_uuid, buffers, version)
+
+
+def _on_error(rpc, message, routing_id, user_id, message_uuid, buffers,
+              version):
+    rpc._handle_error(message, message_uuid, version)
+
+
+def _on_authenticated(rpc, message, routing_id, user_id, message_uuid,
+                      buffers, version):
+    rpc.auth_backend.handle_authenticated(message)
+
+
+def _on_unauthorized(rpc, message, routing_id, user_id, message_uuid,
+                     buffers, version):
+    rpc.auth_backend.handle_authentication(user_id, routing_id,
+                                           message_uuid)
+
+
+def _on_hello(rpc, message, routing_id, user_id, message_uuid, buffers,
+              version):
+    rpc.auth_backend.handle_hello(user_id, routing_id, message_uuid,
+                                  message)
+
+
+def _on_batch(rpc, message, routing_id, user_id, message_uuid, buffers,
+              version):
+    rpc._handle_batch(message, routing_id, user_id, message_uuid, buffers,
+                      version)
+
+
+def _on_batch_reply(rpc, message, routing_id, user_id, message_uuid,
+                    buffers, version):
+    rpc._handle_batch_reply(message, buffers, version)
+
+
+def _on_cancel(rpc, message, routing_id, user_id, message_uuid, buffers,
+               version):
+    rpc.cancel_job(routing_id, message_uuid)
+
+
+def _on_heartbeat(rpc, message, routing_id, user_id, message_uuid, buffers,
+                  version):
+    # Can ignore, because every message is an heartbeat
+    pass
+
+
 class BaseRPC(object):
+    # handlers of messages from authenticated peers, by message type
+    message_handlers = {
+        WORK: _on_work,
+        OK: _on_ok,
+        ERROR: _on_error,
+        AUTHENTICATED: _on_authenticated,
+        UNAUTHORIZED: _on_unauthorized,
+        HELLO: _on_hello,
+        HEARTBEAT: _on_heartbeat,
+        CANCEL: _on_cancel,
+        BATCH: _on_batch,
+        BATCH_REPLY: _on_batch_reply,
+    }
+
     def __init__(self, user_id=None, routing_id=None, peer_routing_id=None,
                  context=None, io_loop=None,
                  security_plugin='noop_auth_backend',
                  public_key=None, secret_key=None,
                  peer_public_key=None, timeout=5,
                  password=None, heartbeat_plugin='noop_heartbeat_backend',
-                 proxy_to=None, registry=None, translation_table=None):
+                 proxy_to=None, registry=None, translation_table=None,
+                 predicate_cache_size=0, predicate_cache_ttl=60,
+                 compression=None, compression_threshold=65536,
+                 max_decompressed_size=64 * 1024 * 1024,
+                 serializer='msgpack', accepted_serializers=None,
+                 identity_cache_size=1024, certificates_directory=None,
+                 zap_thread=False, credentials_database=None,
+                 max_peers=100000, peer_idle_timeout=None, monitor=True,
+                 outbox_size=1000, max_outbox_size=100000,
+                 timer_resolution=.1, concurrent_batches=False,
+                 send_deadlines=False, send_cancels=False):
         self.user_id = user_id
         self.routing_id = routing_id
         self.context = context or self._make_context()
         self.peer_routing_id = peer_routing_id
         self.security_plugin = security_plugin
+        # PendingCall by message id
         self.future_pool = {}
+        # message ids of pending calls, by routing_id of their peer
+        self.peer_calls = {}
+        self.message_ids = message_ids()
+        # jobs being executed for peers, by (routing_id, message id)
+        self.running_jobs = {}
+        self.concurrent_batches = concurrent_batches
+        self.send_deadlines = send_deadlines
+        self.send_cancels = send_cancels
+        # timeouts of pending futures, checked by a single periodic tick
+        self.timers = TimerWheel(resolution=timer_resolution)
+        self._timer_scheduled = False
         self.initialized = False
+        # before backends, they keep their state about peers there
+        self.peers = PeerStateStore(maxsize=max_peers,
+                                    idle_timeout=peer_idle_timeout)
         self.auth_backend = zope.component.getAdapter(self,
                                                       IAuthenticationBackend,
                                                       name=self.security_plugin
@@ -126,6 +395,9 @@ class BaseRPC(object):
         self.secret_key = secret_key
         self.peer_public_key = peer_public_key
         self.password = password
+        self.certificates_directory = certificates_directory
+        self.zap_thread = zap_thread
+        self.credentials_database = credentials_database
         self.timeout = timeout
         self.heartbeat_backend = zope.component.getAdapter(
             self,
@@ -137,7 +409,37 @@ class BaseRPC(object):
         self.registry = (registry if registry is not None
                          else create_local_registry(user_id or ''))
         self.socket = None
-        self.packer = Packer(translation_table)
+        self.translation_table = translation_table
+        self.compression = compression
+        self.compression_threshold = compression_threshold
+        self.max_decompressed_size = max_decompressed_size
+        self.packer = zope.component.getAdapter(self, ISerializer,
+                                                name=serializer)
+        self.version = serializer_version(serializer)
+        self.accepted_serializers = frozenset(
+            accepted_serializers or (serializer,))
+        self._serializers = {self.version: self.packer}
+        self.routes = None
+        self.monitor = monitor
+        self.monitor_socket = None
+        self.monitor_reader = None
+        # routing_id of identified connections by file descriptor, and the
+        # file descriptor of the current connection of a routing_id
+        self.connections = {}
+        self.connection_fds = {}
+        self.outbox = Outbox(maxsize_per_peer=outbox_size,
+                             maxsize=max_outbox_size, ttl=timeout)
+        self.identities = LRUCache(maxsize=identity_cache_size)
+        # forget_identity() may be called from the zap thread, identities
+        # are forgotten by the loop on its next lookup
+        self._identities_generation = 0
+        self._identities_checked = 0
+        self._forgotten_identities = collections.deque()
+        if predicate_cache_size:
+            self.predicate_cache = PredicateCache(maxsize=predicate_cache_size,
+                                                  ttl=predicate_cache_ttl)
+        else:
+            self.predicate_cache = None
 
     def __getattr__(self, name, default=_marker):
         try:
@@ -167,8 +469,180 @@ class BaseRPC(object):
         self.socket.SNDTIMEO = int(self.timeout * 1000)
         self.auth_backend.configure()
         self.heartbeat_backend.configure()
+        if self.monitor and self.monitor_socket is None:
+            self._start_monitor()
         self.initialized = True
 
+    def _start_monitor(self):
+        events = (zmq.EVENT_DISCONNECTED | zmq.EVENT_CONNECTED |
+                  zmq.EVENT_ACCEPTED |
+                  getattr(zmq, 'EVENT_HANDSHAKE_SUCCEEDED', 0))
+        self.monitor_socket = self.socket.get_monitor_socket(events)
+        self.monitor_reader = self.read_forever(self.monitor_socket,
+                                                self._on_monitor_event,
+                                                copy=True)
+
+    def _stop_monitor(self):
+        if self.monitor_socket is None:
+            return
+        try:
+            self.monitor_reader.kill()
+        except AttributeError:
+            self.monitor_reader.on_recv(None)
+            self.monitor_reader.close()
+        self.socket.disable_monitor()
+        self.monitor_socket.close(linger=0)
+        self.monitor_socket = self.monitor_reader = None
+
+    def _on_monitor_event(self, message):
+        event = parse_monitor_message(message)
+        if event['event'] == zmq.EVENT_DISCONNECTED:
+            routing_id = self._unmap_connection(int(event['value']))
+            if routing_id is not None:
+                self.handle_disconnected(routing_id)
+            return
+        if event['event'] in (zmq.EVENT_ACCEPTED, zmq.EVENT_CONNECTED):
+            # the file descriptor may have been reused, and the new
+            # connection may take over a known routing_id: connections
+            # are identified again on their next message
+            self._unmap_connection(int(event['value']))
+            self.forget_identity()
+        if len(self.outbox):
+            # the new connection may be a peer messages are held for
+            self.flush_outbox()
+
+    def _map_connection(self, message, routing_id):
+        # monitor events only give the file descriptor, ZMQ_SRCFD is
+        # deprecated by libzmq but no other property matches them
+        try:
+            fd = message.get(zmq.SRCFD)
+        except (AttributeError, zmq.ZMQError):
+            # inproc:// connections have none
+            return
+        previous = self.connection_fds.get(routing_id)
+        if previous != fd and self.connections.get(previous) == routing_id:
+            # taken over, closing the old connection does not disconnect
+            # the peer
+            del self.connections[previous]
+        self.connections[fd] = routing_id
+        self.connection_fds[routing_id] = fd
+
+    def _unmap_connection(self, fd):
+        """
+        Forgets the connection of given file descriptor, returns the
+        routing_id it was the current connection of, or None.
+        """
+        routing_id = self.connections.pop(fd, None)
+        if routing_id is None or self.connection_fds.get(routing_id) != fd:
+            return None
+        del self.connection_fds[routing_id]
+        return routing_id
+
+    def hold_message(self, message):
+        """
+        Keeps a message the ROUTER socket could not route, until its peer
+        connects, sends something, or a retry succeeds.
+        """
+        routing_id = message[0]
+        held = self.outbox.put(routing_id, message)
+        if held is None:
+            self._reject_message(message)
+            return
+        if not held.scheduled:
+            held.scheduled = True
+            self.create_later_callback(
+                functools.partial(self.flush_outbox, routing_id),
+                self.outbox.next_delay(held))
+
+    def call_ids(self, message):
+        """
+        Returns ids of the calls sent by given message.
+        """
+        if message[4] == WORK:
+            return [message[3]]
+        elif message[4] == BATCH:
+            calls, _ = self.packer.unpackb(message[5], message[6:])
+            return [binascii.unhexlify(call[0]) for call in calls]
+        return []
+
+    def refresh_budget(self, message):
+        """
+        Packs again the seconds left carried by given WORK or BATCH
+        message, before it is sent again.
+        """
+        future_pool = self.future_pool
+        if message[4] == WORK and self.send_deadlines:
+            work = self.packer.unpackb(message[5], message[6:])
+            call = future_pool.get(message[3])
+            if len(work) != 4 or call is None:
+                return
+            name, args, kw, _ = work
+            buffers = []
+            body = self._pack_work(name, args, kw, buffers, call.deadline)
+        elif message[4] == BATCH:
+            calls, _ = self.packer.unpackb(message[5], message[6:])
+            calls = [(binascii.unhexlify(uid), name, args, kw)
+                     for uid, name, args, kw in calls]
+            deadlines = [future_pool[call[0]].deadline for call in calls
+                         if call[0] in future_pool]
+            if not deadlines:
+                return
+            buffers = []
+            body = self._pack_batch(calls, buffers, min(deadlines))
+        else:
+            return
+        # in place, the outbox knows messages by identity
+        message[5:] = [body] + buffers
+
+    def _reject_message(self, message):
+        error = UnreachablePeerError(
+            'Outbox is full, peer {!r} is unreachable'.format(message[0]))
+        calls = [self.future_pool.pop(uid, None)
+                 for uid in self.call_ids(message)]
+        calls = [call for call in calls if call is not None]
+        for call in calls:
+            call.future.set_exception(error)
+        if not calls:
+            logger.error(str(error))
+
+    def flush_outbox(self, routing_id=None):
+        """
+        Sends again messages held for given peer, or for every peer.
+        """
+        if routing_id is None:
+            routing_ids = self.outbox.routing_ids()
+        else:
+            routing_ids = [routing_id]
+        for routing_id in routing_ids:
+            messages = []
+            for message in self.outbox.take(routing_id):
+                if message[4] not in (WORK, BATCH) or any(
+                        uid in self.future_pool
+                        for uid in self.call_ids(message)):
+                    messages.append(message)
+                else:
+                    # nobody waits anymore for these replies
+                    self.outbox.discard(routing_id, message)
+            for message in messages:
+                self.refresh_budget(message)
+                # out-of-band frames follow the body
+                self.send_message(message, copy=len(message) == 6)
+
+    def handle_disconnected(self, routing_id):
+        """
+        Fails calls waiting for a reply of the peer known as given
+        routing_id and forgets it, its connection is closed.
+        """
+        logger.debug('Peer {!r} disconnected'.format(routing_id))
+        user_id = self._lookup_identity(routing_id)
+        for uid in self.peer_calls.pop(routing_id, ()):
+            # popped first, there is nobody to send a CANCEL to
+            call = self.future_pool.pop(uid, None)
+            if call is not None:
+                call.future.set_exception(PeerDisconnectedError(
+                    'Peer {!r} disconnected'.format(routing_id)))
+        self.forget_peer(user_id, routing_id)
+
     def connect(self, endpoint):
         self._setup_socket()
         self.socket.connect(endpoint)
@@ -180,51 +654,274 @@ class BaseRPC(object):
     def disconnect(self, endpoint):
         self.socket.disconnect(endpoint)
 
+    def _pack_work(self, name, args, kw, buffers, deadline):
+        mark = self.packer.mark_out_of_band
+        work = (name, tuple(mark(arg) for arg in args),
+                {key: mark(value) for key, value in kw.items()})
+        if self.send_deadlines:
+            # servers older than 0.1.0 only unpack 3 items; seconds left
+            # rather than the deadline, clocks of peers may differ
+            work += (deadline - time.time(),)
+        return self.packer.packb(work, buffers)
+
     def _prepare_work(self, user_id, name, *args, **kw):
+        """
+        Returns the WORK message of a call, its id and its deadline.
+        """
         routing_id = self.auth_backend.get_routing_id(user_id)
-        work = self.packer.packb((name, args, kw))
-        uid = uuid.uuid4().bytes
-        message = [routing_id, EMPTY_DELIMITER, VERSION, uid, WORK, work]
-        return message, uid
+        buffers = []
+        deadline = time.time() + self.timeout
+        work = self._pack_work(name, args, kw, buffers, deadline)
+        uid = next(self.message_ids)
+        message = [routing_id, EMPTY_DELIMITER, self.version, uid, WORK,
+                   work]
+        message.extend(buffers)
+        return message, uid, deadline
 
-    def create_timeout_detector(self, uuid):
-        self.create_later_callback(functools.partial(self.timeout_task, uuid),
-                                   self.timeout)
+    def add_pending_call(self, uid, future, user_id, routing_id, name=None,
+                         deadline=None):
+        """
+        Remembers future of the request identified by uid until it is
+        done, and arms its timeout.
+        """
+        if deadline is None:
+            deadline = time.time() + self.timeout
+        call = self.future_pool[uid] = PendingCall(
+            self, uid, future, deadline, user_id, routing_id, name)
+        try:
+            self.peer_calls[routing_id].add(uid)
+        except KeyError:
+            self.peer_calls[routing_id] = {uid}
+        self.create_timeout_detector(uid, deadline - time.time())
+        return call
+
+    def in_flight_memory(self):
+        """
+        Returns the number of pending calls and an estimate of the bytes
+        they use, their records, futures, ids and kept messages, with
+        their share of the tables.
+        """
+        size = (sys.getsizeof(self.future_pool) + self.timers.memory_size() +
+                sys.getsizeof(self.peer_calls) +
+                sum(sys.getsizeof(uids) for uids in self.peer_calls.values()))
+        for uid, call in self.future_pool.items():
+            size += (sys.getsizeof(call) + sys.getsizeof(call.future) +
+                     sys.getsizeof(uid))
+            if call.message is not None:
+                size += sum(sys.getsizeof(frame) for frame in call.message)
+        return {'calls': len(self.future_pool), 'bytes': size}
+
+    def batch(self, user_id=None):
+        """
+        Returns a :class:`Batch` of calls sent to given peer, by default
+        to :attr:`peer_routing_id`.
+        """
+        return Batch(self, user_id)
+
+    def _pack_batch(self, calls, buffers, deadline):
+        mark = self.packer.mark_out_of_band
+        return self.packer.packb(
+            ([(batch_id(uid), name, tuple(mark(arg) for arg in args),
+               {key: mark(value) for key, value in kw.items()})
+              for uid, name, args, kw in calls],
+             deadline - time.time()),
+            buffers)
+
+    def _prepare_batch(self, routing_id, calls, deadline):
+        buffers = []
+        body = self._pack_batch(calls, buffers, deadline)
+        message = [routing_id, EMPTY_DELIMITER, self.version,
+                   next(self.message_ids), BATCH, body]
+        message.extend(buffers)
+        return message
 
-    def cleanup_future(self, uuid, future):
+    def create_timeout_detector(self, uuid, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        self.timers.add(uuid, timeout)
+        if not self._timer_scheduled:
+            self._timer_scheduled = True
+            self.create_later_callback(self._on_timer_tick,
+                                       self.timers.resolution)
+
+    def _on_timer_tick(self):
+        self._timer_scheduled = False
+        for uuid in self.timers.advance():
+            self.timeout_task(uuid)
+        if len(self.timers) and not self._timer_scheduled:
+            self._timer_scheduled = True
+            self.create_later_callback(self._on_timer_tick,
+                                       self.timers.resolution)
+
+    def cleanup_future(self, uuid, future, routing_id=None):
+        call = self.future_pool.pop(uuid, None)
+        self.timers.discard(uuid)
+        if call is not None:
+            routing_id = call.routing_id
+        uids = self.peer_calls.get(routing_id)
+        if uids is not None:
+            uids.discard(uuid)
+            if not uids:
+                del self.peer_calls[routing_id]
+        if call is not None:
+            # done without a reply, e.g. timed out or cancelled,
+            # the peer can stop working on it
+            self.send_cancel(call)
+
+    def cancel(self, future):
+        """
+        Fails given future of a pending call with
+        :class:`pseud.interfaces.CallCancelledError`, and tells its peer
+        if ``send_cancels`` is set. Returns False if the call was already
+        done.
+        """
+        for uid, call in self.future_pool.items():
+            if call.future is future:
+                break
+        else:
+            return False
+        # popped before the future is done, a reply arriving meanwhile
+        # is ignored
+        self.cleanup_future(uid, future)
+        future.set_exception(CallCancelledError(
+            'Call {!r} cancelled'.format(call.name)))
+        return True
+
+    def send_cancel(self, call):
+        if not self.send_cancels:
+            # servers older than 0.1.0 do not know CANCEL
+            return
+        if (call.routing_id in self.outbox or self.socket is None or
+                self.socket.closed):
+            # the request itself was not sent
+            return
+        self.send_message([call.routing_id, EMPTY_DELIMITER, self.version,
+                           call.uid, CANCEL, b''])
+
+    def cancel_job(self, routing_id, message_uuid):
+        """
+        Stops the job requested by given message, its reply is not sent.
+        """
+        job = self.running_jobs.pop((routing_id, message_uuid), None)
+        if job is not None:
+            logger.debug('Job {!r} cancelled by {!r}'.format(
+                message_uuid, routing_id))
+            self._stop_job(job)
+
+    def _current_job(self):
+        """
+        Returns what :meth:`_stop_job` needs to stop the running job.
+        """
+        return True
+
+    def _stop_job(self, job):
+        pass
+
+    def _get_serializer(self, version):
+        """
+        Returns the serializer announced by given :term:`VERSION` frame,
+        or None if it is not accepted.
+        """
         try:
-            del self.future_pool[uuid]
+            return self._serializers[version]
         except KeyError:
             pass
+        base, _, name = version.partition(b'/')
+        name = name.decode('utf-8') or 'msgpack'
+        if base != VERSION or name not in self.accepted_serializers:
+            return None
+        serializer = self._serializers[version] = zope.component.getAdapter(
+            self, ISerializer, name=name)
+        return serializer
+
+    def _get_error_serializer(self, version):
+        """
+        Returns the serializer of an ERROR message with given
+        :term:`VERSION` frame. Errors about the serializer itself are
+        packed by msgpack under the bare VERSION, even if it is not
+        accepted.
+        """
+        packer = self._get_serializer(version)
+        if packer is None and version == VERSION:
+            # not cached, other messages with the bare VERSION are refused
+            packer = zope.component.getAdapter(self, ISerializer,
+                                               name='msgpack')
+        return packer
+
+    def _reject_serializer(self, message_type, routing_id, message_uuid,
+                           version):
+        """
+        Answers a message whose serializer is not accepted: the caller
+        of a request gets an ERROR it can read, calls waiting for
+        a reply fail.
+        """
+        logger.error('Unsupported serializer received {!r}'.format(version))
+        error = ('UnsupportedSerializerError',
+                 'Serializer {!r} is not accepted, accepted: {}'.format(
+                     version, ', '.join(sorted(self.accepted_serializers))),
+                 '')
+        if message_type in (WORK, BATCH):
+            packer = self._get_error_serializer(VERSION)
+            self.send_message([routing_id, EMPTY_DELIMITER, VERSION,
+                               message_uuid, ERROR, packer.packb(error)])
+            return
+        for uid in self._message_calls(message_uuid):
+            self._resolve_error(uid, error)
+
+    def _message_calls(self, message_uuid):
+        """
+        Returns ids of the pending calls answered by given message,
+        its own or those of the BATCH it replies to.
+        """
+        if message_uuid in self.future_pool:
+            return [message_uuid]
+        return [uid for uid, call in self.future_pool.items()
+                if call.batch == message_uuid]
 
     def on_socket_ready(self, response):
-        if len(response) == 4:
-            # From REQ socket
-            version, message_uuid, message_type = map(bytes, response[:-1])
-            message = response[-1]
+        # Frame.bytes is cached by pyzmq, and cheaper than a memoryview
+        # for such tiny frames; the delimiter is never looked at.
+        if self.socket_type == zmq.REQ:
+            header_size = 3
             routing_id = None
         else:
             # from ROUTER socket
-            routing_id, delimiter, version, message_uuid, message_type = map(
-                bytes, response[:-1])
-            message = response[-1]
-        try:
-            user_id = message.get(b'User-Id').encode('utf-8')
-        except zmq.ZMQError:
-            # no zap handler
-            user_id = b''
-        else:
-            self.auth_backend.register_routing_id(user_id, routing_id)
+            header_size = 5
+            routing_id = _frame_bytes(response[0])
+        version = _frame_bytes(response[header_size - 3])
+        message_uuid = _frame_bytes(response[header_size - 2])
+        message_type = _frame_bytes(response[header_size - 1])
+        # frames following the body carry out-of-band buffers
+        message = response[header_size]
+        buffers = response[header_size + 1:]
+        user_id = self._lookup_identity(routing_id)
+        if user_id is not None:
+            # peers sending anything are not idle
+            self.peers.touch(user_id, routing_id)
+            # those evicted meanwhile are identified again
+            user_id = self._lookup_identity(routing_id)
+        if user_id is None:
+            user_id = self._identify(message, routing_id)
+            self.peers.touch(user_id, routing_id)
+        if routing_id in self.outbox:
+            self.flush_outbox(routing_id)
 
+        if message_type == ERROR:
+            packer = self._get_error_serializer(version)
+        elif message_type in SERIALIZED_TYPES:
+            packer = self._get_serializer(version)
+        else:
+            # control messages always carry the bare VERSION, hello is
+            # packed by the auth backend itself
+            packer = self.packer
         if logger.isEnabledFor(logging.DEBUG):
             logger.debug('Message received for {!r}: {!r} {}'.format(
                 self.user_id,
-                map(bytes, response[:-1]),
+                [bytes(frame) for frame in response[:header_size]],
                 pprint.pformat(
-                    self.packer.unpackb(response[-1])
-                    if message_type in (WORK, OK, HELLO)
-                    else bytes(response[-1]))))
-        assert version == VERSION
+                    packer.unpackb(message, buffers)
+                    if packer is not None and message_type in SERIALIZED_TYPES
+                    else bytes(message))))
         if not self.auth_backend.is_authenticated(user_id):
             if message_type != HELLO:
                 self.auth_backend.handle_authentication(user_id, routing_id,
@@ -232,83 +929,318 @@ class BaseRPC(object):
             else:
                 self.auth_backend.handle_hello(user_id, routing_id,
                                                message_uuid, message)
+            return
+        self.heartbeat_backend.handle_heartbeat(user_id, routing_id)
+        if packer is None:
+            return self._reject_serializer(message_type, routing_id,
+                                           message_uuid, version)
+        try:
+            handler = self.message_handlers[message_type]
+        except KeyError:
+            logger.error('Unknown message_type'
+                         ' received {!r}'.format(message_type))
+            raise NotImplementedError
+        return handler(self, message, routing_id, user_id, message_uuid,
+                       buffers, version)
+
+    def freeze_routes(self):
+        """
+        Compiles the registry into a static dispatch table used for every
+        incoming job instead of querying the registry.
+        rpc-callables registered afterwards are ignored until this method
+        is called again.
+        """
+        self.routes = compile_routes(self.registry)
+
+    def unfreeze_routes(self):
+        self.routes = None
+
+    def _identify(self, message, routing_id):
+        """
+        Reads the user_id given by the zap handler to the connection of
+        given message and remembers it until the peer is forgotten.
+        """
+        try:
+            user_id = message.get(b'User-Id').encode('utf-8')
+        except zmq.ZMQError:
+            # no zap handler
+            user_id = b''
         else:
-            self.heartbeat_backend.handle_heartbeat(user_id, routing_id)
-            if message_type == WORK:
-                self._handle_work(message, routing_id, user_id, message_uuid)
-            elif message_type == OK:
-                return self._handle_ok(message, message_uuid)
-            elif message_type == ERROR:
-                self._handle_error(message, message_uuid)
-            elif message_type == AUTHENTICATED:
-                self.auth_backend.handle_authenticated(message)
-            elif message_type == UNAUTHORIZED:
-                self.auth_backend.handle_authentication(user_id, routing_id,
-                                                        message_uuid)
-            elif message_type == HELLO:
-                self.auth_backend.handle_hello(user_id, routing_id,
-                                               message_uuid, message)
-            elif message_type == HEARTBEAT:
-                # Can ignore, because every message is an heartbeat
-                pass
-            else:
-                logger.error('Unknown message_type'
-                             ' received {!r}'.format(message_type))
-                raise NotImplementedError
+            self.auth_backend.register_routing_id(user_id, routing_id)
+        if routing_id is not None:
+            self.identities[routing_id] = user_id
+            if self.monitor_socket is not None:
+                self._map_connection(message, routing_id)
+        return user_id
+
+    def _lookup_identity(self, routing_id):
+        generation = self._identities_generation
+        if generation != self._identities_checked:
+            self.identities.clear()
+            self._identities_checked = generation
+        forgotten = self._forgotten_identities
+        while forgotten:
+            self.identities.pop(forgotten.popleft(), None)
+        return self.identities.get(routing_id)
+
+    def forget_identity(self, routing_id=None):
+        """
+        Forget the user_id of the connection known as given routing_id,
+        or of every connection, before the next message is read.
+        Must be called when a peer disconnects. Every identity is
+        forgotten when a new connection is authenticated, as it may take
+        over a known routing_id. Safe from the zap thread.
+        """
+        if routing_id is None:
+            self._identities_generation += 1
+        else:
+            self._forgotten_identities.append(routing_id)
+
+    def forget_peer(self, user_id, routing_id):
+        """
+        Drops everything known about given peer,
+        e.g. when it is disconnected.
+        """
+        self.peers.forget(user_id, routing_id)
+        self.forget_identity(routing_id)
+
+    def invalidate_predicates(self, user_id=None):
+        """
+        Forget cached predicate decisions for given user_id,
+        or for every peer.
+        Authentication backends must call it when permissions of a peer
+        change.
+        """
+        if self.predicate_cache is not None:
+            self.predicate_cache.invalidate(user_id)
+
+    def _get_rpc_callable(self, locator, user_id):
+        if self.routes is None:
+            candidates = get_route_index(self.registry).get(locator, ())
+            # RPCCallable.test() looks up the predicate by itself
+            routes = zip(candidates, candidates)
+        else:
+            routes = self.routes.get(locator, ())
+        cache = self.predicate_cache
+        predicate_arguments = None
+        for rpc_call, predicate in routes:
+            key = (locator, rpc_call.domain, user_id)
+            allowed = None if cache is None else cache.get(key)
+            if allowed is None:
+                if predicate_arguments is None:
+                    predicate_arguments = (
+                        self.auth_backend.get_predicate_arguments(user_id))
+                allowed = bool(predicate.test(**predicate_arguments))
+                if cache is not None:
+                    cache[key] = allowed
+            if allowed:
+                return rpc_call
+        raise ServiceNotFoundError(locator)
 
     def _handle_work_proxy(self, locator, args, kw, user_id,
-                           message_uuid):
-        worker_callable = get_rpc_callable(
-            locator,
-            registry=self.registry,
-            **self.auth_backend.get_predicate_arguments(user_id))
+                           message_uuid, deadline=None):
+        worker_callable = self._get_rpc_callable(locator, user_id)
+        if worker_callable.with_context:
+            return worker_callable(CallContext(user_id, deadline),
+                                   *args, **kw)
         if worker_callable.with_identity:
             return worker_callable(user_id, *args, **kw)
         return worker_callable(*args, **kw)
 
-    def _handle_work(self, message, routing_id, user_id, message_uuid):
-        locator, args, kw = self.packer.unpackb(message)
+    def _unpack_work(self, packer, message, buffers):
+        """
+        Returns locator, args, kw and deadline of a WORK body, or None if
+        its deadline is over.
+        """
+        work = packer.unpackb(message, buffers)
+        # peers without deadline propagation send 3 items
+        budget = work[3] if len(work) > 3 else None
+        if budget is None:
+            return work[0], work[1], work[2], None
+        if budget <= 0:
+            logger.warning('Job {!r} expired {:.3f}s ago, dropped'.format(
+                work[0], -budget))
+            return None
+        return work[0], work[1], work[2], time.time() + budget
+
+    def _unpack_batch(self, packer, message, buffers):
+        """
+        Returns calls and deadline of a BATCH body, or None if its
+        deadline is over.
+        """
+        calls, budget = packer.unpackb(message, buffers)
+        if budget <= 0:
+            logger.warning('Batch of {} jobs expired, dropped'.format(
+                len(calls)))
+            return None
+        return [(binascii.unhexlify(uid), name, args, kw)
+                for uid, name, args, kw in calls], time.time() + budget
+
+    def _run_job(self, locator, args, kw, user_id, message_uuid, deadline):
+        """
+        Returns status and result of a job.
+        """
         try:
             try:
                 result = self._handle_work_proxy(locator, args, kw, user_id,
-                                                 message_uuid, )
+                                                 message_uuid, deadline)
             except ServiceNotFoundError:
                 if self.proxy_to is None:
                     raise
                 else:
                     result = self.proxy_to._handle_work_proxy(locator, args,
                                                               kw, user_id,
-                                                              message_uuid)
+                                                              message_uuid,
+                                                              deadline)
 
         except Exception as error:
             logger.exception('Pseud job failed')
             traceback_ = traceback.format_exc()
             name = error.__class__.__name__
             message = str(error)
-            result = (name, message, traceback_)
-            status = ERROR
-        else:
-            status = OK
-        response = self.packer.packb(result)
-        message = [routing_id, EMPTY_DELIMITER, VERSION, message_uuid, status,
+            return ERROR, (name, message, traceback_)
+        return OK, result
+
+    def _handle_work(self, message, routing_id, user_id, message_uuid,
+                     buffers=(), version=None):
+        version = version or self.version
+        packer = self._serializers[version]
+        work = self._unpack_work(packer, message, buffers)
+        if work is None:
+            return
+        locator, args, kw, deadline = work
+        job_key = (routing_id, message_uuid)
+        self.running_jobs[job_key] = self._current_job()
+        try:
+            status, result = self._run_job(locator, args, kw, user_id,
+                                           message_uuid, deadline)
+        finally:
+            cancelled = self.running_jobs.pop(job_key, None) is None
+        if cancelled:
+            # nobody waits for the reply
+            return
+        buffers = []
+        response = packer.packb(packer.mark_out_of_band(result), buffers)
+        message = [routing_id, EMPTY_DELIMITER, version, message_uuid, status,
                    response]
+        message.extend(buffers)
         if logger.isEnabledFor(logging.DEBUG):
             logger.debug('Worker send reply {!r} {!r}'.format(
-                message[:-1],
+                message[:5],
                 pprint.pformat(result))
             )
-        self.send_message(message)
+        self.send_message(message, copy=not buffers)
+
+    def _start_batch(self, routing_id, calls):
+        """
+        Registers the jobs of a batch, returns what stops each of them.
+        """
+        for call in calls:
+            self.running_jobs[(routing_id, call[0])] = True
+        if self.concurrent_batches:
+            # each job is stopped by itself
+            return None
+        # a job can not be stopped without the rest of the batch,
+        # cancelled jobs are skipped or their result dropped
+        return True
 
-    def _handle_ok(self, message, message_uuid):
-        value = self.packer.unpackb(message)
+    def _run_batched_job(self, routing_id, user_id, deadline, job, call):
+        """
+        Returns message id, status and result of a job of a batch,
+        or None if it has been cancelled.
+        """
+        message_uuid, locator, args, kw = call
+        job_key = (routing_id, message_uuid)
+        if job_key not in self.running_jobs:
+            return None
+        if deadline is not None and deadline <= time.time():
+            logger.warning('Batched job {!r} expired, dropped'.format(
+                locator))
+            # the caller gave up on the rest of the batch
+            del self.running_jobs[job_key]
+            return None
+        self.running_jobs[job_key] = job or self._current_job()
+        try:
+            status, result = self._run_job(locator, args, kw, user_id,
+                                           message_uuid, deadline)
+        finally:
+            cancelled = self.running_jobs.pop(job_key, None) is None
+        if cancelled:
+            return None
+        return message_uuid, status, result
+
+    def _map_jobs(self, func, calls):
+        return [func(call) for call in calls]
+
+    def _handle_batch(self, message, routing_id, user_id, message_uuid,
+                      buffers=(), version=None):
+        version = version or self.version
+        packer = self._serializers[version]
+        batch = self._unpack_batch(packer, message, buffers)
+        if batch is None:
+            return
+        calls, deadline = batch
+        job = self._start_batch(routing_id, calls)
+        results = self._map_jobs(
+            functools.partial(self._run_batched_job, routing_id, user_id,
+                              deadline, job),
+            calls)
+        self._send_batch_reply(routing_id, version, message_uuid, results)
+
+    def _send_batch_reply(self, routing_id, version, message_uuid, results):
+        results = [result for result in results if result is not None]
+        if not results:
+            return
+        packer = self._serializers[version]
+        mark = packer.mark_out_of_band
+        buffers = []
+        response = packer.packb(
+            [(batch_id(uid), ord(status),
+              mark(result) if status == OK else result)
+             for uid, status, result in results],
+            buffers)
+        message = [routing_id, EMPTY_DELIMITER, version, message_uuid,
+                   BATCH_REPLY, response]
+        message.extend(buffers)
+        logger.debug('Worker send {} batched replies {!r}'.format(
+            len(results), message[:5]))
+        self.send_message(message, copy=not buffers)
+
+    def _handle_ok(self, message, message_uuid, buffers=(), version=None):
+        packer = self._serializers[version or self.version]
+        value = packer.unpackb(message, buffers)
         logger.debug('Client result {!r} from {!r}'.format(value,
                                                            message_uuid))
-        future = self.future_pool.pop(message_uuid)
+        self._resolve_ok(message_uuid, value)
+
+    def _handle_error(self, message, message_uuid, version=None):
+        value = self._get_error_serializer(version or self.version).unpackb(
+            message)
+        # a whole batch fails, e.g. when its serializer is not accepted
+        for uid in self._message_calls(message_uuid) or [message_uuid]:
+            self._resolve_error(uid, value)
+
+    def _handle_batch_reply(self, message, buffers=(), version=None):
+        results = self._serializers[version or self.version].unpackb(
+            message, buffers)
+        for uid, status, value in results:
+            message_uuid = binascii.unhexlify(uid)
+            if message_uuid not in self.future_pool:
+                logger.debug('Late batched reply for {!r}'.format(
+                    message_uuid))
+                continue
+            if status == ord(OK):
+                self._resolve_ok(message_uuid, value)
+            else:
+                self._resolve_error(message_uuid, value)
+
+    def _resolve_ok(self, message_uuid, value):
+        future = self.future_pool.pop(message_uuid).future
         self._store_result_in_future(future, value)
 
-    def _handle_error(self, message, message_uuid):
-        value = self.packer.unpackb(message)
-        future = self.future_pool.pop(message_uuid, DummyFuture())
+    def _resolve_error(self, message_uuid, value):
+        call = self.future_pool.pop(message_uuid, None)
+        future = DummyFuture() if call is None else call.future
         klass, message, traceback = value
         full_message = '\n'.join((format_remote_traceback(traceback),
                                   message))
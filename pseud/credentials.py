@@ -0,0 +1,203 @@
+import hashlib
+import hmac
+import os
+import sqlite3
+import threading
+
+from .cache import LRUCache
+
+_unknown = object()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    login TEXT PRIMARY KEY,
+    salt BLOB NOT NULL,
+    iterations INTEGER NOT NULL,
+    password_hash BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS public_keys (
+    public_key BLOB PRIMARY KEY,
+    login TEXT NOT NULL
+);
+"""
+
+
+def _to_bytes(value):
+    if isinstance(value, bytes):
+        return value
+    return value.encode('utf-8')
+
+
+def _to_text(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
+
+
+class SQLiteCredentialStore(object):
+    """
+    Logins with their salted password hash, and binary CURVE public keys
+    with the login they belong to, in a SQLite database.
+
+    Answers are cached, successful ones for ``ttl`` seconds and failures
+    for ``negative_ttl`` seconds, so that known peers reconnecting and
+    peers retrying bad credentials do not hit the disk.
+    At most ``max_failures`` wrong passwords are hashed by login every
+    ``negative_ttl`` seconds, so that guessing passwords can not keep
+    the store busy.
+    Changes made through another store, e.g. another process, are seen
+    once cached answers expire.
+    """
+    iterations = 10000
+    cache_size = 100000
+    ttl = 300
+    negative_ttl = 30
+    max_failures = 5
+
+    def __init__(self, path):
+        self.path = path
+        # store may be used from the zap thread and provisioned from the
+        # loop, caches and connection are guarded together
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+        self.passwords = LRUCache(maxsize=self.cache_size, ttl=self.ttl)
+        self.bad_passwords = LRUCache(maxsize=self.cache_size,
+                                      ttl=self.negative_ttl)
+        # wrong passwords by login
+        self.failures = LRUCache(maxsize=self.cache_size,
+                                 ttl=self.negative_ttl)
+        self.public_keys = LRUCache(maxsize=self.cache_size, ttl=self.ttl)
+        self.unknown_public_keys = LRUCache(maxsize=self.cache_size,
+                                            ttl=self.negative_ttl)
+
+    def _query(self, query, *args):
+        return self.connection.execute(query, args).fetchone()
+
+    def _execute(self, query, *args):
+        with self.connection:
+            self.connection.execute(query, args)
+
+    def _hash(self, password, salt, iterations):
+        return hashlib.pbkdf2_hmac('sha256', _to_bytes(password), salt,
+                                   iterations)
+
+    def _credentials_key(self, login, password):
+        # do not keep clear passwords in memory
+        return hashlib.sha256(_to_bytes(login) + b'\0' +
+                              _to_bytes(password)).digest()
+
+    def check_password(self, login, password):
+        """
+        Returns True if password is the one of login.
+        After ``max_failures`` wrong passwords for a login, its passwords
+        are refused without being checked until the first failure is
+        ``negative_ttl`` seconds old.
+        """
+        key = self._credentials_key(login, password)
+        login = _to_text(login)
+        with self.lock:
+            if key in self.passwords:
+                return True
+            if key in self.bad_passwords:
+                return False
+            failures = self.failures.get(login)
+            if failures is not None and failures[0] >= self.max_failures:
+                return False
+            row = self._query('SELECT salt, iterations, password_hash'
+                              ' FROM users WHERE login = ?', login)
+        # hashing is slow on purpose, other lookups do not wait for it
+        if row is not None:
+            salt, iterations, password_hash = row
+            valid = hmac.compare_digest(
+                self._hash(password, bytes(salt), iterations),
+                bytes(password_hash))
+        else:
+            valid = False
+        with self.lock:
+            if valid:
+                self.passwords[key] = login
+                return True
+            self.bad_passwords[key] = True
+            failures = self.failures.get(login)
+            if failures is None:
+                # counted in place, the window starts at the first failure
+                self.failures[login] = [1]
+            else:
+                failures[0] += 1
+        return False
+
+    def get_login(self, public_key):
+        """
+        Returns login owning given binary public key, or None.
+        """
+        with self.lock:
+            return self._get_login(public_key)
+
+    def _get_login(self, public_key):
+        login = self.public_keys.get(public_key, _unknown)
+        if login is not _unknown:
+            return login
+        if public_key in self.unknown_public_keys:
+            return None
+        row = self._query('SELECT login FROM public_keys'
+                          ' WHERE public_key = ?', sqlite3.Binary(public_key))
+        if row is None:
+            self.unknown_public_keys[public_key] = True
+            return None
+        self.public_keys[public_key] = row[0]
+        return row[0]
+
+    def add_user(self, login, password):
+        """
+        Creates login, or changes its password.
+        """
+        salt = os.urandom(16)
+        password_hash = self._hash(password, salt, self.iterations)
+        with self.lock:
+            self._execute('INSERT OR REPLACE INTO users'
+                          ' (login, salt, iterations, password_hash)'
+                          ' VALUES (?, ?, ?, ?)',
+                          _to_text(login), sqlite3.Binary(salt),
+                          self.iterations, sqlite3.Binary(password_hash))
+            self.invalidate()
+
+    def remove_user(self, login):
+        """
+        Removes login and its public keys.
+        """
+        with self.lock:
+            self._execute('DELETE FROM users WHERE login = ?',
+                          _to_text(login))
+            self._execute('DELETE FROM public_keys WHERE login = ?',
+                          _to_text(login))
+            self.invalidate()
+
+    def add_public_key(self, public_key, login):
+        """
+        Trusts given binary public key as login.
+        """
+        with self.lock:
+            self._execute('INSERT OR REPLACE INTO public_keys'
+                          ' (public_key, login) VALUES (?, ?)',
+                          sqlite3.Binary(public_key), _to_text(login))
+            self.invalidate()
+
+    def remove_public_key(self, public_key):
+        with self.lock:
+            self._execute('DELETE FROM public_keys WHERE public_key = ?',
+                          sqlite3.Binary(public_key))
+            self.invalidate()
+
+    def invalidate(self):
+        """
+        Forget cached answers.
+        """
+        with self.lock:
+            for cache in (self.passwords, self.bad_passwords, self.failures,
+                          self.public_keys, self.unknown_public_keys):
+                cache.clear()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
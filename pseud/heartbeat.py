@@ -99,10 +99,29 @@ class TestingHeartbeatBackendForClient(_BaseHeartbeatBackend):
 class TestingHeartbeatBackendForServer(_BaseHeartbeatBackend):
     name = b'testing_heartbeat_backend'
     max_time_before_dead = .2
-    callback_pool = {}
+
+    def __init__(self, rpc):
+        self.rpc = rpc
+        self.callback_pool = rpc.peers.table('heartbeat_callbacks',
+                                             on_evict=self._evicted)
+
+    def _cancel(self, callback):
+        try:
+            self.rpc.io_loop.remove_timeout(callback)
+        except AttributeError:
+            callback.kill()
+
+    def _evicted(self, user_id, callback):
+        # forgotten peers, e.g. disconnected ones, are gone too
+        self._cancel(callback)
+        self.monitoring_socket.send(
+            'Gone {!r}'.format(bytes(user_id)).encode())
 
     def handle_timeout(self, user_id, routing_id):
         logger.debug('Timeout detected for {!r}'.format(routing_id))
+        # this callback is running, forgetting the peer must not cancel it
+        self.callback_pool.pop(user_id, None)
+        self.rpc.forget_peer(user_id, routing_id)
         self.monitoring_socket.send(
             'Gone {!r}'.format(bytes(user_id)).encode())
 
@@ -110,10 +129,7 @@ class TestingHeartbeatBackendForServer(_BaseHeartbeatBackend):
         self.monitoring_socket.send(user_id)
         previous = self.callback_pool.pop(user_id, None)
         if previous is not None:
-            try:
-                self.rpc.io_loop.remove_timeout(previous)
-            except AttributeError:
-                previous.kill()
+            self._cancel(previous)
         self.callback_pool[user_id] = self.rpc.create_later_callback(
             functools.partial(self.handle_timeout, user_id, routing_id),
             self.max_time_before_dead)
@@ -125,8 +141,5 @@ class TestingHeartbeatBackendForServer(_BaseHeartbeatBackend):
     def stop(self):
         self.monitoring_socket.close(linger=0)
         for callback in self.callback_pool.values():
-            try:
-                self.rpc.io_loop.remove_timeout(callback)
-            except AttributeError:
-                callback.kill()
+            self._cancel(callback)
         self.callback_pool.clear()
@@ -3,6 +3,9 @@ import zope.interface
 
 
 AUTHENTICATED = b'\x04'
+BATCH = b'\x07'
+BATCH_REPLY = b'\x08'
+CANCEL = b'\x05'
 ERROR = b'\x10'
 HEARTBEAT = b'\x06'
 HELLO = b'\x02'
@@ -27,6 +30,26 @@ class UnauthorizedError(Exception):
     pass
 
 
+class PeerDisconnectedError(Exception):
+    pass
+
+
+class UnreachablePeerError(Exception):
+    pass
+
+
+class BatchDiscardedError(Exception):
+    pass
+
+
+class CallCancelledError(Exception):
+    pass
+
+
+class UnsupportedSerializerError(Exception):
+    pass
+
+
 class IAuthenticationBackend(zope.interface.Interface):
 
     rpc = zope.interface.Attribute("""
@@ -70,6 +93,7 @@ class IAuthenticationBackend(zope.interface.Interface):
         """
         Useful to resend the last work request, after sucessful
         authenctication challenge.
+        Called with every WORK and BATCH message sent.
         """
 
     def is_authenticated(user_id):
@@ -120,6 +144,18 @@ class IBaseRPC(zope.interface.Interface):
     secret_key = zope.interface.Attribute("""
         Z85 encoded private key of the zeromq curve keypair
         """)
+    credentials_database = zope.interface.Attribute("""
+        Path of the SQLite database of the ``'sqlite_plain'`` and
+        ``'sqlite_curve'`` security plugins.
+        """)
+    zap_thread = zope.interface.Attribute("""
+        If True, ZAP requests are answered from a dedicated thread
+        instead of the loop of the RPC.
+        """)
+    certificates_directory = zope.interface.Attribute("""
+        Directory of the public certificates of allowed peers,
+        for the ``'curve_certificates'`` security plugin.
+        """)
     heartbeat_plugin = zope.interface.Attribute("""
         Name of the plugin used as heartbeat backend
         """)
@@ -136,6 +172,79 @@ class IBaseRPC(zope.interface.Interface):
     timeout = zope.interface.Attribute("""
         Max allowed time to send, recv or to wait for a task.
         """)
+    packer = zope.interface.Attribute("""
+        :class:`ISerializer` of bodies sent by this RPC, chosen by name
+        with ``serializer``. The default, ``'msgpack'``, compresses bodies
+        larger than ``compression_threshold`` with the ``compression``
+        codec, e.g. ``'zlib'``, if given. Compressed bodies received are
+        refused beyond ``max_decompressed_size`` bytes once decompressed.
+        """)
+    accepted_serializers = zope.interface.Attribute("""
+        Names of the serializers accepted for incoming jobs.
+        Defaults to the RPC own serializer.
+        """)
+    predicate_cache = zope.interface.Attribute("""
+        Cache of predicate decisions per rpc-callable, domain and peer,
+        or None if disabled (``predicate_cache_size=0``).
+        """)
+    peers = zope.interface.Attribute("""
+        :class:`pseud.cache.PeerStateStore` where backends keep their
+        state about peers, bounded to ``max_peers`` per table and
+        evicting peers idle for ``peer_idle_timeout`` seconds.
+        """)
+    monitor = zope.interface.Attribute("""
+        If True, the socket is monitored to detect peer disconnections.
+        True by default.
+        """)
+    connections = zope.interface.Attribute("""
+        routing_id of monitored connections by file descriptor.
+        """)
+    connection_fds = zope.interface.Attribute("""
+        File descriptor of the current connection of a routing_id,
+        disconnections of the others are ignored.
+        """)
+    future_pool = zope.interface.Attribute("""
+        :class:`pseud.common.PendingCall` of requests waiting for their
+        reply, by message id.
+        """)
+    peer_calls = zope.interface.Attribute("""
+        Message ids of the calls of :attr:`future_pool`, by routing_id of
+        their peer.
+        """)
+    concurrent_batches = zope.interface.Attribute("""
+        If True, jobs of a batch run concurrently,
+        else one after the other.
+        """)
+    send_deadlines = zope.interface.Attribute("""
+        If True, WORK messages carry the seconds left before the call
+        times out. Servers older than 0.1.0 do not answer them, enable it
+        once servers are upgraded. False by default.
+        """)
+    send_cancels = zope.interface.Attribute("""
+        If True, calls done without a reply send a CANCEL message to their
+        peer. Servers older than 0.1.0 fail on them, enable it once
+        servers are upgraded. False by default.
+        """)
+    running_jobs = zope.interface.Attribute("""
+        Jobs being executed for peers, by routing_id and message id.
+        """)
+    message_ids = zope.interface.Attribute("""
+        Iterator of the ids of sent requests,
+        see :func:`pseud.common.message_ids`.
+        """)
+    timers = zope.interface.Attribute("""
+        :class:`pseud.timer.TimerWheel` of pending futures timeouts,
+        expired every ``timer_resolution`` seconds.
+        """)
+    outbox = zope.interface.Attribute("""
+        :class:`pseud.cache.Outbox` of messages held for peers the socket
+        does not know yet, at most ``outbox_size`` by peer and
+        ``max_outbox_size`` overall.
+        """)
+    identities = zope.interface.Attribute("""
+        user_id of known connections by routing_id, read once from the
+        connection metadata, at most ``identity_cache_size`` of them.
+        """)
 
     def connect(endpoint):
         """
@@ -161,15 +270,57 @@ class IBaseRPC(zope.interface.Interface):
             Keyword arguments of the rpc-callable
         """
 
-    def create_timeout_detector(uuid):
+    def add_pending_call(uid, future, user_id, routing_id, name=None,
+                         deadline=None):
+        """
+        Store the future of the request identified by uid in
+        :attr:`future_pool` until it is done, and arm its timeout.
+        deadline is the wall clock time it expires at, by default timeout
+        seconds from now.
+        """
+
+    def batch(user_id=None):
+        """
+        Return a :class:`pseud.common.Batch`, calls made through it
+        are sent to given peer in a single message.
+        """
+
+    def cancel(future):
+        """
+        Fail given future of a pending call with
+        :class:`CallCancelledError` and tell its peer, see
+        :meth:`send_cancel`. Return False if the call was already done.
+        """
+
+    def send_cancel(call):
+        """
+        Tell the peer of given :class:`pseud.common.PendingCall` its reply
+        is not awaited anymore, if :attr:`send_cancels` is set.
+        """
+
+    def cancel_job(routing_id, message_uuid):
+        """
+        Stop the job requested by given message, if still running,
+        and drop its reply.
+        """
+
+    def in_flight_memory():
         """
-        Run in background a timeout task to terminate
-        the future linked to given uuid
+        Return the number of pending calls and an estimate of the bytes
+        they use.
         """
 
-    def cleanup_future(uuid, future):
+    def create_timeout_detector(uuid, timeout=None):
         """
-        Destroy the future kept in memory if any.
+        Arm a timer in :attr:`timers` that runs :meth:`timeout_task` for
+        given uuid once given timeout, by default the one of the RPC,
+        is elapsed.
+        """
+
+    def cleanup_future(uuid, future, routing_id=None):
+        """
+        Destroy the future kept in memory if any, and forget it from
+        :attr:`peer_calls` of given routing_id.
         """
 
     def on_socket_ready(message):
@@ -184,6 +335,68 @@ class IBaseRPC(zope.interface.Interface):
         decorator to register rpc endpoint only for this RPC instance.
         """
 
+    def handle_disconnected(routing_id):
+        """
+        Called when the connection of given peer is closed:
+        fails calls waiting for its reply and forgets it.
+        """
+
+    def hold_message(message):
+        """
+        Keep a message its peer is not connected for yet, fails its calls
+        with :class:`UnreachablePeerError` if :attr:`outbox` is full.
+        """
+
+    def call_ids(message):
+        """
+        Returns message ids of the calls sent by given WORK or BATCH
+        message, none for other messages.
+        """
+
+    def flush_outbox(routing_id=None):
+        """
+        Send again messages held for given peer or for every peer.
+        """
+
+    def refresh_budget(message):
+        """
+        Pack again the seconds left carried by given WORK or BATCH
+        message, from the deadlines of its pending calls, before it is
+        sent again.
+        """
+
+    def forget_peer(user_id, routing_id):
+        """
+        Drop the state of given peer from :attr:`peers` and its identity.
+        Heartbeat backends call it when a peer is gone.
+        """
+
+    def forget_identity(routing_id=None):
+        """
+        Forget the user_id of given connection or of every connection
+        before the next message is read, safe from the zap thread.
+        Called when a peer disconnects or is evicted from a table of
+        :attr:`peers`, and when a new connection is authenticated.
+        """
+
+    def invalidate_predicates(user_id=None):
+        """
+        Forget cached predicate decisions for given user_id
+        or for every peer if None.
+        """
+
+    def freeze_routes():
+        """
+        Build a static dispatch table from the registry, and use it
+        instead of the registry to route incoming jobs.
+        Must be called again to take new registrations into account.
+        """
+
+    def unfreeze_routes():
+        """
+        Discard the static dispatch table and route jobs with the registry.
+        """
+
     def start():
         """
         Run all background tasks, plugins included.
@@ -270,6 +483,36 @@ class IHeartbeatBackend(zope.interface.Interface):
         """
 
 
+class ISerializer(zope.interface.Interface):
+    """
+    Interface for serializers of message bodies.
+    Peers announce the serializer they use in the :term:`VERSION` frame.
+    """
+
+    name = zope.interface.Attribute("""
+        Name of the serializer, announced to peers
+        """)
+
+    def mark_out_of_band(value):
+        """
+        Return what must be packed instead of value, to let the serializer
+        send it as an out-of-band buffer.
+        Serializers without out-of-band support return value itself.
+        """
+
+    def packb(data, buffers=None):
+        """
+        Serialize data, and append out-of-band buffers to ``buffers``
+        if it is a list.
+        Must return bytes.
+        """
+
+    def unpackb(packed, buffers=()):
+        """
+        Deserialize packed, with the out-of-band frames received with it.
+        """
+
+
 class IRPCCallable(zope.interface.Interface):
     """
     Wrapper around callable.
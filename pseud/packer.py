@@ -34,47 +34,293 @@ import functools
 import itertools
 import logging
 import pickle
+import struct
+import zlib
 
+import dateutil.tz
 import msgpack
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 logger = logging.getLogger(__name__)
 
+_EPOCH = datetime.datetime(1970, 1, 1)
+# Offset value used to tell naive datetimes apart.
+_NAIVE = -2 ** 31
+_datetime_struct = struct.Struct('!qi')
+_timedelta_struct = struct.Struct('!iii')
+_date_struct = struct.Struct('!i')
+_timezones = {}
+
+
+def _to_micros(delta):
+    return ((delta.days * 86400 + delta.seconds) * 1000000 +
+            delta.microseconds)
+
+
+def _pack_datetime(obj):
+    """
+    Microseconds since epoch (UTC) and UTC offset in seconds.
+    """
+    offset = obj.utcoffset()
+    if offset is None:
+        return _datetime_struct.pack(_to_micros(obj - _EPOCH), _NAIVE)
+    offset = offset.days * 86400 + offset.seconds
+    return _datetime_struct.pack(
+        _to_micros(obj.replace(tzinfo=None) - _EPOCH) - offset * 1000000,
+        offset)
+
+
+def _unpack_datetime(data):
+    micros, offset = _datetime_struct.unpack(data)
+    if offset == _NAIVE:
+        return _EPOCH + datetime.timedelta(microseconds=micros)
+    try:
+        tzinfo = _timezones[offset]
+    except KeyError:
+        tzinfo = _timezones[offset] = dateutil.tz.tzoffset(None, offset)
+    return (_EPOCH + datetime.timedelta(microseconds=micros + offset *
+                                        1000000)).replace(tzinfo=tzinfo)
+
+
+def _pack_timedelta(obj):
+    return _timedelta_struct.pack(obj.days, obj.seconds, obj.microseconds)
+
+
+def _unpack_timedelta(data):
+    days, seconds, microseconds = _timedelta_struct.unpack(data)
+    return datetime.timedelta(days, seconds, microseconds)
+
+
+def _pack_date(obj):
+    return _date_struct.pack(obj.toordinal())
+
+
+def _unpack_date(data):
+    return datetime.date.fromordinal(_date_struct.unpack(data)[0])
+
+
 _pickle_dumps = functools.partial(
     pickle.dumps, protocol=pickle.HIGHEST_PROTOCOL)
-_datetime_objs = (
-    datetime.tzinfo, datetime.timedelta, datetime.datetime, datetime.date)
 _default = {
-    i: (cls, _pickle_dumps, pickle.loads)
-    for i, cls in enumerate(_datetime_objs, start=123)
+    120: (datetime.timedelta, _pack_timedelta, _unpack_timedelta),
+    121: (datetime.datetime, _pack_datetime, _unpack_datetime),
+    122: (datetime.date, _pack_date, _unpack_date),
+    123: (datetime.tzinfo, _pickle_dumps, pickle.loads),
 }
+# Legacy pickled timedelta, datetime and date are only decoded,
+# an empty tuple of classes never matches while packing.
+_default.update((code, ((), _pickle_dumps, pickle.loads))
+                for code in (124, 125, 126))
+
+# ext type of placeholders for values sent in out-of-band frames
+OUT_OF_BAND = 119
+_index_struct = struct.Struct('!I')
+_binary_types = (bytes, bytearray, memoryview)
+# ext type of numpy arrays, registered if numpy is installed
+NDARRAY = 118
+
+# 0xc1 is never used by msgpack, packed bodies starting with it are
+# compressed, the next byte identifies the codec.
+COMPRESSED = b'\xc1'
+compressors = {}
+_decompressors = {}
+
+
+def register_compressor(name, code, compress, decompress):
+    """
+    Makes a compression codec available to :class:`Packer` under ``name``.
+    ``code`` is the single byte that identifies it in compressed bodies.
+    ``decompress(data, max_length)`` raises :class:`ValueError` if data
+    would be larger than ``max_length`` bytes once decompressed.
+    """
+    if code in _decompressors:
+        raise ValueError('Code {!r} is already registered'.format(code))
+    compressors[name] = (COMPRESSED + code, compress)
+    _decompressors[code] = decompress
+
+
+def _zlib_compress(data):
+    return zlib.compress(data, 1)
+
+
+def _zlib_decompress(data, max_length):
+    # one more byte tells bodies larger than the limit
+    data = zlib.decompressobj().decompress(data, max_length + 1)
+    if len(data) > max_length:
+        raise ValueError(
+            'Body larger than {} bytes once decompressed'.format(max_length))
+    return data
+
+
+register_compressor('zlib', b'\x01', _zlib_compress, _zlib_decompress)
+
+
+def immutable_buffer(buffer):
+    """
+    Returns buffer if it is read-only, else a copy of its bytes.
+    Frames are sent once the call returned, later changes made by the
+    caller to a mutable buffer must not reach the wire.
+    """
+    view = memoryview(buffer)
+    if view.readonly:
+        return buffer
+    return view.tobytes()
+
+
+class OutOfBand(object):
+    """
+    Marks a binary value to be sent in its own frame.
+    """
+    __slots__ = ('buffer',)
+
+    def __init__(self, buffer):
+        self.buffer = buffer
 
 
 class Packer:
 
-    def __init__(self, translation_table=None):
-        if translation_table is None:
-            translation_table = _default
-        else:
-            translation_table = dict(
-                itertools.chain(_default.items(), translation_table.items()))
+    def __init__(self, translation_table=None,
+                 out_of_band_threshold=65536, compression=None,
+                 compression_threshold=65536,
+                 max_decompressed_size=64 * 1024 * 1024):
+        translation_table = dict(itertools.chain(
+            _default.items(), (translation_table or {}).items()))
+        translation_table[OUT_OF_BAND] = (OutOfBand,
+                                          self._pack_out_of_band,
+                                          self._unpack_out_of_band)
         self.translation_table = translation_table
+        self.out_of_band_threshold = out_of_band_threshold
+        if compression is None:
+            self._compressor = None
+        else:
+            self._compressor = compressors[compression]
+        self.compression_threshold = compression_threshold
+        # peers may compress whatever the configuration of this packer
+        self.max_decompressed_size = max_decompressed_size
         self._pack_cache = {}
+        self._pack_buffers = None
+        self._unpack_buffers = ()
+        if numpy is not None and NDARRAY not in self.translation_table:
+            self.register_ext_handler(NDARRAY, numpy.ndarray,
+                                      self._pack_ndarray,
+                                      self._unpack_ndarray)
+        self._packer = self._make_packer()
+        self._unpackb = functools.partial(
+            msgpack.unpackb, use_list=False, encoding='utf-8',
+            ext_hook=self.ext_type_unpack_hook)
+
+    def _make_packer(self):
+        return msgpack.Packer(encoding='utf-8', use_bin_type=True,
+                              default=self.ext_type_pack_hook)
+
+    def mark_out_of_band(self, value):
+        """
+        Wraps bytes, bytearray or memoryview values larger than
+        ``out_of_band_threshold`` in :class:`OutOfBand`, to let
+        :meth:`packb` send them as separate frames.
+        """
+        if (isinstance(value, _binary_types) and
+                len(value) >= self.out_of_band_threshold):
+            return OutOfBand(immutable_buffer(value))
+        return value
 
-    def packb(self, data):
+    def packb(self, data, buffers=None):
+        """
+        Values marked with :meth:`mark_out_of_band` are appended to
+        ``buffers`` and only referenced by index in the packed bytes.
+        """
+        # The long-lived packer is taken out while in use, so an ext
+        # handler packing with this instance gets a fresh one.
+        packer, self._packer = self._packer, None
+        if packer is None:
+            packer = self._make_packer()
+        previous_buffers, self._pack_buffers = self._pack_buffers, buffers
         try:
-            return msgpack.packb(data, encoding='utf-8', use_bin_type=True,
-                                 default=self.ext_type_pack_hook)
+            packed = packer.pack(data)
         except:
+            # drop what has been buffered before the failure
+            packer.reset()
             logger.exception('Packing failed')
             raise
+        finally:
+            self._packer = packer
+            self._pack_buffers = previous_buffers
+        if (self._compressor is not None and
+                len(packed) >= self.compression_threshold):
+            header, compress = self._compressor
+            compressed = header + compress(packed)
+            if len(compressed) < len(packed):
+                return compressed
+        return packed
 
-    def unpackb(self, packed):
+    def unpackb(self, packed, buffers=()):
+        """
+        ``buffers`` are the out-of-band frames received with ``packed``,
+        values they carry are returned as memoryviews, without copy.
+        """
+        previous_buffers, self._unpack_buffers = (self._unpack_buffers,
+                                                  buffers)
         try:
-            return msgpack.unpackb(packed, use_list=False, encoding='utf-8',
-                                   ext_hook=self.ext_type_unpack_hook)
+            # zmq.Frame
+            packed = getattr(packed, 'buffer', packed)
+            if packed[:1] == COMPRESSED:
+                packed = memoryview(packed)
+                code = packed[1:2].tobytes()
+                packed = _decompressors[code](packed[2:].tobytes(),
+                                              self.max_decompressed_size)
+            return self._unpackb(packed)
         except:
             logger.exception('Unpacking failed')
             raise
+        finally:
+            self._unpack_buffers = previous_buffers
+
+    def _pack_out_of_band(self, obj):
+        if self._pack_buffers is None:
+            raise ValueError('No frames to send out-of-band buffer')
+        self._pack_buffers.append(obj.buffer)
+        return _index_struct.pack(len(self._pack_buffers) - 1)
+
+    def _unpack_out_of_band(self, data):
+        frame = self._unpack_buffers[_index_struct.unpack(data)[0]]
+        try:
+            # zmq.Frame
+            return frame.buffer
+        except AttributeError:
+            return memoryview(frame)
+
+    def _pack_ndarray(self, obj):
+        """
+        dtype and shape, followed by the raw data, or the index of the
+        out-of-band frame that carries it.
+        Out-of-band data of writable arrays is copied once, mark arrays
+        read-only (``array.flags.writeable = False``) to send them without
+        copy.
+        """
+        if obj.dtype.hasobject or obj.dtype.fields is not None:
+            raise TypeError('Unsupported dtype: {!r}'.format(obj.dtype))
+        array = numpy.ascontiguousarray(obj)
+        if (self._pack_buffers is not None and
+                array.nbytes >= self.out_of_band_threshold):
+            if numpy.may_share_memory(array, obj):
+                self._pack_buffers.append(immutable_buffer(array))
+            else:
+                self._pack_buffers.append(array)
+            data = len(self._pack_buffers) - 1
+        else:
+            data = array.tobytes()
+        return msgpack.packb((array.dtype.str, array.shape, data),
+                             encoding='utf-8', use_bin_type=True)
+
+    def _unpack_ndarray(self, data):
+        dtype, shape, data = msgpack.unpackb(data, encoding='utf-8')
+        if not isinstance(data, bytes):
+            frame = self._unpack_buffers[data]
+            data = getattr(frame, 'buffer', frame)
+        return numpy.frombuffer(data, dtype=dtype).reshape(shape)
 
     def ext_type_pack_hook(self, obj, _sentinel=object()):
         obj_class = obj.__class__
@@ -0,0 +1,89 @@
+import json
+import pickle
+
+import zope.component
+import zope.interface
+
+from .interfaces import IBaseRPC, ISerializer
+from .packer import Packer, immutable_buffer
+from .utils import register_serializer
+
+
+@register_serializer
+@zope.interface.implementer(ISerializer)
+@zope.component.adapter(IBaseRPC)
+class MsgpackSerializer(Packer):
+    """
+    Default serializer, a :class:`pseud.packer.Packer` configured
+    from the RPC.
+    """
+    name = 'msgpack'
+
+    def __init__(self, rpc):
+        Packer.__init__(self, rpc.translation_table,
+                        compression=rpc.compression,
+                        compression_threshold=rpc.compression_threshold,
+                        max_decompressed_size=rpc.max_decompressed_size)
+        self.rpc = rpc
+
+
+@register_serializer
+@zope.interface.implementer(ISerializer)
+@zope.component.adapter(IBaseRPC)
+class JSONSerializer(object):
+    """
+    Human readable serializer, for debugging.
+    Tuples are received as lists, bytes are not supported.
+    """
+    name = 'json'
+
+    def __init__(self, rpc):
+        self.rpc = rpc
+
+    def mark_out_of_band(self, value):
+        return value
+
+    def packb(self, data, buffers=None):
+        return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+    def unpackb(self, packed, buffers=()):
+        return json.loads(bytes(packed).decode('utf-8'))
+
+
+if pickle.HIGHEST_PROTOCOL >= 5:
+
+    @register_serializer
+    @zope.interface.implementer(ISerializer)
+    @zope.component.adapter(IBaseRPC)
+    class PickleSerializer(object):
+        """
+        Pickle protocol 5, large buffers are sent out-of-band.
+
+        .. warning::
+            Unpickling executes arbitrary code,
+            only accept it from trusted peers.
+        """
+        name = 'pickle'
+        out_of_band_threshold = 65536
+
+        def __init__(self, rpc):
+            self.rpc = rpc
+
+        def mark_out_of_band(self, value):
+            if (isinstance(value, (bytes, bytearray, memoryview)) and
+                    len(value) >= self.out_of_band_threshold):
+                return pickle.PickleBuffer(value)
+            return value
+
+        def packb(self, data, buffers=None):
+            if buffers is None:
+                return pickle.dumps(data, protocol=5)
+            return pickle.dumps(
+                data, protocol=5,
+                buffer_callback=lambda buffer: buffers.append(
+                    immutable_buffer(buffer)))
+
+        def unpackb(self, packed, buffers=()):
+            return pickle.loads(getattr(packed, 'buffer', packed),
+                                buffers=[getattr(frame, 'buffer', frame)
+                                         for frame in buffers])
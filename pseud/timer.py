@@ -0,0 +1,71 @@
+import sys
+import time
+
+_clock = getattr(time, 'monotonic', time.time)
+
+
+class TimerWheel(object):
+    """
+    Hashed timer wheel, keys expire by batches of ``resolution`` seconds.
+    Adding and discarding a key is O(1), whatever the number of timers.
+    Deadlines further than ``slots * resolution`` seconds wait for
+    the wheel to go round.
+    """
+    def __init__(self, resolution=.1, slots=512, clock=_clock):
+        self.resolution = resolution
+        self.clock = clock
+        self._buckets = [{} for _ in range(slots)]
+        # slot of every timer
+        self._timers = {}
+        self._tick = self._get_tick(clock())
+
+    def __len__(self):
+        return len(self._timers)
+
+    def __contains__(self, key):
+        return key in self._timers
+
+    def memory_size(self):
+        """
+        Returns an estimate of the bytes used by the wheel and its timers.
+        """
+        return (sys.getsizeof(self._timers) +
+                sys.getsizeof(self._buckets) +
+                sum(sys.getsizeof(bucket) for bucket in self._buckets))
+
+    def _get_tick(self, deadline):
+        return int(deadline / self.resolution)
+
+    def add(self, key, delay):
+        """
+        Expires key in given delay, in seconds.
+        """
+        deadline = self.clock() + delay
+        # a deadline already behind the wheel expires at next advance
+        slot = max(self._get_tick(deadline), self._tick) % len(self._buckets)
+        self._buckets[slot][key] = deadline
+        self._timers[key] = slot
+
+    def discard(self, key):
+        slot = self._timers.pop(key, None)
+        if slot is not None:
+            del self._buckets[slot][key]
+
+    def advance(self):
+        """
+        Removes and returns the expired keys.
+        """
+        now = self.clock()
+        tick = self._get_tick(now)
+        slots = len(self._buckets)
+        expired = []
+        for current in range(self._tick, min(tick + 1, self._tick + slots)):
+            bucket = self._buckets[current % slots]
+            for key in [key for key, deadline in bucket.items()
+                        if deadline <= now]:
+                del bucket[key]
+                del self._timers[key]
+                expired.append(key)
+        # the current slot may still hold timers expiring later
+        self._tick = tick
+        return expired
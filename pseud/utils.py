@@ -1,5 +1,9 @@
+import weakref
+
 import zope.component
+import zope.event
 import zope.interface
+import zope.interface.interfaces
 
 from future.builtins import str
 
@@ -7,6 +11,7 @@ from .interfaces import (IAuthenticationBackend,
                          IHeartbeatBackend,
                          IRPCCallable,
                          IRPCRoute,
+                         ISerializer,
                          ServiceNotFoundError,
                          IPredicate,
                          )
@@ -14,6 +19,21 @@ from .interfaces import (IAuthenticationBackend,
 
 registry = zope.component.getGlobalSiteManager()
 
+_route_indexes = weakref.WeakKeyDictionary()
+# bumped when an rpc-callable is registered or unregistered in any
+# registry, they may be the bases of others
+_routes_generation = 0
+
+
+def _on_registration_event(event):
+    global _routes_generation
+    if (isinstance(event, zope.interface.interfaces.RegistrationEvent) and
+            getattr(event.object, 'provided', None) is IRPCRoute):
+        _routes_generation += 1
+
+
+zope.event.subscribers.append(_on_registration_event)
+
 
 def register_auth_backend(cls):
     """
@@ -45,6 +65,16 @@ def register_predicate(cls):
     return cls
 
 
+def register_serializer(cls):
+    """
+    Decorator to register Serializer plugins
+    """
+    registry.registerAdapter(cls, zope.component.adaptedBy(cls),
+                             ISerializer,
+                             cls.name)
+    return cls
+
+
 def create_local_registry(name):
     """
     Helper function to create a custom
@@ -57,11 +87,12 @@ def create_local_registry(name):
 @zope.interface.implementer(IRPCCallable)
 class RPCCallable(object):
     def __init__(self, func, name, domain='default',
-                 with_identity=False):
+                 with_identity=False, with_context=False):
         self.func = func
         self.name = name
         self.domain = domain
         self.with_identity = with_identity
+        self.with_context = with_context
 
     def __call__(self, *args, **kw):
         return self.func(*args, **kw)
@@ -73,7 +104,7 @@ class RPCCallable(object):
 
 
 def register_rpc(func=None, name=None, domain='default', registry=registry,
-                 with_identity=False):
+                 with_identity=False, with_context=False):
     def wrapper(fn):
         if name is None:
             try:
@@ -88,7 +119,8 @@ def register_rpc(func=None, name=None, domain='default', registry=registry,
         registered_name = '{}:{}'.format(endpoint_name, domain)
         registry.registerUtility(RPCCallable(fn, name=endpoint_name,
                                              domain=domain,
-                                             with_identity=with_identity),
+                                             with_identity=with_identity,
+                                             with_context=with_context),
                                  IRPCRoute,
                                  name=registered_name)
         return fn
@@ -98,17 +130,53 @@ def register_rpc(func=None, name=None, domain='default', registry=registry,
     return wrapper
 
 
-def get_rpc_callable(name, registry=registry, *args, **kw):
+def get_route_index(registry=registry):
     """
-    Supports predicate API (check like checking permissions)
-    TODO improve sorting
+    Returns a dict that maps rpc-callable names to the tuple of
+    registered candidates, non-default domains first.
+
+    The index is built once and rebuilt lazily after an rpc-callable
+    is registered or unregistered.
     """
+    generation = _routes_generation
+    try:
+        cached_generation, index = _route_indexes[registry]
+    except KeyError:
+        pass
+    else:
+        if cached_generation == generation:
+            return index
+    index = {}
     for rpc_call in sorted(reversed(registry.getAllUtilitiesRegisteredFor(
             IRPCRoute)),
             key=lambda c: c.domain == 'default',
             reverse=False):
-        if rpc_call.name != name:
-            continue
+        index.setdefault(rpc_call.name, []).append(rpc_call)
+    index = {name: tuple(candidates) for name, candidates in index.items()}
+    _route_indexes[registry] = (generation, index)
+    return index
+
+
+def compile_routes(registry=registry):
+    """
+    Resolves once every rpc-callable of the registry along with the
+    predicate of its domain.
+    Returns a plain dict that maps rpc-callable names to tuples of
+    ``(rpc_call, predicate)``, ordered like :func:`get_rpc_callable`.
+    """
+    return {name: tuple((rpc_call,
+                         zope.component.getAdapter(rpc_call,
+                                                   IPredicate,
+                                                   name=rpc_call.domain))
+                        for rpc_call in candidates)
+            for name, candidates in get_route_index(registry).items()}
+
+
+def get_rpc_callable(name, registry=registry, *args, **kw):
+    """
+    Supports predicate API (check like checking permissions)
+    """
+    for rpc_call in get_route_index(registry).get(name, ()):
         if rpc_call.test(*args, **kw):
             return rpc_call
     raise ServiceNotFoundError(name)
@@ -84,6 +84,225 @@ def test_trusted_curve():
     client.stop()
 
 
+def test_curve_certificates_server():
+    from pseud.auth import CurveWithCertificatesForServer
+    from pseud.interfaces import IAuthenticationBackend
+
+    assert verifyClass(IAuthenticationBackend,
+                       CurveWithCertificatesForServer)
+
+
+def test_curve_certificates(tmpdir):
+    import os
+    import zmq.auth
+    from pseud._gevent import Client, Server
+    from pseud.interfaces import UnauthorizedError
+
+    server_id = 'server'
+    endpoint = 'tcp://127.0.0.1:8998'
+    server_public, server_secret = zmq.curve_keypair()
+    directory = str(tmpdir)
+    zmq.auth.create_certificates(directory, 'alice')
+    alice_public, alice_secret = zmq.auth.load_certificate(
+        os.path.join(directory, 'alice.key_secret'))
+
+    server = Server(server_id, security_plugin='curve_certificates',
+                    public_key=server_public,
+                    secret_key=server_secret,
+                    certificates_directory=directory)
+    server.bind(endpoint)
+    client = Client(server_id,
+                    security_plugin='curve_certificates',
+                    public_key=alice_public,
+                    secret_key=alice_secret,
+                    peer_public_key=server_public)
+    client.connect(endpoint)
+
+    @server.register_rpc(name='string.lower')
+    def lower(value):
+        return value.lower()
+
+    server.start()
+    client.start()
+    assert client.string.lower('FOO').get() == 'foo'
+    assert server.auth_backend.get_routing_id(b'alice')
+    assert server.auth_backend.certificates == {
+        z85.decode(alice_public): b'alice'}
+    # only peers of the directory are trusted
+    assert not hasattr(server.auth_backend, 'known_identities')
+
+    # new certificates are picked up without blocking the server
+    os.makedirs(os.path.join(directory, 'new'))
+    zmq.auth.create_certificates(os.path.join(directory, 'new'), 'bob')
+    os.rename(os.path.join(directory, 'new', 'bob.key'),
+              os.path.join(directory, 'bob.key'))
+    server.auth_backend.mtime = None
+    server.auth_backend.check_directory()
+    with Timeout(2):
+        while len(server.auth_backend.certificates) != 2:
+            gevent.sleep(.01)
+
+    # the connection of a revoked certificate stays open, but is refused
+    os.remove(os.path.join(directory, 'alice.key'))
+    server.auth_backend.mtime = None
+    server.auth_backend.check_directory()
+    with Timeout(2):
+        while len(server.auth_backend.certificates) != 1:
+            gevent.sleep(.01)
+    with Timeout(2):
+        with pytest.raises(UnauthorizedError):
+            client.string.lower('FOO').get()
+    with pytest.raises(KeyError):
+        server.send_to(b'alice').string.lower('FOO')
+    server.stop()
+    client.stop()
+
+
+def test_trusted_curve_with_zap_thread():
+    import threading
+    from pseud._gevent import Client, Server
+
+    server_id = 'server'
+    endpoint = 'tcp://127.0.0.1:8998'
+    server_public, server_secret = zmq.curve_keypair()
+    security_plugin = 'trusted_curve'
+
+    server = Server(server_id, security_plugin=security_plugin,
+                    public_key=server_public,
+                    secret_key=server_secret,
+                    zap_thread=True)
+    server.bind(endpoint)
+    assert isinstance(server.auth_backend.reader, threading.Thread)
+    bob_public, bob_secret = server.auth_backend.known_identities[b'bob']
+    client = Client(server_id,
+                    security_plugin=security_plugin,
+                    public_key=bob_public,
+                    secret_key=bob_secret,
+                    peer_public_key=server_public)
+    client.connect(endpoint)
+
+    @server.register_rpc(name='string.lower')
+    def lower(value):
+        return value.lower()
+
+    server.start()
+    client.start()
+    assert client.string.lower('FOO').get() == 'foo'
+    server.stop()
+    client.stop()
+    assert not server.auth_backend.reader.is_alive()
+
+
+def test_connection_taking_over_routing_id_is_identified():
+    from pseud._gevent import Server
+    from pseud.interfaces import OK, VERSION, WORK
+    from pseud.packer import Packer
+
+    endpoint = 'tcp://127.0.0.1:8998'
+    server = Server('server', security_plugin='plain')
+    server.bind(endpoint)
+
+    @server.register_rpc(with_identity=True)
+    def whoami(user_id):
+        return user_id
+
+    server.start()
+    context = zmq.Context.instance()
+
+    def call(login):
+        # same routing_id, the new connection takes over the previous one
+        socket = context.socket(zmq.DEALER)
+        socket.identity = b'peer'
+        socket.plain_username = login
+        socket.plain_password = login
+        socket.connect(endpoint)
+        socket.send_multipart([b'', VERSION, b'uid', WORK,
+                               Packer().packb(('whoami', (), {}))])
+        with Timeout(2):
+            reply = socket.recv_multipart()
+        assert reply[3] == OK
+        return socket, Packer().unpackb(reply[4])
+
+    alice, user_id = call(b'alice')
+    assert user_id == b'alice'
+    bob, user_id = call(b'bob')
+    assert user_id == b'bob'
+    alice.close(linger=0)
+    bob.close(linger=0)
+    server.stop()
+
+
+def test_sqlite_plain(tmpdir):
+    import os
+    from pseud._gevent import Client, Server
+    from pseud.credentials import SQLiteCredentialStore
+
+    server_id = 'server'
+    endpoint = 'tcp://127.0.0.1:8998'
+    database = os.path.join(str(tmpdir), 'auth.db')
+    store = SQLiteCredentialStore(database)
+    store.add_user('alice', 's3cret')
+    store.close()
+
+    server = Server(server_id, security_plugin='sqlite_plain',
+                    credentials_database=database)
+    client = Client(server_id, security_plugin='sqlite_plain',
+                    user_id='alice', password='s3cret')
+    server.bind(endpoint)
+    client.connect(endpoint)
+
+    @server.register_rpc(name='string.lower')
+    def lower(value):
+        return value.lower()
+
+    server.start()
+    client.start()
+    assert client.string.lower('FOO').get() == 'foo'
+    assert server.auth_backend.get_routing_id(b'alice')
+    assert len(server.auth_backend.store.passwords) == 1
+    server.stop()
+    client.stop()
+
+
+def test_sqlite_curve(tmpdir):
+    import os
+    from pseud._gevent import Client, Server
+    from pseud.credentials import SQLiteCredentialStore
+
+    server_id = 'server'
+    endpoint = 'tcp://127.0.0.1:8998'
+    server_public, server_secret = zmq.curve_keypair()
+    alice_public, alice_secret = zmq.curve_keypair()
+    database = os.path.join(str(tmpdir), 'auth.db')
+    store = SQLiteCredentialStore(database)
+    store.add_public_key(z85.decode(alice_public), 'alice')
+    store.close()
+
+    server = Server(server_id, security_plugin='sqlite_curve',
+                    public_key=server_public,
+                    secret_key=server_secret,
+                    credentials_database=database)
+    client = Client(server_id, security_plugin='sqlite_curve',
+                    public_key=alice_public,
+                    secret_key=alice_secret,
+                    peer_public_key=server_public)
+    server.bind(endpoint)
+    client.connect(endpoint)
+
+    @server.register_rpc(name='string.lower')
+    def lower(value):
+        return value.lower()
+
+    server.start()
+    client.start()
+    assert client.string.lower('FOO').get() == 'foo'
+    assert server.auth_backend.get_routing_id(b'alice')
+    # only peers of the database are trusted
+    assert not hasattr(server.auth_backend, 'known_identities')
+    server.stop()
+    client.stop()
+
+
 def test_trusted_curve_with_wrong_peer_public_key():
     from pseud._gevent import Client, Server
     server_id = 'server'
@@ -156,10 +375,231 @@ def test_untrusted_curve_with_allowed_password():
     assert future2.get() == 'foo_jj'
     future3 = server.send_to(client_id).string.lower('ABC')
     assert future3.get() == 'abc'
+    assert server.auth_backend.is_authenticated(client_public)
+    assert server.auth_backend.is_authenticated(client_id)
     server.stop()
     client.stop()
 
 
+def test_untrusted_curve_with_json():
+    from pseud._gevent import Client, Server
+    from pseud.utils import register_rpc
+
+    client_id = 'john'
+    server_id = 'server'
+    endpoint = 'tcp://127.0.0.1:8998'
+    server_public, server_secret = zmq.curve_keypair()
+    client_public, client_secret = zmq.curve_keypair()
+    security_plugin = 'untrusted_curve'
+    password = 's3cret!'
+
+    client = Client(server_id,
+                    security_plugin=security_plugin,
+                    public_key=client_public,
+                    secret_key=client_secret,
+                    peer_public_key=server_public,
+                    user_id=client_id,
+                    password=password,
+                    serializer='json')
+
+    server = Server(server_id,
+                    security_plugin=security_plugin,
+                    public_key=server_public,
+                    secret_key=server_secret,
+                    accepted_serializers=('json',))
+
+    server.bind(endpoint)
+    client.connect(endpoint)
+    server.auth_backend.user_map[client_id] = password
+
+    server.start()
+    # hello, unauthorized and authenticated carry the bare VERSION
+    import string
+    register_rpc(name='string.lower')(string.lower)
+    assert client.string.lower('FOO').get() == 'foo'
+    assert server.auth_backend.is_authenticated(client_id)
+    server.stop()
+    client.stop()
+
+
+def test_untrusted_curve_resends_batch():
+    from pseud._gevent import Client, Server
+
+    client_id = 'john'
+    server_id = 'server'
+    endpoint = 'tcp://127.0.0.1:8998'
+    server_public, server_secret = zmq.curve_keypair()
+    client_public, client_secret = zmq.curve_keypair()
+    security_plugin = 'untrusted_curve'
+    password = 's3cret!'
+
+    client = Client(server_id,
+                    security_plugin=security_plugin,
+                    public_key=client_public,
+                    secret_key=client_secret,
+                    peer_public_key=server_public,
+                    user_id=client_id,
+                    password=password)
+
+    server = Server(server_id,
+                    security_plugin=security_plugin,
+                    public_key=server_public,
+                    secret_key=server_secret)
+    server.register_rpc(name='double')(lambda value: value * 2)
+
+    server.bind(endpoint)
+    client.connect(endpoint)
+    server.auth_backend.user_map[client_id] = password
+
+    server.start()
+    # sent before login, then again once authenticated
+    with client.batch() as batch:
+        first = batch.double(1)
+        second = batch.double(2)
+    assert first.get(timeout=2) == 2
+    assert second.get(timeout=2) == 4
+    server.stop()
+    client.stop()
+
+
+def test_untrusted_curve_trusted_keys_index():
+    from pseud._gevent import Server
+    from zmq.utils import z85
+
+    server = Server('server', security_plugin='untrusted_curve')
+    backend = server.auth_backend
+    key = z85.decode(zmq.curve_keypair()[0])
+    other_key = z85.decode(zmq.curve_keypair()[0])
+    assert not backend.is_authenticated(z85.encode(key))
+
+    backend.trust_key(key, 'alice')
+    backend.trust_key(other_key, 'alice')
+    assert backend.is_authenticated(key)
+    assert backend.is_authenticated(z85.encode(key))
+    assert backend.is_authenticated('alice')
+    assert not backend.is_authenticated('bob')
+
+    backend.trust_key(key, 'bob')
+    assert backend.is_authenticated('alice')
+    backend.trust_key(other_key, 'bob')
+    assert not backend.is_authenticated('alice')
+    assert backend.is_authenticated('bob')
+
+
+def test_untrusted_curve_trusted_keys_are_bounded():
+    from pseud._gevent import Server
+    from zmq.utils import z85
+
+    server = Server('server', security_plugin='untrusted_curve',
+                    max_peers=1)
+    backend = server.auth_backend
+    key = z85.decode(zmq.curve_keypair()[0])
+    other_key = z85.decode(zmq.curve_keypair()[0])
+
+    backend.trust_key(key, 'alice')
+    backend.trust_key(other_key, 'bob')
+    # alice is evicted along with the key
+    assert not backend.is_authenticated('alice')
+    assert not backend.is_authenticated(key)
+    assert backend.is_authenticated(other_key)
+    server.forget_peer('bob', None)
+    assert not backend.is_authenticated('bob')
+    assert not backend.is_authenticated(z85.encode(other_key))
+    assert backend.trusted_keys == {}
+
+
+def test_idle_peer_is_identified_again():
+    from pseud._gevent import Client, Server
+
+    server_id = 'server'
+    endpoint = 'tcp://127.0.0.1:8998'
+    now = [0]
+    server = Server(server_id, security_plugin='plain',
+                    peer_idle_timeout=5)
+    for table in server.peers.tables.values():
+        table.clock = lambda: now[0]
+    client = Client(server_id, security_plugin='plain',
+                    user_id='alice', password='alice')
+    server.bind(endpoint)
+    client.connect(endpoint)
+
+    @server.register_rpc
+    def ping():
+        return 'pong'
+
+    @client.register_rpc(name='ping')
+    def client_ping():
+        return 'pong'
+
+    server.start()
+    client.start()
+    with Timeout(2):
+        assert client.ping().get() == 'pong'
+    # alice is idle, evicted as she sends again
+    now[0] = 10
+    with Timeout(2):
+        assert client.ping().get() == 'pong'
+    with Timeout(2):
+        assert server.send_to(b'alice').ping().get() == 'pong'
+    server.stop()
+    client.stop()
+
+
+def test_connected_peer_is_not_evicted():
+    from pseud._gevent import Client, Server
+    server_id = 'server'
+    endpoint = 'tcp://127.0.0.1:8998'
+    server = Server(server_id, security_plugin='plain', max_peers=1)
+    clients = [Client(server_id, security_plugin='plain',
+                      user_id=login, password=login)
+               for login in ('alice', 'bob')]
+    server.bind(endpoint)
+
+    @server.register_rpc
+    def ping():
+        return 'pong'
+
+    server.start()
+    for client in clients:
+        client.register_rpc(name='ping')(ping)
+        client.connect(endpoint)
+        client.start()
+        with Timeout(2):
+            assert client.ping().get() == 'pong'
+    # alice is the least recently used, she is still connected
+    with Timeout(2):
+        assert server.send_to(b'alice').ping().get() == 'pong'
+    server.stop()
+    for client in clients:
+        client.stop()
+
+
+def test_untrusted_curve_login_evicted_logs_in_again():
+    from pseud._gevent import Server
+    from pseud.interfaces import AUTHENTICATED
+
+    server = Server('server', security_plugin='untrusted_curve',
+                    max_peers=1)
+    backend = server.auth_backend
+    backend.user_map['alice'] = 's3cret'
+    backend.user_map['bob'] = 's3cret'
+    sent = []
+    server.send_message = sent.append
+    backend.trust_key(z85.decode(zmq.curve_keypair()[0]), 'alice')
+    # alice connected with her trusted key, she is known by her login
+    backend.register_routing_id('alice', b'routing-alice')
+    backend.trust_key(z85.decode(zmq.curve_keypair()[0]), 'bob')
+    assert not backend.is_authenticated('alice')
+    assert b'routing-alice' in server._forgotten_identities
+
+    backend.handle_authentication('alice', b'routing-alice', b'uid')
+    hello = backend.packer.packb(('alice', 's3cret'))
+    backend.handle_hello('alice', b'routing-alice', b'uid', hello)
+    assert sent[-1][4] == AUTHENTICATED
+    assert backend.is_authenticated('alice')
+    assert backend.get_routing_id('alice') == b'routing-alice'
+
+
 def test_untrusted_curve_with_allowed_password_and_client_disconnect():
     from pseud._gevent import Client, Server
     from pseud.utils import register_rpc
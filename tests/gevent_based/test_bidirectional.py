@@ -48,6 +48,383 @@ def test_client_can_send():
     server.stop()
 
 
+def test_large_binary_sent_out_of_band():
+    server_id = 'server'
+    endpoint = 'inproc://out-of-band'
+
+    server = make_one_server(server_id)
+    client = make_one_client(server_id)
+
+    @server.register_rpc
+    def measure(blob):
+        assert isinstance(blob, memoryview)
+        return blob.tobytes()[:3], len(blob)
+
+    @server.register_rpc
+    def blob(size):
+        return b'y' * size
+
+    server.bind(endpoint)
+    server.start()
+
+    client.connect(endpoint)
+    client.start()
+
+    size = server.packer.out_of_band_threshold
+    assert client.measure(b'x' * size).get() == (b'xxx', size)
+    assert client.blob(size).get().tobytes() == b'y' * size
+    client.stop()
+    server.stop()
+
+
+def test_serializer_announced_by_client():
+    from pseud._gevent import Client, Server
+    server_id = 'server'
+    endpoint = 'inproc://serializer'
+
+    server = Server(server_id, security_plugin='noop_auth_backend',
+                    accepted_serializers=('msgpack', 'json'))
+    client = Client(server_id, security_plugin='noop_auth_backend',
+                    serializer='json')
+
+    @server.register_rpc
+    def echo(value):
+        return value
+
+    server.bind(endpoint)
+    server.start()
+
+    client.connect(endpoint)
+    client.start()
+
+    assert client.echo((1, 'a')).get() == [1, 'a']
+    client.stop()
+    server.stop()
+
+
+def test_serializer_not_accepted_fails_calls():
+    from pseud._gevent import Client, Server
+    from pseud.interfaces import UnsupportedSerializerError
+    server_id = 'server'
+    endpoint = 'inproc://unsupported-serializer'
+
+    server = Server(server_id, security_plugin='noop_auth_backend')
+    client = Client(server_id, security_plugin='noop_auth_backend',
+                    serializer='json')
+
+    @server.register_rpc
+    def echo(value):
+        return value
+
+    server.bind(endpoint)
+    server.start()
+
+    client.connect(endpoint)
+    client.start()
+
+    with Timeout(1):
+        with pytest.raises(UnsupportedSerializerError):
+            client.echo(1).get()
+        with client.batch() as batch:
+            first = batch.echo(1)
+            second = batch.echo(2)
+        with pytest.raises(UnsupportedSerializerError):
+            first.get()
+        with pytest.raises(UnsupportedSerializerError):
+            second.get()
+    # msgpack is not accepted by the client for anything else
+    assert b'v1' not in client._serializers
+    assert not client.future_pool
+    client.stop()
+    server.stop()
+
+
+def test_pending_calls_fail_when_server_disconnects():
+    from pseud.interfaces import PeerDisconnectedError
+    server_id = 'server'
+    endpoint = 'tcp://127.0.0.1:5002'
+
+    server = make_one_server(server_id)
+    client = make_one_client(server_id)
+
+    @server.register_rpc
+    def fast():
+        return True
+
+    @server.register_rpc
+    def slow():
+        gevent.sleep(5)
+
+    server.bind(endpoint)
+    server.start()
+
+    client.connect(endpoint)
+    client.start()
+
+    assert client.fast().get() is True
+    future = client.slow()
+    gevent.sleep(.1)
+    server.stop()
+    with Timeout(1):
+        with pytest.raises(PeerDisconnectedError):
+            future.get()
+    assert not client.future_pool
+    assert not client.peer_calls
+    assert not len(client.timers)
+    assert not client.connections
+    assert not client.connection_fds
+    client.stop()
+
+
+def test_disconnection_fails_calls_of_its_peer_only():
+    from pseud.interfaces import PeerDisconnectedError
+    client = make_one_client('server')
+    client.connect('inproc://disconnected-peer')
+    alice = client._new_call(b'1', 'alice', b'routing-alice')
+    bob = client._new_call(b'2', 'bob', b'routing-bob')
+    client.handle_disconnected(b'routing-alice')
+    with Timeout(1):
+        with pytest.raises(PeerDisconnectedError):
+            alice.get()
+    gevent.sleep(0)
+    assert not bob.ready()
+    assert list(client.future_pool) == [b'2']
+    assert client.peer_calls == {b'routing-bob': {b'2'}}
+    client.stop()
+
+
+def test_calls_held_until_server_is_reachable():
+    server_id = 'server'
+    endpoint = 'tcp://127.0.0.1:5003'
+
+    server = make_one_server(server_id)
+    client = make_one_client(server_id)
+
+    @server.register_rpc
+    def fast():
+        return True
+
+    client.connect(endpoint)
+    client.start()
+    future = client.fast()
+    gevent.sleep(.5)
+    # messages are taken out of the outbox while they are retried
+    assert server_id in client.outbox
+
+    server.bind(endpoint)
+    server.start()
+    with Timeout(2):
+        assert future.get() is True
+    assert not len(client.outbox)
+    client.stop()
+    server.stop()
+
+
+def test_routing_id_taken_over_is_not_disconnected():
+    from pseud.interfaces import PeerDisconnectedError, VERSION, WORK
+    from pseud.packer import Packer
+    endpoint = 'tcp://127.0.0.1:5006'
+    server = make_one_server('server')
+
+    @server.register_rpc
+    def fast():
+        return True
+
+    server.bind(endpoint)
+    server.start()
+    context = zmq.Context.instance()
+
+    def connect():
+        # same routing_id, the new connection takes over the previous one
+        socket = context.socket(zmq.DEALER)
+        socket.identity = b'peer'
+        socket.connect(endpoint)
+        socket.send_multipart([b'', VERSION, b'uid', WORK,
+                               Packer().packb(('fast', (), {}))])
+        with Timeout(2):
+            socket.recv_multipart()
+        return socket
+
+    first = connect()
+    second = connect()
+    future = server.send_to(b'peer').fast()
+    with Timeout(2):
+        second.recv_multipart()
+    first.close(linger=0)
+    gevent.sleep(.2)
+    # closing the connection taken over does not fail calls of the peer
+    assert not future.ready()
+    assert list(server.connection_fds) == [b'peer']
+    second.close(linger=0)
+    with Timeout(2):
+        with pytest.raises(PeerDisconnectedError):
+            future.get()
+    assert not server.connections
+    server.stop()
+
+
+def test_calls_fail_when_outbox_is_full():
+    from pseud._gevent import Client
+    from pseud.interfaces import UnreachablePeerError
+    client = Client('server', outbox_size=1)
+    client.connect('tcp://127.0.0.1:5004')
+    client.start()
+    held = client.fast()
+    future = client.fast()
+    with Timeout(1):
+        with pytest.raises(UnreachablePeerError):
+            future.get()
+    assert not held.ready()
+    client.stop()
+
+
+def test_timed_out_job_is_cancelled():
+    from pseud._gevent import Client
+    server_id = 'server'
+    endpoint = 'inproc://here'
+
+    server = make_one_server(server_id)
+    client = Client(server_id, timeout=.2, send_cancels=True)
+    done = []
+
+    @server.register_rpc
+    def slow():
+        gevent.sleep(.6)
+        done.append(True)
+
+    server.bind(endpoint)
+    server.start()
+
+    client.connect(endpoint)
+    client.start()
+
+    future = client.slow()
+    gevent.sleep(.1)
+    assert len(server.running_jobs) == 1
+    gevent.sleep(.3)
+    assert future.ready()
+    assert not server.running_jobs
+    gevent.sleep(.4)
+    assert not done
+    client.stop()
+    server.stop()
+
+
+@pytest.mark.parametrize('concurrent_batches', [False, True])
+def test_batch_resolves_each_call(concurrent_batches):
+    from pseud._gevent import Client, Server
+    from pseud.interfaces import ServiceNotFoundError
+    server_id = 'server'
+    # sockets are closed asynchronously, endpoints are not reused
+    endpoint = 'inproc://batch-{}'.format(concurrent_batches)
+
+    server = Server(server_id, concurrent_batches=concurrent_batches)
+    client = Client(server_id)
+    started = []
+
+    @server.register_rpc
+    def slow(value):
+        started.append(value)
+        gevent.sleep(.1)
+        return value * 2
+
+    server.bind(endpoint)
+    server.start()
+
+    client.connect(endpoint)
+    client.start()
+
+    with client.batch() as batch:
+        first = batch.slow(1)
+        missing = batch.doesnotexists()
+        second = batch.slow(2)
+        assert len(client.future_pool) == 3
+    assert first.get(timeout=1) == 2
+    assert second.get(timeout=1) == 4
+    with pytest.raises(ServiceNotFoundError):
+        missing.get()
+    assert started == [1, 2]
+    assert not client.future_pool
+    client.stop()
+    server.stop()
+
+
+def test_batch_with_json():
+    from pseud._gevent import Client, Server
+    server_id = 'server'
+    endpoint = 'inproc://batch-json'
+
+    server = Server(server_id, accepted_serializers=('msgpack', 'json'))
+    client = Client(server_id, serializer='json')
+    server.register_rpc(name='double')(lambda value: value * 2)
+
+    server.bind(endpoint)
+    server.start()
+
+    client.connect(endpoint)
+    client.start()
+
+    with client.batch() as batch:
+        first = batch.double(1)
+        second = batch.double('a')
+    assert first.get(timeout=1) == 2
+    assert second.get(timeout=1) == 'aa'
+    client.stop()
+    server.stop()
+
+
+def test_discarded_batch_fails_its_calls():
+    from pseud._gevent import Client
+    from pseud.interfaces import BatchDiscardedError
+    client = Client('server')
+    client.connect('inproc://batch-discard')
+    with pytest.raises(ZeroDivisionError):
+        with client.batch() as batch:
+            future = batch.fast()
+            1 / 0
+    with pytest.raises(BatchDiscardedError):
+        future.get(timeout=1)
+    assert not client.future_pool
+    client.stop()
+
+
+def test_batch_fails_when_outbox_is_full():
+    from pseud._gevent import Client
+    from pseud.interfaces import UnreachablePeerError
+    client = Client('server', outbox_size=1)
+    client.connect('tcp://127.0.0.1:5004')
+    client.start()
+    held = client.fast()
+    with client.batch() as batch:
+        first = batch.fast()
+        second = batch.fast()
+    with Timeout(1):
+        for future in (first, second):
+            with pytest.raises(UnreachablePeerError):
+                future.get()
+    assert not held.ready()
+    client.stop()
+
+
+def test_held_batch_of_done_calls_is_dropped():
+    from pseud._gevent import Client
+    server_id = 'server'
+    client = Client(server_id)
+    client.connect('tcp://127.0.0.1:5005')
+    client.start()
+    with client.batch() as batch:
+        first = batch.fast()
+        second = batch.fast()
+    gevent.sleep(.1)
+    assert server_id in client.outbox
+    first.set_exception(ValueError())
+    second.set_exception(ValueError())
+    # dropped at the next retry instead of being sent again
+    gevent.sleep(.6)
+    assert server_id not in client.outbox
+    client.stop()
+
+
 def test_server_can_send():
     from pseud.utils import register_rpc
 
@@ -273,3 +650,70 @@ def test_client_can_reconnect():
 
     client.stop()
     server.stop()
+
+
+def test_timed_out_job_is_not_cancelled_by_default():
+    from pseud._gevent import Client
+    server_id = 'server'
+    endpoint = 'inproc://not-cancelled'
+
+    server = make_one_server(server_id)
+    client = Client(server_id, timeout=.2)
+    done = []
+
+    @server.register_rpc
+    def slow():
+        gevent.sleep(.4)
+        done.append(True)
+
+    server.bind(endpoint)
+    server.start()
+
+    client.connect(endpoint)
+    client.start()
+
+    future = client.slow()
+    gevent.sleep(.3)
+    assert future.ready()
+    assert len(server.running_jobs) == 1
+    gevent.sleep(.3)
+    assert done
+    client.stop()
+    server.stop()
+
+
+def test_cancelled_call_cancels_job():
+    from pseud._gevent import Client
+    from pseud.interfaces import CallCancelledError
+    server_id = 'server'
+    endpoint = 'inproc://cancelled'
+
+    server = make_one_server(server_id)
+    client = Client(server_id, send_cancels=True)
+    done = []
+
+    @server.register_rpc
+    def slow():
+        gevent.sleep(.4)
+        done.append(True)
+
+    server.bind(endpoint)
+    server.start()
+
+    client.connect(endpoint)
+    client.start()
+
+    future = client.slow()
+    gevent.sleep(.1)
+    assert len(server.running_jobs) == 1
+    assert client.cancel(future)
+    with pytest.raises(CallCancelledError):
+        future.get()
+    assert not client.cancel(future)
+    assert not client.future_pool
+    gevent.sleep(.1)
+    assert not server.running_jobs
+    gevent.sleep(.4)
+    assert not done
+    client.stop()
+    server.stop()
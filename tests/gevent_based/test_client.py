@@ -1,4 +1,4 @@
-import uuid
+import time
 
 import pytest
 gevent = pytest.importorskip('gevent')
@@ -86,8 +86,7 @@ def test_job_executed():
     assert delimiter == ''
     assert version == VERSION
     assert uid
-    # check it is a real uuid
-    uuid.UUID(bytes=uid)
+    assert len(uid) == 12
     assert message_type == WORK
     locator, args, kw = Packer().unpackb(message)
     assert locator == 'please.do_that_job'
@@ -117,20 +116,98 @@ def test_job_server_never_reply():
     assert delimiter == ''
     assert version == VERSION
     assert uid
-    # check it is a real uuid
-    uuid.UUID(bytes=uid)
+    assert len(uid) == 12
     assert message_type == WORK
     locator, args, kw = Packer().unpackb(message)
     assert locator == 'please.do_that_job'
     assert args == (1, 2, 3)
     assert kw == {'b': 4}
+    call = client.future_pool[uid]
+    assert call.future is future
+    assert call.routing_id == peer_identity
+    assert call.name == 'please.do_that_job'
+    memory = client.in_flight_memory()
+    assert memory['calls'] == 1
+    assert memory['bytes'] > 0
     with pytest.raises(Timeout):
         assert future.get()
     assert not client.future_pool
+    assert client.in_flight_memory()['calls'] == 0
     client.stop()
     socket.close()
 
 
+def test_job_without_deadline():
+    from pseud.packer import Packer
+    peer_identity = 'echo'
+    endpoint = 'tcp://127.0.0.1'
+    port, socket = make_one_server_socket(peer_identity, endpoint)
+    # by default, as servers older than deadlines expect
+    client = make_one_client(peer_identity)
+    client.connect(endpoint + ':{}'.format(port))
+
+    client.please.do_that_job(1, b=4)
+    request = gevent.spawn(socket.recv_multipart).get()
+    locator, args, kw = Packer().unpackb(request[-1])
+    assert locator == 'please.do_that_job'
+    client.stop()
+    socket.close()
+
+
+def test_job_with_deadline():
+    from pseud._gevent import Client
+    from pseud.packer import Packer
+    peer_identity = 'echo'
+    endpoint = 'tcp://127.0.0.1'
+    port, socket = make_one_server_socket(peer_identity, endpoint)
+    client = Client(peer_identity, timeout=5, send_deadlines=True)
+    client.connect(endpoint + ':{}'.format(port))
+
+    client.please.do_that_job(1, b=4)
+    request = gevent.spawn(socket.recv_multipart).get()
+    locator, args, kw, budget = Packer().unpackb(request[-1])
+    assert locator == 'please.do_that_job'
+    # seconds left, not a time of the clock of the client
+    assert 4 < budget <= 5
+    call = client.future_pool[request[3]]
+    assert 4 < call.deadline - time.time() <= 5
+    client.stop()
+    socket.close()
+
+
+def test_held_message_budget_is_refreshed():
+    from pseud._gevent import Client
+    from pseud.packer import Packer
+    client = Client('echo', timeout=5, send_deadlines=True)
+    client.connect('inproc://not-bound')
+    message, uid, deadline = client._prepare_work('echo', 'job', 1)
+    client._new_call(uid, 'echo', message[0], 'job', deadline)
+    # held for a while, the call has one second left
+    client.future_pool[uid].deadline = time.time() + 1
+    client.refresh_budget(message)
+    locator, args, kw, budget = Packer().unpackb(message[5])
+    assert (locator, args) == ('job', (1,))
+    assert 0 < budget <= 1
+
+    uids = [next(client.message_ids) for _ in range(2)]
+    for batch_uid in uids:
+        client._new_call(batch_uid, 'echo', b'echo', 'job',
+                         time.time() + 5)
+    batch = client._prepare_batch(b'echo', [(batch_uid, 'job', (), {})
+                                            for batch_uid in uids],
+                                  time.time() + 5)
+    client.future_pool[uids[0]].deadline = time.time() + 2
+    client.future_pool[uids[1]].deadline = time.time() + 1
+    client.future_pool[uids[1]].future.set_exception(ValueError())
+    gevent.sleep(0)
+    client.refresh_budget(batch)
+    calls, budget = Packer().unpackb(batch[5])
+    assert len(calls) == 2
+    # the earliest deadline of the pending calls
+    assert 1 < budget <= 2
+    client.stop()
+
+
 def test_client_registry():
     from pseud.utils import create_local_registry, get_rpc_callable
     identity = 'client0'
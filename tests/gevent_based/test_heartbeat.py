@@ -143,3 +143,22 @@ def test_basic_heartbeating_with_disconnection():
         client.stop()
         server.stop()
         spawning.kill()
+
+
+def test_forgotten_peer_timer_is_cancelled():
+    from pseud._gevent import Server
+    server = Server('server', heartbeat_plugin='testing_heartbeat_backend',
+                    max_peers=1)
+    server.bind('inproc://heartbeat-forget')
+    backend = server.heartbeat_backend
+    try:
+        backend.handle_heartbeat(b'alice', b'routing-alice')
+        alice_timer = backend.callback_pool[b'alice']
+        backend.handle_heartbeat(b'bob', b'routing-bob')
+        bob_timer = backend.callback_pool[b'bob']
+        # alice is evicted, bob is forgotten
+        assert alice_timer.dead
+        server.forget_peer(b'bob', b'routing-bob')
+        assert bob_timer.dead
+    finally:
+        server.stop()
@@ -125,3 +125,141 @@ def test_job_raise():
     assert message == 'too bad'
     assert __file__ in traceback
     server.stop()
+
+
+def test_job_running_with_frozen_routes():
+    from pseud.interfaces import ERROR, OK, VERSION, WORK
+    from pseud.packer import Packer
+
+    user_id = 'echo'
+    endpoint = 'inproc://{}'.format(__name__)
+    server = make_one_server(user_id, endpoint)
+
+    @server.register_rpc
+    def frozen_job():
+        return True
+
+    server.freeze_routes()
+
+    @server.register_rpc
+    def late_job():
+        return True
+
+    server.start()
+    socket = make_one_client_socket(endpoint)
+
+    def call(name):
+        work = Packer().packb((name, (), {}))
+        gevent.spawn(socket.send_multipart, [user_id, '', VERSION,
+                                             '', WORK, work])
+        return gevent.spawn(read_once, socket).get()
+
+    assert call('frozen_job') == [user_id, '', VERSION, '', OK,
+                                  Packer().packb(True)]
+    assert call('late_job')[:-1] == [user_id, '', VERSION, '', ERROR]
+    server.freeze_routes()
+    assert call('late_job') == [user_id, '', VERSION, '', OK,
+                                Packer().packb(True)]
+    server.unfreeze_routes()
+    assert server.routes is None
+    assert call('late_job') == [user_id, '', VERSION, '', OK,
+                                Packer().packb(True)]
+    server.stop()
+
+
+def test_identity_read_once_per_connection():
+    from pseud.interfaces import OK, VERSION, WORK
+    from pseud.packer import Packer
+
+    user_id = 'echo'
+    endpoint = 'inproc://{}'.format(__name__)
+    server = make_one_server(user_id, endpoint)
+
+    @server.register_rpc
+    def identified_job():
+        return True
+
+    server.start()
+    socket = zmq.Context.instance().socket(zmq.ROUTER)
+    socket.identity = b'client'
+    socket.connect(endpoint)
+
+    def call():
+        work = Packer().packb(('identified_job', (), {}))
+        gevent.spawn(socket.send_multipart, [user_id, '', VERSION,
+                                             '', WORK, work])
+        return gevent.spawn(read_once, socket).get()
+
+    assert call()[4] == OK
+    assert server.identities[b'client'] == b''
+    # forgotten before the next message is read
+    server.identities[b'client'] = b'stale'
+    server.forget_identity(b'client')
+    assert call()[4] == OK
+    assert server.identities[b'client'] == b''
+    server.identities[b'client'] = b'stale'
+    server.forget_identity()
+    assert call()[4] == OK
+    assert server.identities[b'client'] == b''
+    server.stop()
+
+
+def test_expired_job_dropped():
+    from pseud.interfaces import OK, VERSION, WORK
+    from pseud.packer import Packer
+
+    user_id = 'echo'
+    endpoint = 'inproc://{}'.format(__name__)
+    server = make_one_server(user_id, endpoint)
+    budgets = []
+
+    @server.register_rpc(with_context=True)
+    def timed_job(context):
+        budgets.append(context.remaining())
+        return context.user_id
+
+    server.start()
+    socket = make_one_client_socket(endpoint)
+
+    def send(budget):
+        work = Packer().packb(('timed_job', (), {}, budget))
+        gevent.spawn(socket.send_multipart, [user_id, '', VERSION,
+                                             '', WORK, work])
+
+    send(-1)
+    send(5)
+    reply = gevent.spawn(read_once, socket).get()
+    assert reply[4] == OK
+    assert Packer().unpackb(reply[5]) == b''
+    # the expired job never ran
+    assert len(budgets) == 1
+    assert 4 < budgets[0] <= 5
+    server.stop()
+
+
+def test_reply_to_unreachable_peer_expires():
+    from pseud._gevent import Server
+    from pseud.interfaces import EMPTY_DELIMITER, OK, VERSION
+    endpoint = 'inproc://{}-unreachable'.format(__name__)
+    server = Server('echo', timeout=.3)
+    server.bind(endpoint)
+    server.start()
+    # the peer never connects, every retry fails
+    server.send_message(['ghost', EMPTY_DELIMITER, VERSION, 'uid', OK,
+                         b''])
+    gevent.sleep(.1)
+    assert 'ghost' in server.outbox
+    gevent.sleep(1.5)
+    assert 'ghost' not in server.outbox
+    assert not len(server.outbox)
+    server.stop()
+
+
+def test_cancel_batched_job():
+    from pseud._gevent import Server
+    server = Server('echo')
+    calls = [('a', 'job', (), {}), ('b', 'job', (), {})]
+    # sequential jobs run in the greenlet of the batch, they are not killed
+    assert server._start_batch('peer', calls) is True
+    server.cancel_job('peer', 'a')
+    assert list(server.running_jobs) == [('peer', 'b')]
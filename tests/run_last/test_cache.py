@@ -0,0 +1,221 @@
+import pytest
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_lru_cache_eviction():
+    from pseud.cache import LRUCache
+    cache = LRUCache(maxsize=2)
+    cache['a'] = 1
+    cache['b'] = 2
+    assert cache['a'] == 1
+    cache['c'] = 3
+    assert len(cache) == 2
+    assert 'b' not in cache
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    with pytest.raises(KeyError):
+        cache['b']
+    assert cache.pop('a') == 1
+    assert cache.pop('a', None) is None
+
+
+def test_lru_cache_ttl():
+    from pseud.cache import LRUCache
+    clock = FakeClock()
+    cache = LRUCache(maxsize=10, ttl=5, clock=clock)
+    cache['a'] = 1
+    clock.now = 4
+    assert cache.get('a') == 1
+    clock.now = 5
+    assert cache.get('a') is None
+    assert len(cache) == 0
+
+
+def test_predicate_cache_invalidation():
+    from pseud.cache import PredicateCache
+    cache = PredicateCache(maxsize=10)
+    cache[('job', 'restricted', b'alice')] = True
+    cache[('job', 'default', b'alice')] = True
+    cache[('job', 'restricted', b'bob')] = False
+    cache.invalidate(b'alice')
+    assert len(cache) == 1
+    assert cache[('job', 'restricted', b'bob')] is False
+    cache.invalidate()
+    assert len(cache) == 0
+
+
+def test_peer_table_idle_eviction():
+    from pseud.cache import PeerTable
+    clock = FakeClock()
+    table = PeerTable(maxsize=10, ttl=5, clock=clock)
+    table['a'] = 1
+    table['b'] = 2
+    clock.now = 4
+    # used, so not idle
+    assert table['a'] == 1
+    clock.now = 6
+    table['c'] = 3
+    assert 'b' not in table._data
+    assert table.get('a') == 1
+    assert sorted(table.values()) == [1, 3]
+    clock.now = 20
+    assert table.get('a') is None
+
+
+def test_peer_state_store_forget():
+    from pseud.cache import PeerStateStore
+    store = PeerStateStore(maxsize=2)
+    routes = store.table('routes')
+    assert store.table('routes') is routes
+    keys = store.table('keys')
+    routes[b'alice'] = b'routing-alice'
+    keys[b'routing-alice'] = b'key'
+    routes[b'bob'] = b'routing-bob'
+    routes[b'carol'] = b'routing-carol'
+    assert store.sizes() == {'routes': 2, 'keys': 1}
+    store.forget(b'alice', b'routing-alice')
+    assert store.sizes() == {'routes': 2, 'keys': 0}
+
+
+def test_peer_table_on_evict():
+    from pseud.cache import PeerTable
+    clock = FakeClock()
+    evicted = []
+    table = PeerTable(maxsize=2, ttl=5, clock=clock,
+                      on_evict=lambda key, value: evicted.append(key))
+    table['a'] = 1
+    table['b'] = 2
+    table['c'] = 3
+    assert evicted == ['a']
+    assert table.pop('b') == 2
+    table.forget('c')
+    table.forget('unknown')
+    assert evicted == ['a', 'c']
+    table['d'] = 4
+    clock.now = 6
+    assert table.get('d') is None
+    assert evicted == ['a', 'c', 'd']
+
+
+def test_peer_table_keeps_items():
+    from pseud.cache import PeerTable
+    clock = FakeClock()
+    evicted = []
+    connected = {'a'}
+    table = PeerTable(maxsize=2, ttl=5, clock=clock,
+                      on_evict=lambda key, value: evicted.append(key),
+                      keep=lambda key, value: key in connected)
+    table['a'] = 1
+    table['b'] = 2
+    table['c'] = 3
+    assert evicted == ['b']
+    assert list(table._data) == ['c', 'a']
+    clock.now = 6
+    table.expire()
+    assert evicted == ['b', 'c']
+    assert table.get('a') == 1
+    # more kept items than maxsize
+    connected.update('xyz')
+    for key in 'xyz':
+        table[key] = key
+    assert len(table) == 4
+    assert evicted == ['b', 'c']
+
+
+def test_peer_state_store_touch():
+    from pseud.cache import PeerStateStore
+    clock = FakeClock()
+    store = PeerStateStore(idle_timeout=5, clock=clock)
+    routes = store.table('routes')
+    routes[b'alice'] = b'routing-alice'
+    routes[b'bob'] = b'routing-bob'
+    clock.now = 4
+    store.touch(b'alice', b'routing-alice')
+    clock.now = 6
+    routes.expire()
+    assert list(routes._data) == [b'alice']
+
+
+def test_outbox_bounds():
+    from pseud.cache import Outbox
+    clock = FakeClock()
+    outbox = Outbox(maxsize_per_peer=2, maxsize=3, ttl=5, clock=clock)
+    assert outbox.put(b'alice', [b'alice', 1]) is not None
+    assert outbox.put(b'alice', [b'alice', 2]) is not None
+    assert outbox.put(b'alice', [b'alice', 3]) is None
+    assert outbox.put(b'bob', [b'bob', 1]) is not None
+    assert outbox.put(b'carol', [b'carol', 1]) is None
+    assert len(outbox) == 3
+    clock.now += 5
+    # expired messages make room
+    assert outbox.put(b'carol', [b'carol', 1]) is not None
+    assert b'alice' not in outbox
+    assert outbox.take(b'carol') == [[b'carol', 1]]
+    assert len(outbox) == 0
+    assert b'carol' in outbox
+    outbox.discard(b'carol')
+    assert b'carol' not in outbox
+
+
+def test_outbox_retry_delay():
+    from pseud.cache import Outbox
+    outbox = Outbox(delay=.001, max_delay=.004, clock=FakeClock())
+    held = outbox.put(b'alice', [b'alice', 1])
+    assert [outbox.next_delay(held) for _ in range(4)] == [
+        .001, .002, .004, .004]
+    outbox.take(b'alice')
+    assert outbox.put(b'alice', [b'alice', 2]) is held
+
+
+def test_outbox_retry_keeps_expiry():
+    from pseud.cache import Outbox
+    clock = FakeClock()
+    outbox = Outbox(ttl=5, clock=clock)
+    message = [b'alice', 1]
+    outbox.put(b'alice', message)
+    for now in range(1, 5):
+        clock.now = now
+        # sending again failed
+        assert outbox.take(b'alice') == [message]
+        outbox.put(b'alice', message)
+    clock.now = 5
+    assert outbox.take(b'alice') == []
+    outbox.discard(b'alice')
+    assert b'alice' not in outbox
+
+
+def test_outbox_discard_sent_message():
+    from pseud.cache import Outbox
+    outbox = Outbox(clock=FakeClock())
+    first, second = [b'alice', 1], [b'alice', 2]
+    outbox.put(b'alice', first)
+    outbox.put(b'alice', second)
+    outbox.take(b'alice')
+    outbox.discard(b'alice', first)
+    # second is still being sent
+    assert b'alice' in outbox
+    outbox.discard(b'alice', second)
+    assert b'alice' not in outbox
+
+
+def test_outbox_expire_retried_messages():
+    from pseud.cache import Outbox
+    clock = FakeClock()
+    outbox = Outbox(maxsize=2, ttl=5, clock=clock)
+    retried = [b'alice', 1]
+    outbox.put(b'alice', retried)
+    clock.now = 3
+    outbox.take(b'alice')
+    outbox.put(b'alice', [b'alice', 2])
+    # sending again failed, held after a newer message
+    outbox.put(b'alice', retried)
+    clock.now = 5
+    assert outbox.put(b'bob', [b'bob', 1]) is not None
+    assert len(outbox) == 2
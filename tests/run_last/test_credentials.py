@@ -0,0 +1,71 @@
+import os.path
+
+
+def make_one_store(tmpdir):
+    from pseud.credentials import SQLiteCredentialStore
+    store = SQLiteCredentialStore(os.path.join(str(tmpdir), 'auth.db'))
+    store.iterations = 10
+    return store
+
+
+def test_check_password(tmpdir):
+    store = make_one_store(tmpdir)
+    store.add_user('alice', 's3cret')
+    assert store.check_password(b'alice', b's3cret')
+    assert not store.check_password(b'alice', b'wrong')
+    assert not store.check_password(b'bob', b's3cret')
+    # answers are cached, without clear passwords
+    assert len(store.passwords) == 1
+    assert len(store.bad_passwords) == 2
+    assert b's3cret' not in b''.join(store.passwords._data)
+
+    store.add_user('alice', 'changed')
+    assert not store.check_password(b'alice', b's3cret')
+    assert store.check_password(b'alice', b'changed')
+    store.close()
+
+
+def test_negative_cache_expires(tmpdir):
+    from pseud.credentials import SQLiteCredentialStore
+    path = os.path.join(str(tmpdir), 'auth.db')
+    store = make_one_store(tmpdir)
+    other = SQLiteCredentialStore(path)
+    other.iterations = 10
+
+    assert not store.check_password(b'alice', b's3cret')
+    other.add_user('alice', 's3cret')
+    # not seen until negative answer expires
+    assert not store.check_password(b'alice', b's3cret')
+    clock = store.bad_passwords.clock
+    store.bad_passwords.clock = lambda: clock() + store.negative_ttl
+    assert store.check_password(b'alice', b's3cret')
+    store.close()
+    other.close()
+
+
+def test_public_keys(tmpdir):
+    store = make_one_store(tmpdir)
+    key = os.urandom(32)
+    assert store.get_login(key) is None
+    store.add_public_key(key, 'alice')
+    assert store.get_login(key) == 'alice'
+    store.remove_user('alice')
+    assert store.get_login(key) is None
+    store.close()
+
+
+def test_failures_are_limited_by_login(tmpdir):
+    store = make_one_store(tmpdir)
+    store.add_user('alice', 's3cret')
+    hashed = []
+    hash_ = store._hash
+    store._hash = lambda *args: hashed.append(args) or hash_(*args)
+    for attempt in range(store.max_failures + 3):
+        assert not store.check_password(b'alice', 'wrong{}'.format(attempt))
+    assert len(hashed) == store.max_failures
+    # even the right password, until the first failure expires
+    assert not store.check_password(b'alice', b's3cret')
+    clock = store.failures.clock
+    store.failures.clock = lambda: clock() + store.negative_ttl
+    assert store.check_password(b'alice', b's3cret')
+    store.close()
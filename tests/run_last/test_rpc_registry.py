@@ -101,3 +101,43 @@ def test_registration_with_custom_registry():
     assert get_rpc_callable('try_to_call_me')() == 'global'
     assert get_rpc_callable('try_to_call_me',
                             registry=local_registry)() == 'local'
+
+
+def test_route_index_follows_registry_changes():
+    from pseud.utils import (create_local_registry,
+                             get_route_index,
+                             get_rpc_callable,
+                             register_rpc,
+                             )
+    from pseud.interfaces import IRPCRoute
+
+    local_registry = create_local_registry('route_index')
+
+    @register_rpc(name='indexed.route')
+    def callme():
+        return 'global'
+
+    assert get_rpc_callable('indexed.route',
+                            registry=local_registry)() == 'global'
+
+    @register_rpc(name='indexed.route', domain='restricted')
+    def callme_admin(user=None):
+        return 'great power'
+
+    # changes from the global registry reach local registries
+    assert [rpc_call.domain for rpc_call in
+            get_route_index(local_registry)['indexed.route']] == [
+        'restricted', 'default']
+
+    @register_rpc(name='indexed.route', registry=local_registry)
+    def callme_local():
+        return 'local'
+
+    assert get_rpc_callable('indexed.route',
+                            registry=local_registry)() == 'local'
+    assert get_rpc_callable('indexed.route')() == 'global'
+
+    local_registry.unregisterUtility(
+        provided=IRPCRoute, name='indexed.route:default')
+    assert get_rpc_callable('indexed.route',
+                            registry=local_registry)() == 'global'
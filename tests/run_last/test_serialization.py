@@ -71,3 +71,129 @@ def test_packer_translation():
 
     dumb_packer = Packer()
     dumb_packer.unpackb(packer.packb(A('')))
+
+
+def test_datetime_native_codecs():
+    from dateutil.tz import tzoffset
+    from pseud.packer import Packer
+    packer = Packer()
+
+    naive = datetime.datetime(1903, 9, 27, 9, 40, 1, 521290)
+    aware = datetime.datetime(2003, 9, 27, 9, 40, 1, 521290,
+                              tzinfo=tzoffset(None, -5400))
+    for value in (naive, aware, datetime.date(2003, 9, 27),
+                  datetime.timedelta(days=-3, seconds=5, microseconds=7)):
+        result = packer.unpackb(packer.packb(value))
+        assert result == value
+        assert type(result) is type(value)
+    assert packer.unpackb(packer.packb(naive)).tzinfo is None
+    assert packer.unpackb(packer.packb(aware)).utcoffset() == (
+        aware.utcoffset())
+    # ext 8 with 12 bytes of data for datetime, fixext 4 for date
+    assert len(packer.packb(aware)) == 15
+    assert len(packer.packb(datetime.date(2003, 9, 27))) == 6
+
+
+def test_datetime_legacy_pickle_codes():
+    import pickle
+    import msgpack
+    from pseud.packer import Packer
+
+    date = datetime.datetime(2003, 9, 27, 9, 40, 1, 521290,
+                             tzinfo=tzlocal())
+    legacy = msgpack.packb(msgpack.ExtType(125, pickle.dumps(date)))
+    assert Packer().unpackb(legacy) == date
+
+
+def test_packer_out_of_band_buffers():
+    from pseud.packer import Packer
+    packer = Packer(out_of_band_threshold=4)
+    buffers = []
+    mark = packer.mark_out_of_band
+    packed = packer.packb((mark(b'large value'), mark(b'abc')), buffers)
+    assert buffers == [b'large value']
+    assert b'large value' not in packed
+    large, small = packer.unpackb(packed, buffers)
+    assert isinstance(large, memoryview)
+    assert large.tobytes() == b'large value'
+    assert small == b'abc'
+
+    # mutable buffers are copied, changes made after packing are not sent
+    value = bytearray(b'mutable value')
+    buffers = []
+    packer.packb(mark(value), buffers)
+    value[:] = b'changed value'
+    assert buffers == [b'mutable value']
+
+    # without frames to carry them, marked values can not be packed
+    with pytest.raises(ValueError):
+        packer.packb(mark(b'large value'))
+
+
+def test_packer_ndarray():
+    numpy = pytest.importorskip('numpy')
+    from pseud.packer import Packer
+    packer = Packer(out_of_band_threshold=64)
+
+    small = numpy.arange(6, dtype='<i4').reshape(2, 3)
+    result = packer.unpackb(packer.packb(small))
+    assert result.dtype == small.dtype
+    assert (result == small).all()
+
+    large = numpy.arange(100, dtype='>f8')[::2]
+    buffers = []
+    packed = packer.packb({'array': large}, buffers)
+    assert len(buffers) == 1
+    assert len(packed) < large.nbytes
+    result = packer.unpackb(packed, buffers)['array']
+    assert result.dtype == large.dtype
+    assert (result == large).all()
+    # rebuilt on top of the received buffer
+    assert not result.flags.owndata
+
+    # writable arrays are copied once, read-only ones are not
+    writable = numpy.arange(100, dtype='<f8')
+    buffers = []
+    packer.packb(writable, buffers)
+    assert isinstance(buffers[0], bytes)
+    writable.flags.writeable = False
+    buffers = []
+    packer.packb(writable, buffers)
+    assert buffers[0] is writable
+
+    with pytest.raises(TypeError):
+        packer.packb(numpy.array([object()]))
+
+
+def test_packer_compression():
+    from pseud.packer import COMPRESSED, Packer
+    packer = Packer(compression='zlib', compression_threshold=100)
+    small = 'x' * 10
+    large = ['abcd'] * 1000
+
+    assert packer.packb(small) == Packer().packb(small)
+    packed = packer.packb(large)
+    assert packed.startswith(COMPRESSED)
+    assert len(packed) < len(Packer().packb(large))
+    # receivers decompress whatever their own configuration
+    assert Packer().unpackb(packed) == tuple(large)
+    assert Packer().unpackb(memoryview(packed)) == tuple(large)
+    # decompression bombs are refused
+    with pytest.raises(ValueError):
+        Packer(max_decompressed_size=100).unpackb(packed)
+
+    with pytest.raises(KeyError):
+        Packer(compression='unknown')
+
+
+def test_serializer_negotiation():
+    from pseud import SyncClient
+    from pseud.interfaces import VERSION
+
+    client = SyncClient(serializer='json',
+                        accepted_serializers=('json', 'msgpack'))
+    assert client.version == VERSION + b'/json'
+    assert client.packer.unpackb(client.packer.packb([1, 'a'])) == [1, 'a']
+    assert client._get_serializer(VERSION).name == 'msgpack'
+    assert client._get_serializer(VERSION + b'/pickle') is None
+    assert client._get_serializer(b'v0') is None
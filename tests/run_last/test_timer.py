@@ -0,0 +1,39 @@
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_timer_wheel_expires_by_batches():
+    from pseud.timer import TimerWheel
+    clock = FakeClock()
+    wheel = TimerWheel(resolution=1, slots=4, clock=clock)
+    wheel.add(b'a', 1)
+    wheel.add(b'b', 1.5)
+    wheel.add(b'c', 3)
+    assert len(wheel) == 3
+    assert wheel.advance() == []
+    clock.now = 1.2
+    assert wheel.advance() == [b'a']
+    clock.now = 2
+    assert wheel.advance() == [b'b']
+    wheel.discard(b'c')
+    wheel.discard(b'c')
+    clock.now = 10
+    assert wheel.advance() == []
+    assert not len(wheel)
+
+
+def test_timer_wheel_goes_round():
+    from pseud.timer import TimerWheel
+    clock = FakeClock()
+    wheel = TimerWheel(resolution=1, slots=4, clock=clock)
+    wheel.add(b'far', 9)
+    for now in range(1, 9):
+        clock.now = now
+        assert wheel.advance() == []
+    assert b'far' in wheel
+    clock.now = 9
+    assert wheel.advance() == [b'far']
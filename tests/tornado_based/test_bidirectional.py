@@ -55,6 +55,195 @@ class ClientTestCase(tornado.testing.AsyncTestCase):
         client.stop()
         server.stop()
 
+    @tornado.testing.gen_test
+    def test_large_binary_sent_out_of_band(self):
+        server_id = b'server'
+        endpoint = b'inproc://here'
+
+        server = self.make_one_server(server_id)
+        client = self.make_one_client(server_id)
+
+        @server.register_rpc
+        def measure(blob):
+            assert isinstance(blob, memoryview)
+            return blob.tobytes()[:3], len(blob)
+
+        @server.register_rpc
+        def blob(size):
+            return b'y' * size
+
+        server.bind(endpoint)
+        yield server.start()
+
+        client.connect(endpoint)
+        yield client.start()
+
+        size = server.packer.out_of_band_threshold
+        result = yield client.measure(b'x' * size)
+        assert result == (b'xxx', size)
+        result = yield client.blob(size)
+        assert result.tobytes() == b'y' * size
+        client.stop()
+        server.stop()
+
+    @tornado.testing.gen_test
+    def test_serializer_announced_by_client(self):
+        from pseud import Client, Server
+        server_id = b'server'
+        endpoint = b'inproc://here'
+
+        server = Server(server_id, security_plugin='noop_auth_backend',
+                        accepted_serializers=('msgpack', 'json'),
+                        io_loop=self.io_loop)
+        client = Client(server_id, security_plugin='noop_auth_backend',
+                        serializer='json', io_loop=self.io_loop)
+
+        @server.register_rpc
+        def echo(value):
+            return value
+
+        server.bind(endpoint)
+        yield server.start()
+
+        client.connect(endpoint)
+        yield client.start()
+
+        result = yield client.echo((1, 'a'))
+        assert result == [1, 'a']
+        client.stop()
+        server.stop()
+
+    @tornado.testing.gen_test
+    def test_pending_calls_fail_when_server_disconnects(self):
+        from pseud._tornado import async_sleep
+        from pseud.interfaces import PeerDisconnectedError
+        server_id = b'server'
+        endpoint = b'tcp://127.0.0.1:5002'
+
+        server = self.make_one_server(server_id)
+        client = self.make_one_client(server_id)
+
+        @server.register_rpc
+        def fast():
+            return True
+
+        @server.register_rpc
+        def slow():
+            return async_sleep(self.io_loop, 5)
+
+        server.bind(endpoint)
+        yield server.start()
+
+        client.connect(endpoint)
+        yield client.start()
+
+        result = yield client.fast()
+        assert result is True
+        future = client.slow()
+        yield async_sleep(self.io_loop, .1)
+        server.stop()
+        with pytest.raises(PeerDisconnectedError):
+            yield future
+        assert not client.future_pool
+        assert not client.peer_calls
+        assert not len(client.timers)
+        client.stop()
+
+    @tornado.testing.gen_test
+    def test_calls_held_until_server_is_reachable(self):
+        from pseud._tornado import async_sleep
+        server_id = b'server'
+        endpoint = b'tcp://127.0.0.1:5003'
+
+        server = self.make_one_server(server_id)
+        client = self.make_one_client(server_id)
+
+        @server.register_rpc
+        def fast():
+            return True
+
+        client.connect(endpoint)
+        yield client.start()
+        future = client.fast()
+        yield async_sleep(self.io_loop, .5)
+        # without any writable peer the stream keeps the message queued,
+        # else it is held in the outbox
+        assert not future.done()
+
+        server.bind(endpoint)
+        yield server.start()
+        result = yield future
+        assert result is True
+        assert not len(client.outbox)
+        client.stop()
+        server.stop()
+
+    @tornado.testing.gen_test
+    def test_timed_out_job_is_cancelled(self):
+        from pseud import Client
+        from pseud._tornado import async_sleep
+        server_id = b'server'
+        endpoint = b'inproc://here'
+
+        server = self.make_one_server(server_id)
+        client = Client(server_id, timeout=.2, send_cancels=True,
+                        io_loop=self.io_loop)
+        done = []
+
+        @server.register_rpc
+        @tornado.gen.coroutine
+        def slow():
+            yield async_sleep(self.io_loop, .6)
+            done.append(True)
+
+        server.bind(endpoint)
+        yield server.start()
+
+        client.connect(endpoint)
+        yield client.start()
+
+        future = client.slow()
+        with pytest.raises(TimeoutError):
+            yield future
+        yield async_sleep(self.io_loop, .1)
+        assert not server.running_jobs
+        # the job runs to completion, its reply is dropped
+        yield async_sleep(self.io_loop, .5)
+        assert done
+        client.stop()
+        server.stop()
+
+    @tornado.testing.gen_test
+    def test_batch_resolves_each_call(self):
+        from pseud import Server
+        from pseud.interfaces import ServiceNotFoundError
+        server_id = b'server'
+        endpoint = b'inproc://here'
+
+        server = Server(server_id, concurrent_batches=True,
+                        io_loop=self.io_loop)
+        client = self.make_one_client(server_id)
+
+        server.register_rpc(name='str.lower')(str.lower)
+
+        server.bind(endpoint)
+        yield server.start()
+
+        client.connect(endpoint)
+        yield client.start()
+
+        with client.batch() as batch:
+            first = batch.str.lower('A')
+            missing = batch.str.doesnotexists('B')
+            second = batch.str.lower('C')
+        result = yield [first, second]
+        assert result == ['a', 'c']
+        with pytest.raises(ServiceNotFoundError):
+            yield missing
+        assert not client.future_pool
+        client.stop()
+        server.stop()
+
     @tornado.testing.gen_test
     def test_server_can_send(self):
         from pseud.utils import register_rpc
@@ -70,6 +70,42 @@ def test_server_with_its_loop_instance():
     assert result == 'toto'
 
 
+def test_server_caches_predicate_decisions():
+    import zope.component
+    import zope.interface
+    from pseud import Server
+    from pseud.interfaces import IPredicate, IRPCCallable
+    from pseud.utils import register_predicate
+
+    calls = []
+
+    @register_predicate
+    @zope.interface.implementer(IPredicate)
+    @zope.component.adapter(IRPCCallable)
+    class CountingPredicate(object):
+        name = 'counted'
+
+        def __init__(self, rpc_call):
+            self.rpc_call = rpc_call
+
+        def test(self, *args, **kw):
+            calls.append(self.rpc_call.name)
+            return True
+
+    server = Server(b'echo', predicate_cache_size=10)
+
+    @server.register_rpc(domain='counted')
+    def counted_job():
+        return True
+
+    assert server._get_rpc_callable('counted_job', b'alice')()
+    assert server._get_rpc_callable('counted_job', b'alice')()
+    assert calls == ['counted_job']
+    server.invalidate_predicates(b'alice')
+    assert server._get_rpc_callable('counted_job', b'alice')()
+    assert calls == ['counted_job', 'counted_job']
+
+
 class ServerTestCase(tornado.testing.AsyncTestCase):
 
     timeout = 2
@@ -165,3 +201,47 @@ class ServerTestCase(tornado.testing.AsyncTestCase):
         assert message == 'too bad'
         assert __file__ in traceback
         server.stop()
+
+    @tornado.testing.gen_test
+    def test_job_running_with_frozen_routes(self):
+        from pseud.interfaces import ERROR, OK, VERSION, WORK
+        from pseud.packer import Packer
+
+        user_id = b'echo'
+        endpoint = 'inproc://{}'.format(self.__class__.__name__).encode()
+        server = self.make_one_server(user_id, endpoint)
+
+        @server.register_rpc
+        def frozen_job():
+            return True
+
+        server.freeze_routes()
+
+        @server.register_rpc
+        def late_job():
+            return True
+
+        socket = self.make_one_client_socket(endpoint)
+        stream = zmqstream.ZMQStream(socket, io_loop=self.io_loop)
+        yield server.start()
+        yield tornado.gen.Task(stream.send_multipart,
+                               [user_id, b'', VERSION, b'', WORK,
+                                Packer().packb(('frozen_job', (), {}))])
+        response = yield tornado.gen.Task(stream.on_recv)
+        assert response == [user_id, b'', VERSION, b'', OK,
+                            Packer().packb(True)]
+
+        yield tornado.gen.Task(stream.send_multipart,
+                               [user_id, b'', VERSION, b'', WORK,
+                                Packer().packb(('late_job', (), {}))])
+        response = yield tornado.gen.Task(stream.on_recv)
+        assert response[:-1] == [user_id, b'', VERSION, b'', ERROR]
+
+        server.freeze_routes()
+        yield tornado.gen.Task(stream.send_multipart,
+                               [user_id, b'', VERSION, b'', WORK,
+                                Packer().packb(('late_job', (), {}))])
+        response = yield tornado.gen.Task(stream.on_recv)
+        assert response == [user_id, b'', VERSION, b'', OK,
+                            Packer().packb(True)]
+        server.stop()